@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools aggregate`, the code lives in covidtools/aggregate_labels.py
+
+import sys
+from covidtools.aggregate_labels import main
+
+if __name__ == '__main__':
+    sys.exit(main())
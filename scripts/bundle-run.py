@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools bundle`, the code lives in covidtools/bundle_run.py
+
+import sys
+from covidtools.bundle_run import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools compare`, the code lives in covidtools/compare_outputs.py
+
+import sys
+from covidtools.compare_outputs import main
+
+if __name__ == '__main__':
+    sys.exit(main())
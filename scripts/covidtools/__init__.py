@@ -0,0 +1,43 @@
+"""Command line tools for the covid pipeline, one subcommand per former script.
+
+Subcommand modules are imported only when their command runs, so heavy
+dependencies (numpy, scipy, sqlite3, yaml) never slow down the small tools
+the shell wrappers call once per sample.
+"""
+
+# command: (module, script shim, description)
+COMMANDS = {
+    'out2tab': ('out2tab', 'out2spreadsheet.py', 'Demix .out files as one summary line each'),
+    'out2location': ('out2location', 'out2location2spreadsheet.py', 'Demix .out file with date and location from the file name'),
+    'sort-aggregate': ('sort_aggregate', 'sortAggregate.py', 'Join wrapped lines of a freyja aggregate TSV'),
+    'update-mapping': ('update_mapping', 'update-sample-mapping.py', 'Add coverage and demix results to the sample mapping'),
+    'merge': ('merge', 'merge.py', 'Add columns from spreadsheet a to spreadsheet b by key'),
+    'link-labels': ('link_labels', 'samples2aggregates.py', 'Hardlink outputs into aggregate trees by site labels'),
+    'link-patterns': ('link_patterns', 'labels2aggregates.py', 'Hardlink outputs into aggregate trees by ID pattern'),
+    'stage-bams': ('stage_bams', 'staging2bam.py', 'Hardlink bams into bam/ with collection date prefix'),
+    'bam2samples': ('bam2samples', 'bam2samples.py', 'Hardlink bams with collection date prefix'),
+    'check-mapping': ('check_mapping', 'check-text-file.py', 'Check mapping files for encoding, columns and duplicate IDs'),
+    # former name of check-mapping, kept for existing invocations
+    'check-text': ('check_mapping', 'check-text-file.py', 'Same as check-mapping'),
+    'stage-reads': ('stage_reads', 'stage-reads.py', 'Stage fastq and mapping files into a run folder'),
+    'sync': ('sync_run', 'sync-run.py', 'Delta transfer of run files to or from another host'),
+    'run2idph': ('run2idph', 'run2idph', 'Export fastq pairs of a run to IDPH, minus blacklisted sites'),
+    'sra-submit': ('sra_submit', 'sra-submit.py', 'Build SRA metadata and upload fastqs in parallel, resumable'),
+    'fingerprint': ('fingerprint', 'fingerprint.py', 'Cached md5 fingerprints of containers and reference files'),
+    'ledger': ('provenance_ledger', 'provenance-ledger.py', 'Append-only provenance ledger per run, queried across runs'),
+    'depth-cache': ('depth_cache', 'depth-cache.py', 'Memory-mapped binary cache of per sample depth files'),
+    'qc-gate': ('qc_gate', 'qc-gate.py', 'Coverage gate before demix, placeholder outputs for failed samples'),
+    'mutations': ('mutation_matrix', 'mutation-matrix.py', 'Sparse mutation x sample matrix across runs'),
+    'work-queue': ('work_queue', 'work-queue.py', 'Shared per sample work queue for workers on several hosts'),
+    'smooth': ('smooth_prevalence', 'smooth-prevalence.py', 'Rolling window lineage prevalence per site and label group'),
+    'bundle': ('bundle_run', 'bundle-run.py', 'Pack per run result files into one indexed bundle'),
+    'tiles': ('weekly_tiles', 'weekly-tiles.py', 'Weekly lineage rollups per label dimension as JSON tiles'),
+    'aggregate': ('aggregate_labels', 'aggregate-labels.py', 'Aggregate tables and plots for all labels of the label dimensions'),
+    'time-stage': ('time_stage', 'time-stage.py', 'Run a command and record its resource usage'),
+    'timing-report': ('timing_report', 'timing-report.py', 'Summarize stage timing logs'),
+    'watch': ('watch_runs', 'watch-runs.py', 'Process new sequencing runs as they land'),
+    'results-db': ('results_db', 'results-db.py', 'SQLite results database across runs'),
+    'rollup': ('rollup_lineages', 'rollup-lineages.py', 'Roll up demix abundances to parent clades'),
+    'compare': ('compare_outputs', 'compare-outputs.py', 'Compare freyja outputs across output trees'),
+    'reconcile': ('reconcile_aggregates', 'reconcile-aggregates.py', 'Add, replace and remove links in aggregate trees'),
+}
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# python3 scripts/covidtools <command> puts this directory first on sys.path,
+# lib/ and the covidtools package live one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from covidtools.cli import main  # noqa: E402
+
+sys.exit(main())
@@ -0,0 +1,122 @@
+# Author: Andreas Wilke
+
+# Aggregate tables and plots for every label of the label dimensions under
+# aggregate/testing (City, County, Region, ...), the work of
+# process_testing_group.sh for all dimensions in one process. Every demix
+# output is parsed once, hardlinks of the same output in many labels share
+# the parse, and the per label tables (<label>.aggregate.tsv, .line.tsv,
+# .line.filtered.tsv, .line.sorted.tsv, as freyja aggregate, sortAggregate.py,
+# fgrep -v "[]" and sort -n made them) and the freyja plots are produced by
+# a pool of --jobs workers. Prints the time spent per dimension and exits 1
+# if a dimension or label failed.
+#
+#   aggregate-labels.py aggregate/testing --jobs 8
+#   aggregate-labels.py aggregate/testing --dimensions City Region --no-plot
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lib.aggregate import label_dirs, out_files, parse_once, write_label
+
+FREYJA = "/local/incoming/covid/config/freyja_1.3.2.sif"
+BIND = "/local/incoming/covid/"
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Aggregate tables and plots for all labels of the label dimensions.')
+    parser.add_argument('root', help='Directory with one directory per dimension, e.g. aggregate/testing')
+    parser.add_argument('--dimensions', '-d', dest='dimensions', nargs='+', default=None,
+                        help='Dimensions to process, default all directories under root')
+    parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=4, help='Parallel workers, default 4')
+    parser.add_argument('--no-plot', dest='plot', default=True, action='store_false',
+                        help='Tables only, skip freyja plot')
+    parser.add_argument('--freyja', dest='freyja', default=FREYJA, help='Freyja container for plotting')
+    parser.add_argument('--bind', dest='bind', default=BIND, help='Path bound into the container')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def plot(args, table, pdf, lineages=False) -> bool:
+    cmd = ["singularity", "run", "--bind", args.bind, args.freyja, "freyja", "plot", table] + \
+          (["--lineages"] if lineages else []) + ["--output", pdf]
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    except OSError as e:
+        logging.error("%s: %s", pdf, e)
+        return False
+    if p.returncode != 0:
+        logging.error("%s: freyja plot exited with %d\n%s", pdf, p.returncode, p.stdout.strip())
+    return p.returncode == 0
+
+
+def process_label(args, label_dir, files, parsed) -> bool:
+    rows = []
+    ok = True
+    for path in files:
+        if parsed[path] is None:
+            logging.error("%s: not readable", path)
+            ok = False
+            continue
+        rows.append(parsed[path])
+    tables = write_label(label_dir, rows)
+    if args.plot:
+        base = tables['aggregate'][:-len(".tsv")]
+        ok = plot(args, tables['sorted'], base + ".pdf") and ok
+        ok = plot(args, tables['sorted'], base + ".lineages.pdf", lineages=True) and ok
+    logging.debug("%s: %d outputs", label_dir, len(rows))
+    return ok
+
+
+def run(args):
+
+    if not os.path.isdir(args.root):
+        sys.exit("Not a directory: " + args.root)
+
+    dimensions = label_dirs(args.root, args.dimensions)
+    files = {}
+    for dimension, labels in dimensions.items():
+        if not labels:
+            logging.error("%s: no labels in %s", dimension, os.path.join(args.root, dimension))
+        for label_dir in labels:
+            files[label_dir] = out_files(label_dir)
+
+    start = time.time()
+    parsed = parse_once([p for paths in files.values() for p in paths], jobs=args.jobs)
+    logging.info("%d label files parsed in %.1fs", len(parsed), time.time() - start)
+
+    def task(label_dir):
+        t = time.time()
+        try:
+            ok = process_label(args, label_dir, files[label_dir], parsed)
+        except OSError as e:
+            logging.error("%s: %s", label_dir, e)
+            ok = False
+        return ok, time.time() - t
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = {label_dir: pool.submit(task, label_dir) for label_dir in files}
+
+    failed = 0
+    print("\t".join(["dimension", "labels", "outputs", "seconds", "failed"]))
+    for dimension, labels in dimensions.items():
+        done = [results[l].result() for l in labels]
+        errors = sum(1 for ok, seconds in done if not ok) + (0 if labels else 1)
+        failed += errors
+        print("\t".join([dimension, str(len(labels)), str(sum(len(files[l]) for l in labels)),
+                         "%.2f" % sum(seconds for ok, seconds in done), str(errors)]))
+    logging.info("%d dimensions in %.1fs, %d failed", len(dimensions), time.time() - start, failed)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
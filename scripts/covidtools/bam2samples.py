@@ -0,0 +1,112 @@
+# Author: Andreas Wilke
+
+# Hardlink bams into a directory with the collection date as prefix
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+from lib.mapping import Mapping
+
+
+def find_samples(pattern=None , categories= {} , src=None , dest="/local/incoming/covid/aggregates/location/") :
+    destination = None
+    if not dest:
+        destination=Path("/local/incoming/covid/aggregates/location/")
+    else:
+        destination=Path(dest)
+    if not pattern :
+        print("Missing pattern")
+        sys.exit(0)
+    else :
+        print("Searching in " + src + " for " + pattern)
+    
+    date =re.compile("^(\d+)/(\d+)/(\d+)")
+    res = date.match(categories['date'])
+    
+    if res is None :
+        print("No date, skipping " + pattern)
+        return
+    
+
+    prefix="".join([res[3],res[1] if int(res[1]) > 9 else  "0" + res[1], res[2] if int(res[2]) > 9 else "0" + res[2] ])
+    print(res[0] , prefix )
+    
+    for path in Path(src).rglob(pattern + '*.out'):
+        print(path.name , path.parts)    
+        src = path.joinpath()
+        
+        for c in categories['columns'] :
+           
+            target_dir = destination.joinpath(c['header'] , c['group'])
+            print(c['header'] , c['group'], pattern, target_dir) 
+            
+            if not target_dir.is_dir() :
+                Path.mkdir(target_dir, exist_ok=True , parents=True)
+            
+           
+            # get date right - easier to sort later
+            
+      
+      
+            
+            
+            
+            target = os.path.join(target_dir , ".".join([prefix,path.name]))
+            
+            if not os.path.exists(target) :
+                os.link(src ,target)
+                pass
+            else :
+                print("Target " + target + " exists, skipping")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mapping-file', '-m' , dest='mapping_file')
+    parser.add_argument('--source-dir', '-s' , dest='source')
+    parser.add_argument('--destination-dir', '-d' , dest='destination')
+    parser.add_argument('--legacy-sample-ids', '-l' , dest='legacy' , default=False)
+    parser.add_argument('--sites2labes', dest='sites_file')
+    args = parser.parse_args(argv)
+
+    # main
+    mapping = Mapping()
+    suffix = ""
+    if args.legacy:
+        mapping.legacy = True
+        suffix=".sorted.bam"
+
+    print(args.destination)
+    if not args.destination or not os.path.isdir(args.destination):
+        sys.exit("No destination directory " + str(args.destination))
+
+    if os.path.isfile(args.mapping_file) :
+        mapping.load(args.mapping_file)
+
+        result = mapping.resolve(mapping.get_files(args.source), suffix=suffix)
+        linked = 0
+        existing = 0
+        for f, Id, date, site in result['samples']:
+            if not date:
+                continue
+            fname = ".".join([date, os.path.basename(f)])
+            src = os.path.abspath(f)
+            target = os.path.abspath(os.path.join(args.destination, fname))
+            if not os.path.isfile(target):
+                os.link( src, target )
+                linked += 1
+            else:
+                existing += 1
+
+        print("Linked " + str(linked) + " files, " + str(existing) + " already in " + args.destination)
+        mapping.report(result)
+
+        # print(mapping.get_files(args.source))
+        sys.exit()
+        for k in result['values'] :
+            find_samples(pattern=k , categories=result['values'][k] , src=args.source , dest=args.destination)
+        # data2tab(result , metadata=m)
+    else :
+        print("No such file " + args.mapping_file)
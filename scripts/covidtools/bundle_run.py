@@ -0,0 +1,112 @@
+# Author: Andreas Wilke
+
+# Pack the small result files of a finished run (output/*.out, *.version,
+# *.freyja_version, variants/*.variants.tsv, depth/*.depth) into a single
+# results.bundle in the run directory: a header with the index of member
+# offsets, then the members. The parsers in scripts/ read a file from the
+# bundle when it is not on disk, so with --remove an archive-wide scan opens
+# one file per run instead of one per sample file. A re-pack keeps members
+# whose loose file is gone and takes new loose files; unpack restores the
+# loose files, e.g. before a recompute.
+#
+#   bundle-run.py pack runs/220407 --remove
+#   bundle-run.py pack /local/incoming/covid/runs/*/ --remove --min-age 30
+#   bundle-run.py list runs/220407
+#   bundle-run.py cat runs/220407 output/22501_S53.out
+#   bundle-run.py unpack runs/220407
+
+import argparse
+import logging
+import os
+import sys
+import time
+from lib.bundle import BUNDLE, Bundle, pack, unpack
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Pack per run result files into one indexed bundle.')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('pack', help='Create or refresh the bundle of runs')
+    add.add_argument('runs', nargs='+', help='Run directories')
+    add.add_argument('--remove', dest='remove', default=False, action='store_true',
+                     help='Delete the loose files once they are in the verified bundle')
+    add.add_argument('--min-age', dest='min_age', type=float, default=0,
+                     help='Only runs whose newest output is at least this many days old')
+
+    ls = commands.add_parser('list', help='Members with size and mtime')
+    ls.add_argument('run_dir')
+
+    cat = commands.add_parser('cat', help='Write members to stdout')
+    cat.add_argument('run_dir')
+    cat.add_argument('members', nargs='+', help='Paths relative to the run directory')
+
+    check = commands.add_parser('verify', help='Check member checksums, exit 1 on errors')
+    check.add_argument('runs', nargs='+')
+
+    restore = commands.add_parser('unpack', help='Restore loose files and remove the bundle')
+    restore.add_argument('run_dir')
+    restore.add_argument('--keep', dest='keep', default=False, action='store_true', help='Keep the bundle')
+    return parser.parse_args(argv)
+
+
+def newest_output(run_dir) -> float:
+    output = os.path.join(run_dir, "output")
+    if not os.path.isdir(output):
+        return 0
+    return max([os.stat(os.path.join(output, n)).st_mtime for n in os.listdir(output)] or [0])
+
+
+def run(args):
+
+    if args.command == 'pack':
+        for run_dir in args.runs:
+            if args.min_age and time.time() - newest_output(run_dir) < args.min_age * 86400:
+                logging.info("%s: outputs newer than %s days, skipped", run_dir, args.min_age)
+                continue
+            stats = pack(run_dir, remove=args.remove)
+            logging.info("%s: %d files packed, %d members kept, %d bytes, %d loose files removed", run_dir,
+                         stats['packed'], stats['carried'], stats['bytes'], stats['removed'])
+        return 0
+
+    if args.command == 'verify':
+        bad = 0
+        for run_dir in args.runs:
+            with Bundle(os.path.join(run_dir, BUNDLE)) as b:
+                errors = b.verify()
+            for name in errors:
+                print("\t".join([run_dir, name]))
+            logging.info("%s: %d members, %d bad", run_dir, len(b), len(errors))
+            bad += len(errors)
+        return 1 if bad else 0
+
+    if args.command == 'unpack':
+        restored = unpack(args.run_dir, keep=args.keep)
+        logging.info("%s: %d files restored", args.run_dir, restored)
+        return 0
+
+    with Bundle(os.path.join(args.run_dir, BUNDLE)) as b:
+        if args.command == 'list':
+            print("\t".join(["member", "size", "mtime"]))
+            for name in b.names():
+                s = b.stat(name)
+                print("\t".join([name, str(s.st_size), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s.st_mtime))]))
+            return 0
+        for name in args.members:
+            if name not in b:
+                logging.error("%s not in %s", name, b.path)
+                return 1
+            sys.stdout.buffer.write(b.read(name))
+        sys.stdout.flush()
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
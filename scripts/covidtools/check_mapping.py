@@ -0,0 +1,81 @@
+# Author: Andreas Wilke
+
+# Pre-flight check for sample mapping files. Scans the raw bytes and reports
+# invalid UTF-8 and non-ASCII characters with line:column, rows whose column
+# count differs from the header, rows Mapping.load() would skip and duplicate
+# sample IDs. Exits 1 on errors (invalid UTF-8, column counts, duplicate IDs),
+# with --strict also on warnings. --fix writes a normalized UTF-8 copy.
+#
+#   check-text-file.py all.sample-mapping.tsv
+#   check-text-file.py 220407.sample-mapping.tsv --fix 220407.sample-mapping.fixed.tsv
+
+import argparse
+import json
+import sys
+from lib.textcheck import Scanner, normalize
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Check sample mapping files for encoding and structure problems.')
+    parser.add_argument('files', nargs='*', help='Mapping files')
+    parser.add_argument('--file', '-f', dest='file', default=None, help='Mapping file, same as positional')
+    parser.add_argument('--fix', dest='fix', default=None,
+                        help='Write a normalized copy: UTF-8, NFC, LF line endings, no BOM, rows at header width')
+    parser.add_argument('--ascii', dest='ascii', default=False, action='store_true',
+                        help='With --fix, transliterate to ASCII')
+    parser.add_argument('--strict', dest='strict', default=False, action='store_true',
+                        help='Treat warnings as errors')
+    parser.add_argument('--limit', dest='limit', type=int, default=50,
+                        help='Issues reported per kind')
+    parser.add_argument('--json', dest='json', default=False, action='store_true',
+                        help='Print issues as JSON')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    files = args.files + ([args.file] if args.file else [])
+    if not files:
+        sys.exit("No mapping file")
+    if args.fix and len(files) != 1:
+        sys.exit("--fix needs exactly one mapping file")
+
+    failed = False
+    report = {}
+    for path in files:
+        try:
+            scanner = Scanner(limit=args.limit).scan(path)
+        except OSError as e:
+            sys.stderr.write("Can not read " + path + ": " + str(e) + "\n")
+            failed = True
+            continue
+
+        summary = scanner.summary()
+        warnings = sum(summary['counts'].values()) - summary['errors']
+        if summary['errors'] or (args.strict and warnings):
+            failed = True
+
+        if args.json:
+            report[path] = dict(summary, issues=[i.as_dict() for i in scanner.issues])
+        else:
+            for issue in scanner.issues:
+                print(path + "\t" + str(issue))
+            shown = ", ".join("{} {}".format(n, k) for k, n in sorted(summary['counts'].items()))
+            sys.stderr.write("{}: {} lines ({} CRLF), {} columns, {} sample IDs, {} errors{}\n".format(
+                path, summary['lines'], summary['crlf'], summary['columns'], summary['ids'], summary['errors'],
+                " (" + shown + ")" if shown else ""))
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+
+    if args.fix:
+        rows = normalize(files[0], args.fix, ascii=args.ascii)
+        sys.stderr.write("Wrote " + str(rows) + " lines to " + args.fix + "\n")
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    return run(CLI(argv))
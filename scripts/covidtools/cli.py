@@ -0,0 +1,102 @@
+import importlib
+import os
+import subprocess
+import sys
+import time
+from covidtools import COMMANDS
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USAGE = """usage: covidtools <command> [options]
+       covidtools --benchmark-startup [--repeats N] [--max-ms MS] [command ...]
+
+commands:
+"""
+
+
+def usage(stream=sys.stdout):
+    stream.write(USAGE)
+    for name in sorted(COMMANDS):
+        stream.write("  {:<16}{}\n".format(name, COMMANDS[name][2]))
+
+
+def _best(cmd, repeats) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=SCRIPTS)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def benchmark_startup(argv) -> int:
+    """Import time and process startup per subcommand, best of --repeats fresh interpreters"""
+
+    repeats = 5
+    max_ms = None
+    names = []
+    args = list(argv)
+    while args:
+        a = args.pop(0)
+        if a == "--repeats":
+            repeats = int(args.pop(0))
+        elif a == "--max-ms":
+            max_ms = float(args.pop(0))
+        else:
+            names.append(a)
+    unknown = [n for n in names if n not in COMMANDS]
+    if unknown:
+        sys.stderr.write("Unknown command " + ", ".join(unknown) + "\n")
+        return 2
+
+    python = _best([sys.executable, "-c", "pass"], repeats)
+    print("\t".join(["command", "import_ms", "startup_ms"]))
+    print("\t".join(["(python)", "0.0", "{:.1f}".format(python)]))
+    slow = []
+    for name in names or sorted(COMMANDS):
+        module = "covidtools." + COMMANDS[name][0]
+        probe = ("import time; t = time.perf_counter(); import " + module +
+                 "; print((time.perf_counter() - t) * 1000)")
+        imports = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", probe], cwd=SCRIPTS, capture_output=True, text=True)
+            if out.returncode != 0:
+                imports = None
+                break
+            imports.append(float(out.stdout.strip()))
+        startup = _best([sys.executable, os.path.join(SCRIPTS, "covidtools"), name, "--help"], repeats)
+        print("\t".join([name, "failed" if imports is None else "{:.1f}".format(min(imports)),
+                         "{:.1f}".format(startup)]))
+        if imports is None or (max_ms is not None and startup > max_ms):
+            slow.append(name)
+
+    if slow:
+        sys.stderr.write("Over " + str(max_ms) + " ms or failed to import: " + ", ".join(slow) + "\n")
+        return 1
+    return 0
+
+
+def run(name, argv=None) -> int:
+    """Import a subcommand's module and run its main()"""
+
+    module = importlib.import_module("covidtools." + COMMANDS[name][0])
+    code = module.main(argv)
+    return code if isinstance(code, int) else 0
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        usage()
+        return 0 if argv else 2
+    if argv[0] == "--benchmark-startup":
+        return benchmark_startup(argv[1:])
+    if argv[0] not in COMMANDS:
+        sys.stderr.write("Unknown command " + argv[0] + "\n")
+        usage(sys.stderr)
+        return 2
+
+    # argparse prog in usage and errors
+    sys.argv[0] = "covidtools " + argv[0]
+    return run(argv[0], argv[1:])
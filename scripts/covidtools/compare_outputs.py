@@ -0,0 +1,145 @@
+# Author: Andreas Wilke
+
+# Compare freyja outputs across two or more output trees, e.g. runs processed
+# with different FREYJA_VERSIONs. Files are paired by sample ID; variants TSVs
+# are compared by called mutations (REF POS ALT) and numeric fields, demix .out
+# files by lineage and summarized abundances, resid and coverage, each within a
+# tolerance. The first tree is the reference. Writes a human readable report
+# and optionally JSON; exits 1 if anything differs beyond tolerance.
+#
+#   compare-outputs.py runs/220407-v1.5.3/ runs/220407-v2.0.0/ --json comparison.json
+#   compare-outputs.py a/ b/ --tolerance ALT_FREQ=0.05 abundance=0.02 TOTAL_DP=10%
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from lib.compare import DEFAULT_TOLERANCES, compare_pair, index_tree, pair_trees, parse_tolerance
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Compare freyja variants and demix outputs across output trees.')
+    parser.add_argument('trees', nargs='+', help='Output trees, the first is the reference')
+    parser.add_argument('--report', '-r', dest='report', default=None, help='Report file, default stdout')
+    parser.add_argument('--json', '-j', dest='json', default=None, help='Write results as JSON')
+    parser.add_argument('--tolerance', '-t', dest='tolerances', nargs='+', default=[],
+                        help='FIELD=VALUE absolute or FIELD=VALUE%% relative, fields: ' +
+                        ", ".join(sorted(DEFAULT_TOLERANCES)))
+    parser.add_argument('--min-af', dest='min_af', type=float, default=0.0,
+                        help='Ignore mutations below this ALT_FREQ')
+    parser.add_argument('--processes', '-p', dest='processes', type=int, default=os.cpu_count(),
+                        help='Worker processes')
+    parser.add_argument('--details', dest='details', type=int, default=10,
+                        help='Differences listed per sample in the report')
+    parser.add_argument('--level', dest='level', default="WARNING", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def sample_lines(r, limit) -> list:
+    lines = []
+    if r.get('error'):
+        return ["    error: " + r['error']]
+    if r['kind'] == 'variants':
+        lines.append("    called: {} vs {}".format(*r['called']))
+        for what in ['only_a', 'only_b']:
+            if r[what]:
+                lines.append("    {}: {}{}".format(what, " ".join(r[what][:limit]), " ..." if len(r[what]) > limit else ""))
+        for key in list(r['changed'])[:limit]:
+            lines.append("    {}: {}".format(key, ", ".join("{} {} -> {}".format(f, a, b)
+                                                          for f, (a, b) in r['changed'][key].items())))
+    else:
+        lines.append("    lineages: {} vs {}, max abundance delta {:.4f}".format(*r['lineages'], r['max_delta']))
+        deltas = sorted(r['deltas'].items(), key=lambda x: -abs(x[1]))[:limit]
+        if deltas:
+            lines.append("    abundance: " + ", ".join("{} {:+.4f}".format(l, d) for l, d in deltas))
+        if r['summarized']:
+            lines.append("    summarized: " + ", ".join("{} {:+.4f}".format(c, d) for c, d in r['summarized'].items()))
+        for field, (a, b) in r['scalars'].items():
+            lines.append("    {}: {} -> {}".format(field, a, b))
+    return lines
+
+
+def write_report(stream, trees, results, limit):
+    stream.write("=====================================\n")
+    stream.write("Freyja Output Comparison Report\n")
+    stream.write("=====================================\n")
+    stream.write("Date: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\n")
+    stream.write("Reference: " + trees[0] + "\n")
+
+    for tree in trees[1:]:
+        stream.write("\nCompared: " + tree + "\n")
+        for kind in ['variants', 'demix']:
+            rs = [r for r in results if r['tree'] == tree and r['kind'] == kind]
+            missing_a = [r['sample'] for r in rs if r['a'] is None]
+            missing_b = [r['sample'] for r in rs if r['b'] is None]
+            compared = [r for r in rs if r['a'] and r['b']]
+            different = [r for r in compared if not r['equal']]
+            stream.write("\n{}: {} paired, {} equal within tolerance, {} different, "
+                         "{} only in reference, {} only in compared\n".format(
+                             kind, len(compared), len(compared) - len(different), len(different),
+                             len(missing_b), len(missing_a)))
+            for r in different:
+                stream.write("  " + r['sample'] + "\n")
+                for line in sample_lines(r, limit):
+                    stream.write(line + "\n")
+            if missing_b:
+                stream.write("  only in reference: " + " ".join(missing_b) + "\n")
+            if missing_a:
+                stream.write("  only in compared: " + " ".join(missing_a) + "\n")
+    stream.write("\n=====================================\n")
+
+
+def run(args):
+
+    for tree in args.trees:
+        if not os.path.isdir(tree):
+            sys.exit("Not a directory: " + tree)
+    if len(args.trees) < 2:
+        sys.exit("Need at least two output trees")
+
+    tolerances = dict(DEFAULT_TOLERANCES)
+    for t in args.tolerances:
+        field, value = parse_tolerance(t)
+        tolerances[field] = value
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        indexes = list(pool.map(index_tree, args.trees))
+        pairs = pair_trees(indexes[0], list(zip(args.trees[1:], indexes[1:])))
+        tasks = [(kind, sample, a, b, tolerances, args.min_af) for tree, kind, sample, a, b in pairs if a and b]
+        compared = pool.map(compare_pair, tasks, chunksize=max(1, len(tasks) // (4 * (args.processes or 1))))
+
+        results = []
+        compared = iter(compared)
+        for tree, kind, sample, a, b in pairs:
+            r = next(compared) if a and b else {'kind': kind, 'sample': sample, 'a': a, 'b': b, 'equal': False}
+            r['tree'] = tree
+            results.append(r)
+    logging.info("Compared %d pairs", len(tasks))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            write_report(f, args.trees, results, args.details)
+    else:
+        write_report(sys.stdout, args.trees, results, args.details)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'trees': args.trees,
+                       'tolerances': {k: {'value': v, 'relative': r} for k, (v, r) in tolerances.items()},
+                       'min_af': args.min_af,
+                       'results': results}, f, indent=1, sort_keys=True)
+
+    return 0 if all(r['equal'] for r in results) else 1
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
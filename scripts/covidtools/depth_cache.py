@@ -0,0 +1,140 @@
+# Author: Andreas Wilke
+
+# Binary depth cache per run: depth/*.depth (chrom, pos, base, depth, one line
+# per reference position) as one samples x positions uint32 matrix in
+# depth.u32 with the sample index in depth.u32.json. build converts only new
+# or changed depth files and checks every written row against the text,
+# unreadable or malformed depth files are skipped with a warning and only a
+# row that does not read back as written makes build exit 1;
+# verify checks row checksums (--full re-reads the text). coverage prints the
+# lines depth2cov.sh printed, computed for all samples of a run at once;
+# slice and regions read positions or BED amplicons straight from the
+# memory map.
+#
+#   depth-cache.py build runs/220407
+#   depth-cache.py coverage runs/220407 > runs/220407/coverage.all.txt
+#   depth-cache.py slice runs/220407 --sample 22501_S53 --start 21563 --end 25384
+#   depth-cache.py regions /local/incoming/covid/runs/*/ --bed config/ARTIC_V4.1.bed --stat mean
+
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+
+from lib.depthcache import (DEFAULT_REFERENCE, THRESHOLD, DepthCache, bc_percent, depth_files, read_bed,
+                            reference_length)
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Memory-mapped binary cache of per sample depth files.')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Add new and changed depth files')
+    build.add_argument('runs', nargs='+', help='Run directories')
+    build.add_argument('--depth-dir', dest='depth_dir', default=None, help='Default <run>/depth')
+    build.add_argument('--reference', dest='reference', default=DEFAULT_REFERENCE,
+                       help='Reference fasta giving the number of positions, default ' + DEFAULT_REFERENCE)
+    build.add_argument('--force', dest='force', default=False, action='store_true', help='Convert all files again')
+
+    verify = commands.add_parser('verify', help='Check rows against their checksums')
+    verify.add_argument('runs', nargs='+', help='Run directories')
+    verify.add_argument('--full', dest='full', default=False, action='store_true',
+                        help='Compare with the depth files too')
+
+    coverage = commands.add_parser('coverage', help='Percent of positions with depth >= threshold, as depth2cov.sh')
+    coverage.add_argument('runs', nargs='+', help='Run directories')
+    coverage.add_argument('--threshold', dest='threshold', type=int, default=THRESHOLD)
+
+    part = commands.add_parser('slice', help='Depth per position of one sample')
+    part.add_argument('run')
+    part.add_argument('--sample', dest='sample', required=True)
+    part.add_argument('--start', dest='start', type=int, default=1)
+    part.add_argument('--end', dest='end', type=int, default=None)
+
+    regions = commands.add_parser('regions', help='Depth statistic per sample and BED region, as TSV')
+    regions.add_argument('runs', nargs='+', help='Run directories')
+    regions.add_argument('--bed', dest='bed', required=True, help='Amplicons or other regions')
+    regions.add_argument('--stat', dest='stat', default='mean', choices=['mean', 'median', 'min', 'max'])
+    return parser.parse_args(argv)
+
+
+STATS = {'mean': np.mean, 'median': np.median, 'min': np.min, 'max': np.max}
+
+
+def run(args):
+
+    if args.command == 'build':
+        length = reference_length(args.reference)
+        failed = 0
+        for run_dir in args.runs:
+            cache = DepthCache(run_dir)
+            if length is None and not cache.positions:
+                logging.warning("No reference %s, positions taken from the depth files", args.reference)
+            stats = cache.update(depth_files(run_dir, args.depth_dir), length=length, force=args.force)
+            logging.info("%s: %d added, %d updated, %d unchanged, %d skipped, %d failed %s", run_dir, stats['added'],
+                         stats['updated'], stats['unchanged'], len(stats['skipped']), len(stats['failed']),
+                         " ".join(stats['failed']))
+            if stats['skipped']:
+                logging.warning("%s: unreadable or malformed depth files skipped for %s", run_dir,
+                                " ".join(stats['skipped']))
+            if stats['truncated']:
+                logging.warning("%s: positions beyond %d dropped for %s", run_dir, cache.positions,
+                                " ".join(stats['truncated']))
+            failed += len(stats['failed'])
+        return 1 if failed else 0
+
+    if args.command == 'verify':
+        bad = 0
+        for run_dir in args.runs:
+            cache = DepthCache(run_dir)
+            samples = cache.verify(full=args.full)
+            for sample in samples:
+                print("\t".join([run_dir, sample, "FAILED"]))
+            logging.info("%s: %d samples, %d failed", run_dir, len(cache), len(samples))
+            bad += len(samples)
+        return 1 if bad else 0
+
+    if args.command == 'coverage':
+        for run_dir in args.runs:
+            cache = DepthCache(run_dir)
+            paths = {s: e['path'] for s, e in cache.index['samples'].items()}
+            for sample, (count, total) in sorted(cache.coverage(args.threshold).items(), key=lambda i: paths[i[0]]):
+                cov = bc_percent(count, total)
+                print("{}\t{}\tSample={} File={} Treshold={} Count={} Total={} Coverage={}".format(
+                    sample, cov, sample, paths[sample], args.threshold, count, total, cov))
+        return 0
+
+    if args.command == 'slice':
+        cache = DepthCache(args.run)
+        if args.sample not in cache:
+            sys.exit("No sample " + args.sample + " in " + args.run)
+        for pos, d in enumerate(cache.depth(args.sample, args.start, args.end), start=args.start):
+            print("{}\t{}".format(pos, d))
+        return 0
+
+    regions = read_bed(args.bed)
+    stat = STATS[args.stat]
+    print("\t".join(["run", "sample"] + [name for name, start, end in regions]))
+    for run_dir in args.runs:
+        cache = DepthCache(run_dir)
+        if not len(cache):
+            continue
+        run_name = os.path.basename(os.path.normpath(run_dir))
+        # one reduction over all samples per region
+        values = np.column_stack([stat(cache.region(start, end), axis=1) for name, start, end in regions])
+        for sample, row in zip(cache.samples, values):
+            print("\t".join([run_name, sample] + ["{:g}".format(v) for v in row]))
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
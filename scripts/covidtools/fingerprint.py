@@ -0,0 +1,77 @@
+# Author: Andreas Wilke
+
+# Fingerprint the freyja container and the reference files that determine
+# results (barcodes, lineages.yml, curated lineages, reference fasta). md5s
+# are cached in /local/incoming/covid/config/fingerprints.tsv ($COVID_FINGERPRINTS)
+# keyed by inode, size and mtime, so after the first run a call costs a few
+# stats instead of reading gigabytes. Prints name=path and name_md5=digest
+# lines for the per sample .version files, or writes the run provenance JSON.
+#
+#   fingerprint.py container=config/freyja_latest.sif barcodes=config/usher_barcodes.feather >> output/22501_S53.version
+#   fingerprint.py container=config/freyja_latest.sif --json provenance/freyja_run_1.json --field run_id=1 requested_version=latest
+
+import argparse
+import json
+import logging
+import os
+import sys
+from lib.fingerprint import DEFAULT_CACHE, fingerprint, provenance, version_lines, write_json
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Cached md5 fingerprints of containers and reference files.')
+    parser.add_argument('files', nargs='+', help='name=path, or a path named by its file name')
+    parser.add_argument('--cache', dest='cache', default=None,
+                        help='Digest cache, default $COVID_FINGERPRINTS or ' + DEFAULT_CACHE)
+    parser.add_argument('--cached-only', dest='cached_only', default=False, action='store_true',
+                        help='Never hash, leave digests of changed files empty')
+    parser.add_argument('--json', dest='json', default=None,
+                        help='Write a provenance record to this file, - for stdout')
+    parser.add_argument('--field', dest='fields', nargs='+', default=[],
+                        help='key=value pairs added to the provenance record')
+    parser.add_argument('--strict', dest='strict', default=False, action='store_true',
+                        help='Exit with 1 if a file is missing')
+    parser.add_argument('--level', dest='level', default="WARNING", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def named(items) -> dict:
+    files = {}
+    for item in items:
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = os.path.basename(item), item
+        files[name] = path
+    return files
+
+
+def run(args):
+
+    files = named(args.files)
+    prints = fingerprint(files, cache=args.cache, cached_only=args.cached_only)
+    missing = [name for name, p in prints.items() if p['size'] is None]
+    for name in missing:
+        logging.warning("Missing %s: %s", name, files[name])
+
+    if args.json:
+        record = provenance(prints, dict(f.partition("=")[::2] for f in args.fields))
+        if args.json == "-":
+            json.dump(record, sys.stdout, indent=2)
+            print()
+        else:
+            write_json(args.json, record)
+            logging.info("Wrote %s", args.json)
+    else:
+        for line in version_lines(prints):
+            print(line)
+    return 1 if missing and args.strict else 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
@@ -0,0 +1,193 @@
+# Author: Andreas Wilke
+
+# Hardlink demix outputs into <group>/<label>/data for every label of the sample's site,
+# outputs of packed runs are written out from the run's results.bundle
+
+import argparse
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from lib import bundle
+from lib.mapping import Mapping
+
+
+def parse_mapping_file(mfile) -> dict :
+    mapping= {}
+    
+    with open(mfile) as f :
+        header_line = f.readline()
+        tags = header_line.strip().split("\t")
+        
+        primary_column = 0
+        date_column =  1
+        exclude_columns = []
+        include_columns = []
+        
+        mapping['header'] = []
+        mapping['values'] = {}
+        for idx, val in enumerate(tags):
+            
+            # if val =="Label" :
+                # exclude_columns.append(idx)
+            if val in ["wwtp_name" , "SiteId"] :
+                include_columns.append(idx)
+            if val == "sample_id" :
+                primary_column = idx
+            elif val in ["sample_collection_data" , "sample_collect_date"] :
+                date_column = idx
+            
+            mapping['header'].append(val.strip().replace(" " , "_"))
+                
+        logging.info("Primary column: %d", primary_column)
+        logging.info("Date column: %d", date_column)
+        logging.info("Excluding columns: %s", ",".join(map(str, exclude_columns)))
+        
+        for l in f :
+            values = l.strip().split("\t")
+            if len(values) < len(mapping['header']):
+                continue
+            mapping['values'][values[primary_column]] = { 'date' : None ,
+                                                         'columns' : []
+                                                         }
+            if not date_column is None :
+                mapping['values'][values[primary_column]]['date'] = values[date_column]
+                
+            for i,v in enumerate(values) :
+                    
+                if i in exclude_columns :
+                    pass
+                elif i in include_columns :
+                    mapping['values'][values[primary_column]]['columns'].append({ 
+                                                            'header' : mapping['header'][i],
+                                                            'group' : v.strip().replace(" " , "_")
+                                                            })
+    
+    return mapping
+
+
+def find_samples(pattern=None , categories= {} , src=None , dest="/local/incoming/covid/aggregates/location/", mapping=None) :
+    destination = None
+    if not dest:
+        destination=Path("/local/incoming/covid/aggregates/location/")
+    else:
+        destination=Path(dest)
+    if not pattern :
+        print("Missing pattern")
+        sys.exit(0)
+    else :
+        print("Searching in " + src + " for " + pattern)
+    
+    date =re.compile("^(\d+)/(\d+)/(\d+)")
+    res = date.match(categories['date'])
+    
+    if res is None :
+        print("No date, skipping " + pattern)
+        return
+    
+
+    prefix="".join([res[3],res[1] if int(res[1]) > 9 else  "0" + res[1], res[2] if int(res[2]) > 9 else "0" + res[2] ])
+    print(res[0] , prefix )
+    
+    for path in Path(src).rglob("*." + pattern + '*.out'):
+        print(path.name , path.parts)    
+        src = path.joinpath()
+        
+        for c in categories['columns'] :
+           
+            target_dir = destination.joinpath(c['header'] , c['group'])
+            print(c['header'] , c['group'], pattern, target_dir) 
+            
+            if not target_dir.is_dir() :
+                Path.mkdir(target_dir, exist_ok=True , parents=True)
+            
+           
+            # get date right - easier to sort later
+            
+      
+      
+            
+            
+            
+            target = os.path.join(target_dir , ".".join([prefix,path.name]))
+            
+            if not os.path.exists(target) :
+                os.link(src ,target)
+                pass
+            else :
+                print("Target " + target + " exists, skipping")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mapping-file' , dest='mapping_file' , help="ID mapping file")
+    parser.add_argument('--source-dir' , dest='source')
+    parser.add_argument('--destination-dir' , dest='destination')
+    parser.add_argument('--sites2labels', dest='sites_file')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity, links made and skipped are logged at DEBUG')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+
+    # def dev:
+    #     print(mapping.id2site(Id))
+    #     print(mapping.site2labels( mapping.id2site(Id) ) )
+
+    mapping = Mapping()
+    destination = Path("/tmp")
+
+    if args.destination and os.path.isdir(args.destination):
+        destination = Path(args.destination)
+
+    if os.path.isfile(args.mapping_file) :
+        result = parse_mapping_file(args.mapping_file)
+        mapping.load(args.mapping_file)
+
+        if args.sites_file and os.path.isfile(args.sites_file):
+            # load sites file
+            mapping.load_site_mapping(args.sites_file)
+
+        # label directories already created, checked once per label not per sample
+        created = set()
+
+        # get all outfiles     
+        for src in mapping.get_files(args.source, suffix=".out"):
+            basename = os.path.basename(src)
+
+            Id = mapping.get_id(src)
+            if Id:
+                site = mapping.id2site(Id)
+                if site:
+                    labels = mapping.site2labels(site)
+                    logging.debug("%s: %d labels", Id, len(labels))
+                    for group, label in labels:
+                        outdir = destination.joinpath(group, label,"out")
+                        datadir = destination.joinpath(group, label,"data")
+                        # check if dir exists
+                        if not (group, label) in created :
+                            Path.mkdir(outdir, exist_ok=True , parents=True)
+                            Path.mkdir(datadir, exist_ok=True , parents=True)
+                            created.add((group, label))
+
+                        target = datadir.joinpath(basename)
+
+                        logging.debug("%s %s %s %s %s", Id, site, group, src, target)
+                        if not os.path.exists(target) :
+                            bundle.link(src ,target)
+                        else :
+                            logging.debug("Target %s exists, skipping", target)
+
+                else:
+                    logging.warning("No site for ID: %s", Id)
+            else:
+                logging.warning("No ID for file: %s", src)
+
+        sys.exit()
+
+
+        for k in result['values'] :
+            find_samples(pattern=k , categories=result['values'][k] , src=args.source , dest=args.destination, mapping=mapping)
+        # data2tab(result , metadata=m)
+    else :
+        logging.error("No such file %s", args.mapping_file)
@@ -0,0 +1,116 @@
+# Author: Andreas Wilke
+
+# Hardlink demix outputs into <group>/<label>/data for every ID pattern in a label mapping,
+# outputs of packed runs are written out from the run's results.bundle
+
+import argparse
+import fnmatch
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from lib import bundle
+from lib.mapping import Mapping
+
+
+def parse_mapping_file(mfile) -> dict :
+    mapping= {}
+    
+    with open(mfile) as f :
+        header_line = f.readline()
+        tags = header_line.strip().split("\t")
+        
+        primary_column = 0
+        exclude_columns = []
+        
+        mapping['header'] = []
+        mapping['values'] = {}
+        for idx, val in enumerate(tags):
+            
+            if val =="Label" :
+                exclude_columns.append(idx)
+            elif val == "ID Pattern" :
+                primary_column = idx
+            
+            mapping['header'].append(val.strip().replace(" " , "_").replace("/", "_").replace("(","_").replace(")", "_").replace("'","_").replace("`","_").replace("&","_").replace(",","_").replace('"','_'))
+                
+        logging.info("Primary column: %d", primary_column)
+        logging.info("Excluding columns: %s", ",".join(map(str, exclude_columns)))
+        
+        for l in f :
+            values = l.strip().split("\t")
+            mapping['values'][values[primary_column]] = []
+            for i,v in enumerate(values) :
+                if i in exclude_columns :
+                    pass
+                else :
+                    mapping['values'][values[primary_column]].append({ 
+                                                            'header' : mapping['header'][i],
+                                                            'group' : v.strip().replace(" " , "_").replace("/", "_").replace("(","_").replace(")", "_").replace("'","_").replace("`","_").replace("&","_").replace(",","_").replace('"','_')
+                                                            })
+    
+    return mapping
+
+
+def find_samples(pattern=None , categories=[] , src=None , dest="/local/incoming/covid/aggregates/location/", files=None) :
+    destination = None
+    if not dest:
+        destination=Path("/local/incoming/covid/aggregates/location/")
+    else:
+        destination=Path(dest)
+    if not pattern :
+        logging.error("Missing pattern")
+        sys.exit(0)
+    else :
+        logging.debug("Searching for %s in %s", pattern, src)
+    
+    # same match as rglob, against the file list read once instead of a tree walk per pattern
+    regex = re.compile(fnmatch.translate('*.[0-9][0-9][0-9][0-9][0-9][0-9][-_]' + pattern + '*.out'))
+    if files is None :
+        files = [Path(p) for p in bundle.rglob(src, '*.out')]
+    for path in files :
+        if not regex.match(path.name) :
+            continue
+        # print(path.name , path.parts)    
+        src = path.joinpath()
+        logging.debug("%s", path)
+        for c in categories :
+           
+            data_dir = destination.joinpath(c['header'] , c['group'], "data")
+            out_dir = destination.joinpath(c['header'] , c['group'],"out")
+            logging.debug("%s %s %s %s", c['header'], c['group'], pattern, data_dir)
+            pass
+            if not data_dir.is_dir() :
+                Path.mkdir(data_dir, exist_ok=True , parents=True)
+            if not out_dir.is_dir() :
+                Path.mkdir(out_dir, exist_ok=True , parents=True)
+           
+            target = os.path.join(data_dir , path.name) # no need for date prefix anymore
+            
+            if not os.path.exists(target) :
+                logging.debug("Linking: %s %s", src, target)
+                bundle.link(src ,target)
+            else :
+                logging.debug("Target %s exists, skipping", target)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mapping-file' , dest='mapping_file')
+    parser.add_argument('--source-dir' , dest='source')
+    parser.add_argument('--destination-dir' , dest='destination')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity, links made and skipped are logged at DEBUG')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+
+    if os.path.isfile(args.mapping_file) :
+        result = parse_mapping_file(args.mapping_file)
+        files = Mapping().get_files(args.source, suffix=".out")
+
+        for k in result['values'] :
+            find_samples(pattern=k , categories=result['values'][k] , src=args.source , dest=args.destination, files=files)
+        # data2tab(result , metadata=m)
+    else :
+        logging.error("No such file %s", args.mapping_file)
@@ -0,0 +1,100 @@
+# Author: Andreas Wilke
+
+# Sparse mutation x sample matrix of allele frequency and depth from the
+# variants/*.variants.tsv files of any number of runs. Mutations (REF POS ALT)
+# are interned in a dictionary shared by all runs and samples are numbered
+# once, both append only; build adds or refreshes one shard per run whose
+# variants changed. Queries work on the CSR matrices: carriers of a mutation,
+# mutations first seen in a collection window, prevalence per site.
+#
+#   mutation-matrix.py build /local/incoming/covid/runs/*/
+#   mutation-matrix.py carriers C22995A --min-af 0.1
+#   mutation-matrix.py new --since 2024-05-06 --min-af 0.05
+#   mutation-matrix.py prevalence A23063T --min-af 0.1 --since 2024-04-01
+
+import argparse
+import logging
+import os
+import sys
+from lib.mutations import DEFAULT_STORE, MutationStore
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Sparse mutation x sample matrix across runs.')
+    parser.add_argument('--store', dest='store', default=DEFAULT_STORE, help='Matrix directory, default ' + DEFAULT_STORE)
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Add or refresh runs')
+    build.add_argument('runs', nargs='+', help='Run directories')
+    build.add_argument('--force', dest='force', default=False, action='store_true',
+                       help='Rebuild runs even if unchanged')
+
+    carriers = commands.add_parser('carriers', help='Samples with a mutation')
+    carriers.add_argument('mutations', nargs='+', help='REF POS ALT, e.g. C22995A')
+    carriers.add_argument('--min-af', dest='min_af', type=float, default=0.0)
+    carriers.add_argument('--min-dp', dest='min_dp', type=int, default=0)
+
+    new = commands.add_parser('new', help='Mutations first seen in a collection date window')
+    new.add_argument('--since', dest='since', required=True, help='YYYY-MM-DD')
+    new.add_argument('--until', dest='until', default=None, help='YYYY-MM-DD')
+    new.add_argument('--min-af', dest='min_af', type=float, default=0.0)
+
+    prevalence = commands.add_parser('prevalence', help='Samples with a mutation per site')
+    prevalence.add_argument('mutation')
+    prevalence.add_argument('--min-af', dest='min_af', type=float, default=0.0)
+    prevalence.add_argument('--since', dest='since', default=None, help='Collection date YYYY-MM-DD')
+    prevalence.add_argument('--until', dest='until', default=None, help='Collection date YYYY-MM-DD')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    store = MutationStore(args.store)
+
+    if args.command == 'build':
+        fd = store.lock()
+        try:
+            # reread under the lock, another build may have extended the dictionary
+            store = MutationStore(args.store)
+            for run_dir in args.runs:
+                stats = store.add_run(run_dir, force=args.force)
+                if stats is None:
+                    logging.info("%s unchanged", run_dir)
+                else:
+                    logging.info("%s: %s", run_dir, ", ".join("{} {}".format(v, k) for k, v in stats.items()))
+            store.save()
+        finally:
+            os.close(fd)
+        logging.info("%d mutations x %d samples in %d runs", len(store.mutations), len(store.samples), len(store.runs))
+        return 0
+
+    if args.command == 'carriers':
+        print("\t".join(["mutation", "run", "sample", "site_id", "collect_date", "af", "dp"]))
+        for mutation in args.mutations:
+            for c, af, dp in store.carriers(mutation, args.min_af, args.min_dp):
+                s = store.samples[c]
+                print("\t".join([mutation, s['run'], s['sample'], s['site_id'], s['collect_date'],
+                                 "{:.4g}".format(af), str(dp)]))
+        return 0
+
+    if args.command == 'new':
+        print("\t".join(["mutation", "first_seen"]))
+        for mutation, first in store.new_mutations(args.since, args.until, args.min_af):
+            print("\t".join([mutation, first]))
+        return 0
+
+    print("\t".join(["site_id", "with", "samples", "prevalence"]))
+    for site, found, total in store.prevalence(args.mutation, args.min_af, args.since, args.until):
+        print("\t".join([site, str(found), str(total), "{:.4f}".format(found / total)]))
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
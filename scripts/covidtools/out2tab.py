@@ -0,0 +1,173 @@
+# Author: Andreas Wilke
+
+# Demix .out files as one tab separated summary line each, see process-run.sh
+
+import argparse
+import os
+import re
+import sys
+import traceback
+from lib import bundle
+from lib.mapping import Mapping
+
+
+def parse(file) -> dict:
+
+    p = re.compile(r'^\s')
+    t = re.compile(r'^(summarized|lineages|abundances|resid)\s+(.*)$')
+
+    d = {
+        'summarized': {},
+        'lineages': [],
+        'abundances': [],
+        'resid': ''
+    }
+
+    with bundle.open_file(file) as f:
+        header_line = f.readline()
+        tag = None
+        for l in f:
+            line = ''
+            if t.match(l):
+                m = t.match(l)
+                tag = m[1]
+                l = m[2]
+                # print(m[0])
+                # print(m[1])
+                # print(m[2])
+
+            stripped = l.strip()
+            if tag == "summarized":
+                sum = re.findall(r'\(\'(\w+)\',\s*([\d\.]+)\)', stripped)
+
+                for pair in sum:
+                    d[tag][pair[0]] = pair[1]
+
+            if tag == "lineages":
+                lin = re.findall(r'([A-Z\.\d]+)', stripped)
+                d[tag] += lin
+            if tag == "abundances":
+                abu = re.findall(r'([\d\.]+)', stripped)
+                d[tag] += abu
+            if tag == "resid":
+                d[tag] = stripped
+
+    return d
+
+
+def data2tab(data, metadata=None) -> None:
+
+    header = False
+
+    k = data.keys()
+
+    # print header
+    if header:
+        if metadata:
+            print("\t".join(['id', 'date', 'location']) + "\t" + "\t".join(k))
+        else:
+            print("\t".join(k))
+
+    row = []
+    for i in data:
+
+        if isinstance(data[i], str):
+            row += [data[i]]
+        elif isinstance(data[i], list):
+            row += [",".join(data[i])]
+        elif isinstance(data[i], dict):
+            tmp = []
+            for k, v in data[i].items():
+                tmp += [":".join([k, v])]
+
+            row += [",".join(tmp)]
+        else:
+            print("Error: Unsupported type " + type(data[i], file=sys.stderr))
+            sys.exit(0)
+
+    if metadata:
+        print(
+            " : ".join([metadata['id'], metadata['date'], metadata['location']] + row))
+    else:
+        print("\t".join(row))
+    return None
+
+
+def file2meta(filepath, mapping=None) -> dict:
+    m = {
+        'id': '',
+        'file': '',
+        'date': '',
+        'date-format': '',
+        'location': '',
+        'tags': [],
+        'hierarchy': []
+    }
+
+    filename = os.path.basename(filepath)
+    m['file'] = filename
+
+    d = re.match(r"^(\d{2})(\d{2})(\d{2})", filename)
+    i = re.match(r"^[^-_\.]+\.([^-_\.]+).+\.out", filename)
+    # l = re.match("^\d+-(.+)_.*", filename)
+    l = None
+
+    if i:
+        m['id'] = i[1]
+        if mapping:
+            l = mapping.site2labels(mapping.id2site(i[1]))
+    else:
+        m['id'] = filename
+
+    month = ''
+    day = ''
+    year = ''
+    location = ''
+
+    if d:
+        month = d[2]
+        day = d[3]
+        year = d[1]
+
+        m['date'] = year + month + day
+        m['date-format'] = year + "-" + month + "-" + day
+
+    else:
+        m['date'] = ''
+
+    if l and len(l) > 1:
+        # label of the second (group, label) pair
+        m['location'] = l[1][1]
+    else:
+        m['location'] = m['id']
+
+    return m
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--mapping-file", dest="mapping_file")
+    parser.add_argument("out_file", nargs="+")
+    args = parser.parse_args(argv)
+
+    mapping = Mapping()
+    if args.mapping_file and os.path.isfile(args.mapping_file):
+        mapping.load(args.mapping_file)
+
+    # one process for all files instead of one per file, a broken file
+    # is reported and skipped like a failed run in the old shell loop
+    failed = 0
+    out_files = [f for pattern in args.out_file for f in bundle.expand(pattern)]
+    for out_file in out_files:
+        if bundle.isfile(out_file):
+            try:
+                m = file2meta(out_file, mapping=mapping)
+                result = parse(out_file)
+                data2tab(result, metadata=m)
+            except Exception:
+                traceback.print_exc()
+                failed += 1
+        else:
+            print("No such file " + out_file)
+
+    return 1 if failed else 0
@@ -0,0 +1,115 @@
+# Author: Andreas Wilke
+
+# Append-only provenance ledger per run, provenance/ledger.jsonl, instead of
+# one .version/.freyja_version file per sample. The pipeline appends one
+# record per sample (freyja version, container and reference fingerprints
+# from the cache in config/fingerprints.tsv); provenance/ledger.index.json maps
+# key -> value -> record offsets and is brought up to date from the ledger's
+# tail. Queries read only the index and the matching lines of every run, runs
+# in parallel. import adds existing per-sample files and run JSONs, once each.
+#
+#   provenance-ledger.py append runs/220407 --sample 22501_S53 --field freyja_actual=2.0.0 --fingerprint container=config/freyja_latest.sif
+#   provenance-ledger.py import /local/incoming/covid/runs/*/
+#   provenance-ledger.py query /local/incoming/covid/runs --where container_md5=8f644a64125adc07ac7af46c653895f1
+#   provenance-ledger.py query /local/incoming/covid/runs --where barcodes='*usher_barcodes.2024-05*' --fields run sample
+
+import argparse
+import json
+import logging
+import os
+import sys
+from lib.ledger import append, find_runs, import_files, load_index, query, record
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Append-only provenance ledger per run, queried across runs.')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('append', help='Append one record')
+    add.add_argument('run_dir')
+    add.add_argument('--field', dest='fields', nargs='+', default=[], help='key=value pairs')
+    add.add_argument('--sample', dest='sample', default=None)
+    add.add_argument('--stage', dest='stage', default='demix')
+    add.add_argument('--fingerprint', dest='fingerprints', nargs='+', default=[],
+                     help='name=path, adds name and name_md5 from the fingerprint cache')
+    add.add_argument('--cache', dest='cache', default=None, help='Fingerprint cache, default $COVID_FINGERPRINTS')
+
+    imp = commands.add_parser('import', help='Add existing .version, .freyja_version and run JSON files')
+    imp.add_argument('runs', nargs='+', help='Run directories')
+
+    index = commands.add_parser('index', help='Bring ledger indexes up to date')
+    index.add_argument('runs', nargs='+', help='Run directories or directories of runs')
+
+    find = commands.add_parser('query', help='Records matching all conditions, as TSV')
+    find.add_argument('runs', nargs='+', help='Run directories or directories of runs')
+    find.add_argument('--where', '-w', dest='where', nargs='+', default=[],
+                      help='key=value, value may be a glob pattern')
+    find.add_argument('--fields', '-f', dest='fields', nargs='+', default=None,
+                      help='Columns to print, default run, sample, stage and the --where keys')
+    find.add_argument('--json', dest='json', default=False, action='store_true', help='Print records as JSON lines')
+    find.add_argument('--threads', '-t', dest='threads', type=int, default=8)
+    return parser.parse_args(argv)
+
+
+def pairs(items) -> dict:
+    result = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep:
+            sys.exit("Expected key=value: " + item)
+        result[key] = value
+    return result
+
+
+def run(args):
+
+    if args.command == 'append':
+        fields = pairs(args.fields)
+        if args.fingerprints:
+            from lib.fingerprint import fingerprint
+            files = pairs(args.fingerprints)
+            for name, p in fingerprint(files, cache=args.cache).items():
+                fields[name] = p['resolved_path']
+                fields[name + "_md5"] = p['md5']
+        append(args.run_dir, [record(sample=args.sample, stage=args.stage, **fields)])
+        return 0
+
+    if args.command == 'import':
+        for run_dir in args.runs:
+            if not os.path.isdir(run_dir):
+                logging.error("Not a directory: %s", run_dir)
+                continue
+            counts = import_files(run_dir)
+            load_index(run_dir)
+            logging.info("%s: %s", run_dir, ", ".join("{} {}".format(v, k) for k, v in counts.items()))
+        return 0
+
+    runs = find_runs(args.runs)
+    if args.command == 'index':
+        for run_dir in runs:
+            logging.info("%s: %d records", run_dir, load_index(run_dir)['count'])
+        return 0
+
+    where = pairs(args.where)
+    records = query(runs, where, threads=args.threads)
+    if args.json:
+        for r in records:
+            print(json.dumps(r, sort_keys=True))
+    else:
+        fields = args.fields or ['run', 'sample', 'stage'] + [k for k in where if k not in ('run', 'sample', 'stage')]
+        print("\t".join(fields))
+        for r in records:
+            print("\t".join(str(r.get(f, "")) for f in fields))
+    logging.info("%d records in %d runs", len(records), len(runs))
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
@@ -0,0 +1,92 @@
+# Author: Andreas Wilke
+
+# Coverage gate between freyja variants and demix. check reads the sample's
+# depth file, computes breadth (% of positions with at least --depth reads)
+# and mean depth, and appends the decision to qc_gate.tsv in the run
+# directory. Samples below --min-breadth or --min-mean-depth are added to
+# qc_failed.tsv with the reason and get a placeholder qc_failed/<sample>.out
+# instead of a demix run, outside output/ so aggregates and summaries leave
+# them out; exit status 3 tells the Makefile to skip demix, any other status,
+# including an error in the gate, demixes. summary rewrites both files with
+# the latest decision per sample, prints the skipped samples with their reason
+# and, with --table, adds decision, breadth, mean depth and reason to the run
+# summary.
+#
+#   qc-gate.py check --sample 22501_S53 --min-breadth 10 --min-mean-depth 2 ; [ $? -ne 3 ] && freyja demix ...
+#   qc-gate.py summary runs/220407 --table runs/220407/summary.all.tsv
+
+import argparse
+import logging
+import os
+import sys
+from lib.qcgate import DECISIONS, FAILED, SKIPPED_DIR, THRESHOLD, decide, join_summary, placeholder, record, summarize
+
+SKIP = 3    # exit status for skip demix, distinct from the 1 of an uncaught exception
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Coverage gate before freyja demix.')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    check = commands.add_parser('check', help='Decide for one sample, exit 3 if demix should be skipped')
+    check.add_argument('--sample', dest='sample', required=True)
+    check.add_argument('--run-dir', dest='run_dir', default=".")
+    check.add_argument('--depth-file', dest='depth_file', default=None, help='Default depth/<sample>.depth')
+    check.add_argument('--out-file', dest='out_file', default=None, help='Placeholder for a skipped sample, default qc_failed/<sample>.out')
+    check.add_argument('--min-breadth', dest='min_breadth', type=float, default=0.0,
+                       help='Percent of positions with at least --depth reads')
+    check.add_argument('--min-mean-depth', dest='min_mean_depth', type=float, default=0.0)
+    check.add_argument('--depth', dest='depth', type=int, default=THRESHOLD,
+                       help='Read depth a position needs to count for breadth')
+
+    summary = commands.add_parser('summary', help='One decision per sample in ' + DECISIONS + ' and ' + FAILED)
+    summary.add_argument('run_dir', nargs='?', default=".")
+    summary.add_argument('--table', dest='table', default=None,
+                         help='Summary table as join wrote it, e.g. summary.all.tsv; the gate columns are appended per sample')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    if args.command == 'check':
+        path = lambda *p: os.path.join(args.run_dir, *p)
+        depth_file = args.depth_file or path("depth", args.sample + ".depth")
+        d = decide(args.sample, depth_file, min_breadth=args.min_breadth, min_mean_depth=args.min_mean_depth,
+                   depth=args.depth)
+        record(args.run_dir, d)
+        out_file = args.out_file or path(SKIPPED_DIR, args.sample + ".out")
+        if d['decision'] == "pass":
+            # placeholder of an earlier attempt
+            if os.path.isfile(out_file):
+                os.remove(out_file)
+            logging.info("%s passed QC", args.sample)
+            return 0
+        os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+        placeholder(out_file, os.path.join("variants", args.sample + ".variants.tsv"), d)
+        # demix output of an earlier attempt with other thresholds
+        stale = path("output", args.sample + ".out")
+        if os.path.isfile(stale):
+            os.remove(stale)
+        logging.warning("%s failed QC, demix skipped: %s", args.sample, d['reason'])
+        return SKIP
+
+    decisions = summarize(args.run_dir)
+    failed = sorted(s for s, d in decisions.items() if d['decision'] == "fail")
+    for sample in failed:
+        print("\t".join([sample, decisions[sample]['reason']]))
+    logging.info("QC gate: %d passed, %d failed, demix skipped for %s", len(decisions) - len(failed), len(failed),
+                 " ".join(failed) or "none")
+    if args.table:
+        join_summary(args.table, decisions)
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
@@ -0,0 +1,108 @@
+# Author: Andreas Wilke
+
+# Reconcile an aggregate tree (<dest>/<group>/<label>/data) with the mapping and
+# the output archive. samples2aggregates.py and labels2aggregates.py only add
+# links; this computes the tree they should have produced, scans each data
+# directory once and applies only the difference: missing links are added,
+# links to an older inode of a recomputed output are replaced and links for
+# samples no longer mapped to that label are removed. The label directories
+# that changed are printed one per line, so aggregation can skip the rest.
+#
+#   reconcile-aggregates.py -s runs/ -d aggregate/current -m all.sample-mapping.tsv --sites2labels mapping.tsv
+#   reconcile-aggregates.py -s runs/ -d aggregate/testing --patterns labels.tsv --dry-run
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+from lib.mapping import Mapping
+from lib.reconcile import desired_by_pattern, desired_by_site, reconcile, scan_sources
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Add, replace and remove links so an aggregate tree matches the mapping.')
+    parser.add_argument('--source-dir', '-s', dest='source', nargs='+', required=True,
+                        help='Output archive, searched recursively for demix files')
+    parser.add_argument('--destination-dir', '-d', dest='destination', required=True,
+                        help='Aggregate tree, <group>/<label>/data')
+    parser.add_argument('--mapping-file', '-m', dest='mapping_file', default=None,
+                        help='Sample mapping, links by site labels as samples2aggregates.py')
+    parser.add_argument('--sites2labels', dest='sites_file', default=None,
+                        help='Site to label mapping for --mapping-file')
+    parser.add_argument('--patterns', dest='patterns', default=None,
+                        help='ID pattern to label mapping, links as labels2aggregates.py')
+    parser.add_argument('--groups', dest='groups', nargs='+', default=None,
+                        help='Only reconcile these group directories')
+    parser.add_argument('--suffix', dest='suffix', default=".out")
+    parser.add_argument('--dry-run', '-n', dest='dry_run', default=False, action='store_true',
+                        help='Report changes without touching the tree')
+    parser.add_argument('--json', '-j', dest='json', default=None, help='Write the plan as JSON')
+    parser.add_argument('--level', dest='level', default="WARNING", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def read_patterns(path) -> dict:
+    """ID pattern -> [(group, label), ...] from a labels2aggregates.py mapping file"""
+
+    from covidtools.link_patterns import parse_mapping_file
+
+    with contextlib.redirect_stdout(sys.stderr):
+        parsed = parse_mapping_file(path)
+    return {p: [(c['header'], c['group']) for c in categories] for p, categories in parsed['values'].items()}
+
+
+def run(args):
+
+    if bool(args.mapping_file) == bool(args.patterns):
+        sys.exit("Need either --mapping-file or --patterns")
+    for d in args.source + [args.destination]:
+        if not os.path.isdir(d):
+            sys.exit("Not a directory: " + d)
+
+    sources = scan_sources(args.source, suffix=args.suffix)
+    logging.info("Found %d outputs", len(sources))
+
+    if args.patterns:
+        desired = desired_by_pattern(sources, read_patterns(args.patterns), suffix=args.suffix)
+    else:
+        mapping = Mapping()
+        with contextlib.redirect_stdout(sys.stderr):
+            mapping.load(args.mapping_file)
+            if args.sites_file:
+                mapping.load_site_mapping(args.sites_file)
+        desired, result = desired_by_site(sources, mapping)
+        mapping.report(result, stream=sys.stderr)
+
+    plan = reconcile(desired, args.destination, groups=args.groups, suffix=args.suffix, dry_run=args.dry_run)
+    summary = plan.summary()
+    sys.stderr.write("{}{} added, {} replaced, {} removed, {} unchanged, {} label directories changed\n".format(
+        "Dry run: " if args.dry_run else "", summary['add'], summary['replace'], summary['remove'],
+        summary['unchanged'], summary['groups']))
+    for target, error in plan.failed:
+        sys.stderr.write("Failed: " + target + ": " + error + "\n")
+
+    for group, label in plan.changed:
+        print(os.path.join(args.destination, group, label))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'summary': summary,
+                       'add': [[g, l, name, s.path] for (g, l), name, s in plan.add],
+                       'replace': [[g, l, name, s.path] for (g, l), name, s in plan.replace],
+                       'remove': [[g, l, name] for (g, l), name in plan.remove],
+                       'failed': plan.failed,
+                       'changed': ["/".join(p) for p in plan.changed]}, f, indent=1)
+
+    return 1 if plan.failed else 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
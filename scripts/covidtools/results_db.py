@@ -0,0 +1,82 @@
+# Author: Andreas Wilke
+
+# Load run results (sample mapping, demix outputs, coverage.all.txt and
+# .version/.freyja_version provenance) into an indexed SQLite database and
+# export the TSVs update-sample-mapping.py and the aggregate step produce.
+# Ingest replaces a run as a whole and skips runs that did not change.
+#
+#   results-db.py ingest /local/incoming/covid/runs/*/
+#   results-db.py export-mapping --run 220407 > 220407.sample-mapping.tsv.updated.tsv
+#   results-db.py export-aggregate --site S0024 --since 2022-01-01 > S0024.aggregate.line.tsv
+#   results-db.py sql "SELECT lineage, count(*) FROM abundances GROUP BY lineage"
+
+import argparse
+import logging
+import os
+import sys
+from lib.warehouse import DEFAULT_DB, connect, export_aggregate, export_mapping, ingest_run, query
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Indexed SQLite database of results across runs.')
+    parser.add_argument('--db', dest='db', default=DEFAULT_DB, help='Database file, default ' + DEFAULT_DB)
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help='Load or refresh runs')
+    ingest.add_argument('runs', nargs='+', help='Run directories')
+    ingest.add_argument('--force', dest='force', default=False, action='store_true',
+                        help='Reload runs even if unchanged')
+
+    for name, text in [('export-mapping', 'Sample mapping with coverage and demix columns'),
+                       ('export-aggregate', 'Aggregate lines per demix output')]:
+        export = commands.add_parser(name, help=text)
+        export.add_argument('--run', dest='run', default=None)
+        export.add_argument('--site', dest='sites', nargs='+', default=None)
+        export.add_argument('--sample', dest='samples', nargs='+', default=None)
+        export.add_argument('--lineage', dest='lineage', default=None, help='Lineage or any of its sublineages')
+        export.add_argument('--since', dest='since', default=None, help='Collection date YYYY-MM-DD')
+        export.add_argument('--until', dest='until', default=None, help='Collection date YYYY-MM-DD')
+
+    sql = commands.add_parser('sql', help='Run a query, print TSV')
+    sql.add_argument('sql')
+    sql.add_argument('params', nargs='*')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    conn = connect(args.db)
+
+    if args.command == 'ingest':
+        for run_dir in args.runs:
+            if not os.path.isdir(run_dir):
+                logging.error("Not a directory: %s", run_dir)
+                continue
+            counts = ingest_run(conn, run_dir, force=args.force)
+            if counts is None:
+                logging.info("%s unchanged", run_dir)
+            else:
+                logging.info("%s: %s", run_dir, ", ".join("{} {}".format(v, k) for k, v in counts.items()))
+        return
+
+    filters = {}
+    if args.command != 'sql':
+        filters = {k: getattr(args, k) for k in ['run', 'sites', 'samples', 'lineage', 'since', 'until']}
+
+    if args.command == 'export-mapping':
+        logging.info("Exported %d samples", export_mapping(conn, **filters))
+    elif args.command == 'export-aggregate':
+        logging.info("Exported %d outputs", export_aggregate(conn, **filters))
+    elif args.command == 'sql':
+        query(conn, args.sql, args.params)
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
@@ -0,0 +1,101 @@
+# Author: Andreas Wilke
+
+# Roll up demix lineage abundances to parent clades using the hierarchy in
+# lineages.yml, e.g. everything below BA.2 or XBB. Inclusive by default, a
+# lineage counts towards every listed ancestor; --exclusive assigns it to the
+# nearest listed clade only and adds an Other column. With --by-site samples
+# are averaged per site and collection date for time series.
+#
+#   rollup-lineages.py -s output/ -m all.sample-mapping.tsv --clades BA.1 BA.2 BA.5 XBB --exclusive --by-site
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import numpy as np
+import scipy.sparse as sp
+from lib import bundle
+from lib.lineages import DEFAULT_LINEAGES, load
+from lib.mapping import Mapping
+from lib.warehouse import parse_demix
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Roll up demix abundances to parent clades.')
+    parser.add_argument('--source-dir', '-s', dest='source', nargs='+', required=True,
+                        help='Directories with demix .out files')
+    parser.add_argument('--clades', '-c', dest='clades', nargs='+', required=True)
+    parser.add_argument('--lineages', dest='lineages', default=DEFAULT_LINEAGES,
+                        help='lineages.yml, default ' + DEFAULT_LINEAGES)
+    parser.add_argument('--alias-key', dest='alias_key', default=None, help='Pango alias_key.json')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        help='Where to keep the compiled hierarchy, default next to lineages.yml')
+    parser.add_argument('--mapping-file', '-m', dest='mapping_file', default=None,
+                        help='Sample mapping for site and collection date')
+    parser.add_argument('--exclusive', dest='exclusive', default=False, action='store_true',
+                        help='Assign each lineage to its nearest listed clade, rest to Other')
+    parser.add_argument('--by-site', dest='by_site', default=False, action='store_true',
+                        help='Mean per site and collection date, needs --mapping-file')
+    parser.add_argument('--level', dest='level', default="WARNING", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    if args.by_site and not args.mapping_file:
+        sys.exit("--by-site needs --mapping-file")
+
+    hierarchy = load(args.lineages, alias_key=args.alias_key, cache_dir=args.cache_dir)
+    logging.info("Loaded %d lineages", len(hierarchy))
+
+    files = []
+    for d in args.source:
+        if not os.path.isdir(d):
+            sys.exit("Not a directory: " + d)
+        files += [os.path.join(d, f) for f in bundle.listdir(d) if f.endswith(".out")]
+
+    demix = [parse_demix(f) for f in files]
+    matrix = hierarchy.abundance_matrix((d['lineages'], d['abundances']) for d in demix)
+    columns = list(args.clades) + (["Other"] if args.exclusive else [])
+    clades = hierarchy.rollup(matrix, args.clades, exclusive=args.exclusive)
+
+    keys = [(os.path.basename(f), None, None, None) for f in files]
+    if args.mapping_file:
+        mapping = Mapping()
+        with contextlib.redirect_stdout(sys.stderr):
+            mapping.load(args.mapping_file)
+        result = mapping.resolve([os.path.basename(f) for f in files])
+        mapping.report(result, stream=sys.stderr)
+        resolved = {path: (path, Id, date, site) for path, Id, date, site in result['samples']}
+        keys = [resolved.get(k[0], k) for k in keys]
+
+    if not args.by_site:
+        print("\t".join(["file", "sample_id", "date", "site_id"] + columns))
+        for (name, Id, date, site), row in zip(keys, clades):
+            print("\t".join([name, Id or "", date or "", site or ""] + ["{:.6g}".format(v) for v in row]))
+        return
+
+    # group indicator matrix, one multiply for all sites and dates
+    groups = {}
+    member = []
+    for name, Id, date, site in keys:
+        member.append(groups.setdefault((site or "", date or ""), len(groups)))
+    indicator = sp.csr_matrix((np.ones(len(member)), (member, np.arange(len(member)))),
+                              shape=(len(groups), len(member)))
+    counts = np.asarray(indicator.sum(axis=1)).ravel()
+    means = (indicator @ clades) / counts[:, None]
+
+    print("\t".join(["site_id", "date", "samples"] + columns))
+    for (site, date), g in sorted(groups.items()):
+        print("\t".join([site, date, str(int(counts[g]))] + ["{:.6g}".format(v) for v in means[g]]))
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
@@ -0,0 +1,170 @@
+# Author: Andreas Wilke
+
+# Export the fastq pairs of a run for IDPH: for every sample in the run's
+# *.sample-mapping.tsv (sample ID in the first column, site ID in the second)
+# whose site is not in the blacklist, hardlink or copy <sample>*.fastq* from
+# reads/ to the target directory. reads/ is listed once into a sorted index;
+# exports go through lib.staging, so copies run in parallel with md5
+# checksums and a manifest in the target directory makes re-runs resumable.
+#
+#   run2idph --run-dir runs/220407 --blacklist blacklist.tsv --target-dir /vol/idph/220407 --stats
+#   run2idph --run-dir runs/220407 --mapping-file a.sample-mapping.tsv b.sample-mapping.tsv --list
+
+import argparse
+import glob
+import logging
+import os
+import sys
+from lib.staging import ReadIndex, stage
+
+ID_COLUMNS = ["sample_id", "sample id"]
+MANIFEST = "run2idph.manifest.tsv"
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Command line options for moving IDPH data to a target directory. Uses *.sample-mapping.tsv file.')
+    parser.add_argument('--run-dir', dest='run_dir',
+                        help='Directory with fastq for samples in sample-mapping file.')
+    parser.add_argument('--target-dir', dest='target_dir', default=None,
+                        help='Destination for fastq files.')
+    parser.add_argument('--mapping-file', dest='mapping_files', nargs='+', default=None,
+                        help='Sample mapping files, default all *.sample-mapping.tsv in the run directory')
+    parser.add_argument('--blacklist', dest='blacklist', default=None,
+                        help='Blacklist file , containes site IDs')
+    parser.add_argument('--list', dest='list', default=False, action='store_true',
+                        help='Do not copy but print list of source files.')
+    parser.add_argument('--threads', '-t', dest='threads', type=int, default=8,
+                        help='Number of parallel copies')
+    parser.add_argument('--manifest', dest='manifest', default=None,
+                        help='Manifest file, default <target-dir>/' + MANIFEST)
+    parser.add_argument('--no-link', dest='link', default=True, action='store_false',
+                        help='Always copy, never hardlink')
+    parser.add_argument('--verify', dest='verify', default=False, action='store_true',
+                        help='Re-read copies and compare checksums')
+    parser.add_argument('--stats', dest='stats', default=False, action='store_true',
+                        help='Print a summary of samples and exported files')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def get_mapping_files(run_dir, mapping_files=None) -> list:
+    if mapping_files:
+        missing = [m for m in mapping_files if not os.path.isfile(m)]
+        if missing:
+            sys.exit("No such mapping file: " + ", ".join(missing))
+        return mapping_files
+    return sorted(glob.glob(os.path.join(run_dir, '*.sample-mapping.tsv')))
+
+
+def read_samples(mapping_files) -> dict:
+    """Sample ID -> site ID from one or more mapping files, the first file listing a sample wins"""
+
+    samples = {}
+    for mfile in mapping_files:
+        with open(mfile, encoding='utf-8', errors='replace') as f:
+            for l in f:
+                columns = l.rstrip("\r\n").split("\t")
+                prefix = columns[0].strip()
+                if not prefix or prefix.lower() in ID_COLUMNS or len(columns) < 2:
+                    continue
+                samples.setdefault(prefix, columns[1].strip())
+    return samples
+
+
+def get_blacklist(blacklist_file) -> set:
+    """Site IDs, any tab separated field of the file"""
+
+    blacklist = set()
+    if blacklist_file and os.path.isfile(blacklist_file):
+        with open(blacklist_file, "r") as f:
+            for l in f:
+                blacklist.update(ID for ID in l.rstrip("\r\n").split("\t") if ID)
+    else:
+        logging.error("Missing blacklist file")
+    return blacklist
+
+
+def select(samples, index, blacklist) -> tuple:
+    """Fastq pairs to export and per category sample lists for the summary"""
+
+    files = {}
+    report = {'blacklisted': [], 'missing': [], 'ambiguous': []}
+    for prefix, site in samples.items():
+        if site in blacklist:
+            logging.debug("In Blacklist: %s , %s", prefix, site)
+            report['blacklisted'].append(prefix)
+            continue
+        fqs = index.find(prefix)
+        if len(fqs) == 2:
+            files[prefix] = fqs
+        else:
+            logging.debug("Found %d files for prefix: %s", len(fqs), prefix)
+            report['missing' if len(fqs) < 2 else 'ambiguous'].append(prefix)
+    return files, report
+
+
+def write_stats(stream, samples, files, report, stats=None, limit=10):
+    stream.write("Samples in mapping:\t" + str(len(samples)) + "\n")
+    stream.write("Samples selected:\t" + str(len(files)) + "\n")
+    for what in ['blacklisted', 'missing', 'ambiguous']:
+        items = report[what]
+        shown = ", ".join(items[:limit]) + (" ..." if len(items) > limit else "")
+        stream.write("Samples " + what + ":\t" + str(len(items)) + ("\t" + shown if items else "") + "\n")
+    if stats:
+        for key in ['staged', 'linked', 'copied', 'skipped', 'bytes', 'seconds']:
+            stream.write("Files " + key + ":\t" + str(stats[key]) + "\n")
+        stream.write("Files failed:\t" + str(len(stats['failed'])) + "\n")
+
+
+def run(args):
+
+    if not (args.run_dir and os.path.isdir(os.path.join(args.run_dir, 'reads'))):
+        logging.critical("Missing run directory: %s", str(args.run_dir))
+        sys.exit(404)
+
+    mapping_files = get_mapping_files(args.run_dir, args.mapping_files)
+    if not mapping_files:
+        sys.exit("No *.sample-mapping.tsv in " + args.run_dir)
+    logging.info("Mapping files: %s", " ".join(mapping_files))
+
+    blacklist = get_blacklist(args.blacklist)
+    samples = read_samples(mapping_files)
+    index = ReadIndex(os.path.join(args.run_dir, 'reads'))
+    files, report = select(samples, index, blacklist)
+    for what in ['missing', 'ambiguous']:
+        if report[what]:
+            logging.error("%s files for %d samples: %s", what.capitalize(), len(report[what]),
+                          ", ".join(report[what][:10]) + (" ..." if len(report[what]) > 10 else ""))
+
+    if args.list:
+        for prefix in files:
+            for f in files[prefix]:
+                print("\t".join([prefix, f]))
+        if args.stats:
+            write_stats(sys.stderr, samples, files, report)
+        return 0
+
+    if not (args.target_dir and os.path.isdir(args.target_dir)):
+        logging.warning("No valid target directory: %s", args.target_dir)
+        if args.stats:
+            write_stats(sys.stdout, samples, files, report)
+        return 1
+
+    manifest = args.manifest or os.path.join(args.target_dir, MANIFEST)
+    stats = stage([f for prefix in files for f in files[prefix]], args.target_dir, manifest,
+                  threads=args.threads, link=args.link, verify=args.verify)
+    logging.info("Exported %d files (linked %d, copied %d), skipped %d, failed %d",
+                 stats['staged'], stats['linked'], stats['copied'], stats['skipped'], len(stats['failed']))
+    if args.stats:
+        write_stats(sys.stdout, samples, files, report, stats)
+    return 1 if stats['failed'] else 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
@@ -0,0 +1,114 @@
+# Author: Andreas Wilke
+
+# Smoothed lineage prevalence per site and per label of every label group
+# (City, County, Region, ... from the sites2labels mapping), the series
+# freyja plot --lineages draws, as data. For every label and collection date
+# the prevalence is the mean abundance over all samples collected in the
+# --window days up to that date (--center: around it). All labels of a group
+# are computed at once; with --output-dir one tidy table per group is
+# written to <group>.smoothed.tsv for plots, dashboards and exports.
+# --clades rolls lineages up to parent clades first, see rollup-lineages.py.
+#
+#   smooth-prevalence.py -s runs/*/output -m all.sample-mapping.tsv --sites2labels mapping.tsv --output-dir aggregate/smoothed
+#   smooth-prevalence.py -s output/ -m all.sample-mapping.tsv --groups site_id --clades BA.2 BA.5 XBB --exclusive --window 21
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import numpy as np
+from lib import bundle
+from lib.mapping import Mapping
+from lib.prevalence import HEADER, WINDOW, day_number, lineage_matrix, memberships, rows, smooth, write_table
+from lib.warehouse import parse_demix
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Rolling window lineage prevalence per site and label group.')
+    parser.add_argument('--source-dir', '-s', dest='source', nargs='+', required=True,
+                        help='Directories with demix .out files')
+    parser.add_argument('--mapping-file', '-m', dest='mapping_file', required=True,
+                        help='Sample mapping for site and collection date')
+    parser.add_argument('--sites2labels', dest='sites_file', default=None, help='Site mapping with the label groups')
+    parser.add_argument('--groups', dest='groups', nargs='+', default=None,
+                        help='Label groups to compute, default all; site_id for sites')
+    parser.add_argument('--window', dest='window', type=int, default=WINDOW,
+                        help='Window in days, default {}'.format(WINDOW))
+    parser.add_argument('--center', dest='center', default=False, action='store_true',
+                        help='Window centered on the date instead of ending at it')
+    parser.add_argument('--min-prevalence', dest='min_prevalence', type=float, default=0.0,
+                        help='Leave out rows below this prevalence')
+    parser.add_argument('--clades', '-c', dest='clades', nargs='+', default=None,
+                        help='Roll lineages up to these clades first')
+    parser.add_argument('--exclusive', dest='exclusive', default=False, action='store_true',
+                        help='With --clades, nearest listed clade only, rest to Other')
+    parser.add_argument('--lineages', dest='lineages', default=None, help='lineages.yml for --clades')
+    parser.add_argument('--output-dir', '-o', dest='output_dir', default=None,
+                        help='Write <group>.smoothed.tsv per group instead of one table to stdout')
+    parser.add_argument('--level', dest='level', default="WARNING", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    files = []
+    for d in args.source:
+        if not os.path.isdir(d):
+            sys.exit("Not a directory: " + d)
+        files += [os.path.join(d, f) for f in bundle.listdir(d) if f.endswith(".out")]
+
+    mapping = Mapping()
+    with contextlib.redirect_stdout(sys.stderr):
+        mapping.load(args.mapping_file)
+        if args.sites_file:
+            mapping.load_site_mapping(args.sites_file)
+    result = mapping.resolve([os.path.basename(f) for f in files])
+    mapping.report(result, stream=sys.stderr)
+
+    # samples with site and date only
+    paths = {os.path.basename(f): f for f in files}
+    samples = [(paths[name], site, day_number(date)) for name, Id, date, site in result['samples']
+               if site and day_number(date) is not None]
+    logging.info("%d of %d demix outputs with site and collection date", len(samples), len(files))
+    if not samples:
+        return 1
+
+    demix = [parse_demix(path) for path, site, day in samples]
+    if args.clades:
+        from lib.lineages import DEFAULT_LINEAGES, load
+        hierarchy = load(args.lineages or DEFAULT_LINEAGES)
+        counts = hierarchy.abundance_matrix((d['lineages'], d['abundances']) for d in demix)
+        columns = list(args.clades) + (["Other"] if args.exclusive else [])
+        matrix = hierarchy.rollup(counts, args.clades, exclusive=args.exclusive)
+    else:
+        columns, matrix = lineage_matrix(demix)
+    days = np.array([day for path, site, day in samples], dtype=np.int64)
+
+    groups = memberships([site for path, site, day in samples], mapping, args.groups)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    else:
+        print("\t".join(HEADER))
+    for group, (labels, unit, sample) in groups.items():
+        smoothed = smooth(unit, sample, days, matrix, window=args.window, center=args.center)
+        table = rows(group, labels, columns, smoothed, args.min_prevalence)
+        if args.output_dir:
+            n = write_table(os.path.join(args.output_dir, group + ".smoothed.tsv"), table)
+        else:
+            n = 0
+            for r in table:
+                print("\t".join(r))
+                n += 1
+        logging.info("%s: %d labels, %d dates, %d rows", group, len(labels), len(smoothed['day']), n)
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
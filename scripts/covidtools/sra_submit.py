@@ -0,0 +1,204 @@
+# Author: Andreas Wilke
+
+# Build the SRA RUN and BIOSAMPLE files for one or more run folders from the
+# sample mapping and upload them with the fastq pairs to the CDC endpoint.
+# Templates (*.run.tmpl.tsv or *.sra.tmpl.tsv, *.biosample.tmpl.tsv, found in
+# the run folder like sra-upload does) give the columns in the first row and
+# optional values in the second; values may use {placeholders} and empty ones
+# are filled from the mapping column of the same name, plus sample_id, run,
+# filename and filename2. Fastqs of all runs go over --connections parallel
+# connections to <dest>/<run>/ as <name>.part, resume after interruptions and
+# are renamed when complete; metadata files follow once every fastq of their
+# run is up. SRA/upload.manifest.tsv in each run folder records finished files
+# with md5, re-runs skip them.
+#
+#   sra-submit.py runs/230712 runs/230719 --connections 8 --dry-run
+#   FTP_USER=IL_NWSS sra-submit.py runs/230712 --url sftp://eft.cdc.gov --dest /Data/Prod/
+#   sra-submit.py runs/230712 --url file:///tmp/standin          # local stand-in for the endpoint
+
+import argparse
+import glob
+import logging
+import os
+import sys
+from lib.staging import ReadIndex
+from lib.submission import CHUNK_SIZE, PROTOCOLS, Upload, connector, fill, read_template, submit, write_metadata
+
+ID_COLUMNS = ["sample_id", "sample id"]
+MANIFEST = "upload.manifest.tsv"
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Create RUN and BIOSAMPLE files and upload fastqs for SRA submission.')
+    parser.add_argument('run_folders', nargs='+', help='Run folders, one submission each')
+    parser.add_argument('--mapping-file', '-m', dest='mapping_file', default=None,
+                        help='Sample mapping, default the *.sample-mapping.tsv of each run folder')
+    parser.add_argument('--sequence-dir', dest='sequence_dir', default=None,
+                        help='Fastq directory, searched recursively, default <run folder>/reads or the run folder')
+    parser.add_argument('--run-template', dest='run_template', default=None)
+    parser.add_argument('--biosample-template', dest='biosample_template', default=None)
+    parser.add_argument('--url', dest='url', default=os.environ.get('FTP_URL', 'eft.cdc.gov'),
+                        help='Endpoint, [sftp|ftp|ftps|file]://host, default $FTP_URL or eft.cdc.gov')
+    parser.add_argument('--protocol', dest='protocol', default='sftp', choices=PROTOCOLS,
+                        help='Protocol for a --url without scheme')
+    parser.add_argument('--dest', dest='dest', default=os.environ.get('FTP_DEST', '/Data/Prod/'),
+                        help='Upload directory, default $FTP_DEST or /Data/Prod/')
+    parser.add_argument('--remote-dir', dest='remote_dir', default='{run}',
+                        help='Per run directory below --dest, "" to upload flat')
+    parser.add_argument('--user', dest='user', default=os.environ.get('FTP_USER'))
+    parser.add_argument('--password', dest='password', default=os.environ.get('FTP_PASSWORD'),
+                        help='Default $FTP_PASSWORD, FTP only; SFTP needs key authentication')
+    parser.add_argument('--connections', '-c', dest='connections', type=int, default=4,
+                        help='Parallel connections')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help='Transfer block size in MB')
+    parser.add_argument('--retries', dest='retries', type=int, default=3, help='Retries per file')
+    parser.add_argument('--retry-wait', dest='retry_wait', type=float, default=5.0,
+                        help='Seconds before the first retry, grows per attempt')
+    parser.add_argument('--metadata-only', dest='metadata_only', default=False, action='store_true',
+                        help='Write RUN and BIOSAMPLE files, upload nothing')
+    parser.add_argument('--dry-run', '-n', dest='dry_run', default=False, action='store_true',
+                        help='List what would be written and uploaded')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def find_one(folder, patterns) -> str:
+    """Exactly one file below folder for the first pattern that matches anything"""
+
+    for pattern in patterns:
+        found = sorted(glob.glob(os.path.join(folder, "**", pattern), recursive=True))
+        if len(found) == 1:
+            return found[0]
+        if found:
+            sys.exit("Found " + str(len(found)) + " files for " + pattern + ": " + " ".join(found))
+    sys.exit("No " + " or ".join(patterns) + " in " + folder)
+
+
+def read_mapping(path) -> dict:
+    """Sample ID -> row as dict, column names lower case with _ for spaces"""
+
+    records = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        header = [h.strip().lower().replace(" ", "_") for h in f.readline().rstrip("\r\n").split("\t")]
+        id_column = next((header.index(c.replace(" ", "_")) for c in ID_COLUMNS if c.replace(" ", "_") in header), 0)
+        for l in f:
+            values = [v.strip() for v in l.rstrip("\r\n").split("\t")]
+            if len(values) <= id_column or not values[id_column]:
+                continue
+            records.setdefault(values[id_column], dict(zip(header, values)))
+    return records
+
+
+def prepare(folder, args) -> tuple:
+    """Metadata files and uploads for one run folder"""
+
+    name = os.path.basename(os.path.abspath(folder))
+    sra_dir = os.path.join(folder, "SRA")
+    mapping = read_mapping(args.mapping_file or find_one(folder, ["*.sample-mapping.tsv"]))
+    sequence_dir = args.sequence_dir or (os.path.join(folder, "reads") if os.path.isdir(os.path.join(folder, "reads")) else folder)
+    index = ReadIndex(sequence_dir, recursive=True)
+
+    records, missing = [], []
+    for sample, row in mapping.items():
+        fqs = sorted(index.find(sample))
+        if len(fqs) != 2:
+            missing.append(sample)
+            continue
+        record = dict(row, sample_id=sample, run=name,
+                      filename=os.path.basename(fqs[0]), filename2=os.path.basename(fqs[1]))
+        records.append((record, fqs))
+    if missing:
+        logging.warning("%s: no fastq pair for %d samples: %s", name, len(missing),
+                        ", ".join(missing[:10]) + (" ..." if len(missing) > 10 else ""))
+
+    metadata = []
+    for template in [args.run_template or find_one(folder, ["*.run.tmpl.tsv", "*.sra.tmpl.tsv"]),
+                     args.biosample_template or find_one(folder, ["*.biosample.tmpl.tsv"])]:
+        header, values = read_template(template)
+        out = os.path.join(os.path.dirname(template), os.path.basename(template)[:-len(".tmpl.tsv")] + ".tsv")
+        metadata.append((out, header, [fill(header, values, r) for r, fqs in records]))
+
+    remote_dir = args.remote_dir.format(run=name).strip("/")
+    manifest = os.path.join(sra_dir, MANIFEST)
+    fastqs = [(fq, "/".join(filter(None, [remote_dir, os.path.basename(fq)]))) for r, fqs in records for fq in fqs]
+    return name, remote_dir, manifest, metadata, fastqs
+
+
+def report(name, what, stats):
+    logging.info("%s %s: uploaded %d (resumed %d), skipped %d, failed %d, %d bytes in %ss", name, what,
+                 stats['uploaded'], stats['resumed'], stats['skipped'], len(stats['failed']), stats['bytes'],
+                 stats.get('seconds', 0))
+
+
+def run(args):
+
+    for folder in args.run_folders:
+        if not os.path.isdir(folder):
+            sys.exit("Not a directory: " + folder)
+
+    runs = [prepare(folder, args) for folder in args.run_folders]
+
+    for run_name, remote_dir, manifest, metadata, fastqs in runs:
+        for out, header, rows in metadata:
+            if args.dry_run:
+                print("\t".join(["metadata", out, str(len(rows)) + " rows"]))
+            elif write_metadata(out, header, rows):
+                logging.info("Wrote %s, %d rows", out, len(rows))
+        if not args.dry_run:
+            os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    if args.metadata_only:
+        return 0
+
+    connect = connector(args.url, user=args.user, password=args.password, dest=args.dest, protocol=args.protocol)
+    if not args.dry_run:
+        transport = connect()
+        try:
+            for run_name, remote_dir, manifest, metadata, fastqs in runs:
+                if remote_dir:
+                    transport.makedirs(remote_dir)
+        finally:
+            transport.close()
+
+    options = dict(connections=args.connections, retries=args.retries, retry_wait=args.retry_wait,
+                   chunk_size=args.chunk_size * 1024 * 1024, dry_run=args.dry_run)
+
+    # fastqs of all runs share the connections, a run's metadata goes last and only if its fastqs are complete
+    uploads = [Upload(fq, remote, manifest) for run_name, remote_dir, manifest, metadata, fastqs in runs
+               for fq, remote in fastqs]
+    stats = submit(uploads, connect, **options)
+    report("all runs", "fastq", stats)
+    failed = list(stats['failed'])
+    planned = list(stats['planned'])
+
+    for run_name, remote_dir, manifest, metadata, fastqs in runs:
+        if any(remote in stats['failed'] for fq, remote in fastqs):
+            logging.error("%s: fastq uploads failed, not sending metadata", run_name)
+            continue
+        remotes = [(out, "/".join(filter(None, [remote_dir, os.path.basename(out)]))) for out, header, rows in metadata]
+        if args.dry_run:
+            # not written yet in a dry run, listed unless the manifest has the current file
+            planned += [remote for out, remote in remotes if not os.path.isfile(out)]
+        uploads = [Upload(out, remote, manifest) for out, remote in remotes if os.path.isfile(out)]
+        meta = submit(uploads, connect, **options)
+        report(run_name, "metadata", meta)
+        failed += meta['failed']
+        planned += meta['planned']
+
+    if args.dry_run:
+        for remote in planned:
+            print("\t".join(["upload", remote]))
+    if failed:
+        logging.error("Failed uploads: %s", " ".join(failed))
+        return 1
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
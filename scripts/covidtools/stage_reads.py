@@ -0,0 +1,73 @@
+# Author: Andreas Wilke
+
+# Stage fastq and sample mapping files from a sequencing run into a covid run folder.
+# Files are hardlinked when source and run folder share a filesystem, otherwise
+# copied in parallel. Every staged file is recorded in staging.manifest.tsv
+# (path, size, mtime, md5, method), md5 is "-" for hardlinks as they share the
+# source inode; re-runs skip files already staged.
+
+import argparse
+import logging
+import os
+import sys
+from lib.staging import discover, stage
+from lib.timing import timed
+
+FASTQ_PATTERN = "*.fastq.gz"
+MAPPING_PATTERN = "*.sample-mapping.tsv"
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Stage fastq and sample mapping files into a covid run folder.')
+    parser.add_argument('--source-dir', '-s', dest='source', required=True,
+                        help='Sequencing run directory, searched recursively')
+    parser.add_argument('--run-dir', '-r', dest='run_dir', required=True,
+                        help='Covid run directory, fastqs go into samples/')
+    parser.add_argument('--threads', '-t', dest='threads', type=int, default=8,
+                        help='Number of parallel copies')
+    parser.add_argument('--manifest', dest='manifest', default=None,
+                        help='Manifest file, default <run-dir>/staging.manifest.tsv')
+    parser.add_argument('--no-link', dest='link', default=True, action='store_false',
+                        help='Always copy, never hardlink')
+    parser.add_argument('--verify', dest='verify', default=False, action='store_true',
+                        help='Re-read copies and compare checksums')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    if not os.path.isdir(args.source):
+        sys.exit("Not a directory: " + str(args.source))
+
+    samples_dir = os.path.join(args.run_dir, "samples")
+    if not os.path.isdir(samples_dir):
+        os.makedirs(samples_dir)
+
+    manifest = args.manifest or os.path.join(args.run_dir, "staging.manifest.tsv")
+    found = discover(args.source, [FASTQ_PATTERN, MAPPING_PATTERN])
+    logging.info("Found %d fastq and %d mapping files in %s",
+                 len(found[FASTQ_PATTERN]), len(found[MAPPING_PATTERN]), args.source)
+
+    failed = []
+    for pattern, dest_dir in [(FASTQ_PATTERN, samples_dir), (MAPPING_PATTERN, args.run_dir)]:
+        stats = stage(found[pattern], dest_dir, manifest, base_dir=args.run_dir,
+                      threads=args.threads, link=args.link, verify=args.verify)
+        logging.info("%s: staged %d (linked %d, copied %d), skipped %d, failed %d, %d bytes in %ss",
+                     pattern, stats['staged'], stats['linked'], stats['copied'], stats['skipped'],
+                     len(stats['failed']), stats['bytes'], stats['seconds'])
+        failed += stats['failed']
+
+    if failed:
+        sys.exit("Failed staging " + str(len(failed)) + " files")
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    with timed("staging"):
+        return run(args)
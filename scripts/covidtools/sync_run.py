@@ -0,0 +1,86 @@
+# Author: Andreas Wilke
+
+# Transfer only what is missing or changed between a run directory and its
+# copy on another host. Both sides are described by a manifest (path, size,
+# mtime, md5), the remote one is built by piping lib/transfer.py to python3
+# over ssh. Files are hashed only if they have the same size but another
+# mtime on both sides; md5s are cached in .transfer.manifest.tsv per
+# directory. The delta
+# is split into --streams batches of similar size, each its own rsync (or a
+# plain copy between local directories); .bam and .gz batches are sent
+# without compression. Mode and group are set as files are written, and
+# --flatten puts files into one directory, replacing the find -exec mv step.
+#
+#   sync-run.py wilke@locust:/vol/sars2/jdavis/Sarah/220407 runs/220407 --include "*.sorted.bam" --flatten staging
+#   sync-run.py runs/220407 wilke@locust:/vol/sars2/jdavis/Sarah/220407 --include "*.fastq.gz" Makefile --chmod g+w --group collab
+
+import argparse
+import logging
+from lib.transfer import add_checksums, delta, manifest, record, split_endpoint, target_path, transfer, unsettled
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Manifest based delta transfer of a run directory.')
+    parser.add_argument('source', help='Directory or host:directory to read from')
+    parser.add_argument('destination', help='Directory or host:directory to write to')
+    parser.add_argument('--include', '-i', dest='includes', nargs='+', default=[],
+                        help='File name or relative path globs to transfer, default everything')
+    parser.add_argument('--exclude', '-e', dest='excludes', nargs='+', default=[])
+    parser.add_argument('--flatten', dest='flatten', default=None,
+                        help='Put files into this directory of the destination by name')
+    parser.add_argument('--streams', '-s', dest='streams', type=int, default=4, help='Parallel transfer streams')
+    parser.add_argument('--chmod', dest='chmod', default=None, help='Mode change for written files, e.g. g+w')
+    parser.add_argument('--group', dest='group', default=None, help='Group for written files')
+    parser.add_argument('--ssh', dest='ssh', default="ssh", help='Remote shell, e.g. "ssh -i ~/.ssh/covid_rsa"')
+    parser.add_argument('--rsync', dest='rsync', default="rsync")
+    parser.add_argument('--no-checksum', dest='checksum', default=True, action='store_false',
+                        help='Compare size and mtime only')
+    parser.add_argument('--dry-run', '-n', dest='dry_run', default=False, action='store_true',
+                        help='List files that would be transferred')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    # stat only, cached md5s are filled in; files are hashed only if size and mtime do not settle it
+    source = manifest(args.source, args.includes, args.excludes, checksum=False, ssh=args.ssh)
+    if not source and not split_endpoint(args.source)[0]:
+        logging.warning("Nothing to transfer in %s", args.source)
+    dest = manifest(args.destination, args.includes, args.excludes, checksum=False, ssh=args.ssh)
+    if args.checksum:
+        suspects = unsettled(source, dest, flatten=args.flatten)
+        if suspects:
+            logging.info("%d files with the same size but another mtime, comparing md5s", len(suspects))
+        add_checksums(args.source, source, suspects, ssh=args.ssh)
+        add_checksums(args.destination, dest, [target_path(f, args.flatten) for f in suspects], ssh=args.ssh)
+    files = delta(source, dest, flatten=args.flatten, checksum=args.checksum)
+    size = sum(source[f]['size'] for f in files)
+    logging.info("%d of %d files to transfer, %d bytes", len(files), len(source), size)
+
+    if args.dry_run:
+        for f in files:
+            print(f)
+        return 0
+    if not files:
+        return 0
+
+    stats = transfer(args.source, args.destination, files, {f: source[f]['size'] for f in files},
+                     streams=args.streams, flatten=args.flatten, chmod=args.chmod, group=args.group,
+                     ssh=args.ssh, rsync=args.rsync)
+    record(args.destination, source, [f for f in files if f not in stats['failed']], flatten=args.flatten)
+    logging.info("Transferred %d files, %d bytes over %d streams in %ss, %d failed",
+                 stats['files'], stats['bytes'], stats['streams'], stats['seconds'], len(stats['failed']))
+    for error in stats.get('errors', []):
+        logging.error(error)
+    return 1 if stats['failed'] else 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
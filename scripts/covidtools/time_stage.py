@@ -0,0 +1,25 @@
+# Author: Andreas Wilke
+
+# Run a pipeline command and append a timing event (wall/cpu time, peak RSS,
+# block I/O) to the run's timing log, $COVID_TIMING_LOG or logs/timing.jsonl.
+#
+#   time-stage.py --stage demix --sample 22501_S53 -- singularity exec ...
+
+import argparse
+import sys
+from lib.timing import run_command
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a command and record its resource usage.')
+    parser.add_argument('--stage', dest='stage', required=True, help='Pipeline stage, e.g. assembly, variants, demix')
+    parser.add_argument('--sample', dest='sample', default=None, help='Sample name, if the command is per sample')
+    parser.add_argument('--log', dest='log', default=None, help='Timing log, default $COVID_TIMING_LOG or logs/timing.jsonl')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to run, after --')
+    args = parser.parse_args(argv)
+
+    cmd = args.command[1:] if args.command and args.command[0] == "--" else args.command
+    if not cmd:
+        sys.exit("Missing command")
+
+    return run_command(cmd, args.stage, sample=args.sample, path=args.log)
@@ -0,0 +1,81 @@
+# Author: Andreas Wilke
+
+# Summarize timing logs written by time-stage.py per stage, and optionally
+# compare against a baseline run to flag regressions, e.g. after switching
+# FREYJA_VERSION.
+#
+#   timing-report.py runs/220407/                       # one run
+#   timing-report.py runs/220407/ --baseline runs/220330/ --threshold 0.2
+
+import argparse
+import json
+import os
+import sys
+from lib.timing import DEFAULT_LOG, compare, read_events, summarize
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Aggregate pipeline timing logs into per stage percentiles.')
+    parser.add_argument('runs', nargs='+', help='Run directories or timing.jsonl files')
+    parser.add_argument('--baseline', dest='baseline', nargs='+', default=[],
+                        help='Run directories or timing.jsonl files to compare against')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.2,
+                        help='Flag stages slower by more than this fraction, default 0.2')
+    parser.add_argument('--json', dest='json', default=False, action='store_true',
+                        help='Print summary and regressions as JSON')
+    return parser.parse_args(argv)
+
+
+def logs(paths):
+    files = []
+    for p in paths:
+        f = os.path.join(p, DEFAULT_LOG) if os.path.isdir(p) else p
+        if os.path.isfile(f):
+            files.append(f)
+        else:
+            sys.stderr.write("No timing log " + f + "\n")
+    return files
+
+
+def fmt(v, scale=1.0):
+    return "n/a" if v is None else "{:.2f}".format(v / scale)
+
+
+def print_summary(summary):
+    print("\t".join(["stage", "count", "failed", "wall_total_s", "wall_p50_s", "wall_p90_s", "wall_max_s",
+                     "cpu_p50_s", "rss_max_mb", "read_mb", "write_mb", "freyja_version"]))
+    for stage in sorted(summary, key=lambda s: -summary[s]['wall']['total']):
+        s = summary[stage]
+        print("\t".join([stage, str(s['count']), str(s['failed']),
+                         fmt(s['wall']['total']), fmt(s['wall']['p50']), fmt(s['wall']['p90']), fmt(s['wall']['max']),
+                         fmt(s['cpu']['p50']), fmt(s['max_rss_kb']['max'], 1024),
+                         fmt(s['read_bytes']['total'], 1024 ** 2), fmt(s['write_bytes']['total'], 1024 ** 2),
+                         ",".join(s['versions'])]))
+
+
+def run(args):
+
+    current = summarize(read_events(logs(args.runs)))
+    regressions = []
+    if args.baseline:
+        baseline = summarize(read_events(logs(args.baseline)))
+        regressions = compare(baseline, current, threshold=args.threshold)
+
+    if args.json:
+        print(json.dumps({'summary': current, 'regressions': regressions}, indent=2, sort_keys=True))
+    else:
+        print_summary(current)
+        if args.baseline:
+            print()
+            print("Regressions (> {:.0%}):".format(args.threshold) if regressions else "No regressions")
+            for r in regressions:
+                print("\t".join([r['stage'], r['metric'], r['stat'], fmt(r['baseline']), fmt(r['current']),
+                                 "{:+.0%}".format(r['change'])]))
+
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    return run(CLI(argv))
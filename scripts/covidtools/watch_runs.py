@@ -0,0 +1,192 @@
+# Author: Andreas Wilke
+
+# Watch the instrument drop directory and run process-covid-run on every
+# sequencing run once it is complete: the sentinel file exists and the fastqs
+# have not changed for --settle seconds, going by their mtimes, so a run that
+# landed while the watcher was down is complete when first seen. The primer
+# comes from a 'primer' column in the run's *.sample-mapping.tsv, else from
+# --primer-config (run name glob <tab> primer), else --primer. Up to --max-runs runs are
+# processed at the same time. Queued and processed runs are kept in --state so
+# a restart does not reprocess them; runs left queued or running by a crash or
+# restart are queued again. --once waits for runs that are still settling.
+#
+#   watch-runs.py --drop-dir /vol/sequencing/runs --primer-config config/primers.tsv --max-runs 2
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from lib.watch import Inotify, RunTracker, primer_for, read_primer_config, read_state, write_state
+
+BASE = "/local/incoming/covid"
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Process new sequencing runs as they land in the drop directory.')
+    parser.add_argument('--drop-dir', '-d', dest='drop_dir', required=True,
+                        help='Directory the instrument writes run folders into')
+    parser.add_argument('--sentinel', dest='sentinel', default="CopyComplete.txt",
+                        help='File (glob) marking a finished run, empty to rely on stable sizes only')
+    parser.add_argument('--settle', dest='settle', type=int, default=300,
+                        help='Seconds fastqs and sentinel must be unchanged, by mtime, default 300')
+    parser.add_argument('--poll', dest='poll', type=int, default=60,
+                        help='Rescan interval in seconds, default 60')
+    parser.add_argument('--poll-only', dest='poll_only', default=False, action='store_true',
+                        help='Do not use inotify, e.g. when the drop directory is written over NFS')
+    parser.add_argument('--max-runs', dest='max_runs', type=int, default=2,
+                        help='Number of runs processed concurrently')
+    parser.add_argument('--primer', dest='primer', default=None,
+                        help='Default primer if neither mapping nor config name one')
+    parser.add_argument('--primer-config', dest='primer_config', default=os.path.join(BASE, "config", "primers.tsv"),
+                        help='Run name glob and primer per line, tab separated')
+    parser.add_argument('--freyja-version', dest='freyja_version', default=os.environ.get("FREYJA_VERSION"),
+                        help='Passed to process-covid-run, default $FREYJA_VERSION')
+    parser.add_argument('--command', dest='command', default=os.path.join(BASE, "scripts", "process-covid-run"),
+                        help='Pipeline command, called as <command> <run dir> <primer> [freyja version]')
+    parser.add_argument('--then', dest='then', action='append', default=[],
+                        help='Shell command run after a successful run, {run} and {run_dir} are substituted; repeatable')
+    parser.add_argument('--state', dest='state', default=os.path.join(BASE, "runs", "watch.state.tsv"),
+                        help='Runs already queued or processed')
+    parser.add_argument('--log-dir', dest='log_dir', default=os.path.join(BASE, "runs", "watch-logs"),
+                        help='Pipeline output per run')
+    parser.add_argument('--once', dest='once', default=False, action='store_true',
+                        help='Process the runs that are complete or settling and exit')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class Watcher(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.tracker = RunTracker(sentinel=args.sentinel, settle=args.settle)
+        self.rules = read_primer_config(args.primer_config)
+        self.state = read_state(args.state)
+        interrupted = [run_dir for run_dir, s in self.state.items() if s['status'] in ("queued", "running")]
+        for run_dir in interrupted:
+            logging.warning("%s was %s when the watcher stopped, queueing it again", run_dir, self.state[run_dir]['status'])
+            del self.state[run_dir]
+        if interrupted:
+            write_state(args.state, self.state)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=args.max_runs)
+        self.running = set()
+        self.stop = False
+        self.inotify = None
+        if not args.poll_only:
+            try:
+                self.inotify = Inotify()
+                self.inotify.watch(args.drop_dir)
+            except (OSError, AttributeError) as e:
+                logging.warning("inotify not available, polling every %ss: %s", args.poll, e)
+
+    def update(self, run_dir, **fields):
+        with self.lock:
+            s = self.state.setdefault(run_dir, {'status': '', 'start': '', 'end': '', 'exit': ''})
+            s.update(fields)
+            write_state(self.args.state, self.state)
+
+    def candidates(self):
+        try:
+            entries = list(os.scandir(self.args.drop_dir))
+        except OSError as e:
+            logging.error("Can not read %s: %s", self.args.drop_dir, e)
+            return []
+        return sorted(e.path for e in entries if e.is_dir() and e.path not in self.state)
+
+    def scan(self):
+        for run_dir in self.candidates():
+            if self.inotify:
+                self.inotify.watch(run_dir)
+            if not self.tracker.complete(run_dir):
+                continue
+            self.tracker.forget(run_dir)
+            if self.inotify:
+                self.inotify.unwatch(run_dir)
+
+            primer = primer_for(run_dir, self.rules, default=self.args.primer)
+            if not primer:
+                logging.error("No primer for %s, add it to %s", run_dir, self.args.primer_config)
+                self.update(run_dir, status="no-primer")
+                continue
+
+            logging.info("Queueing %s with primer %s", run_dir, primer)
+            self.update(run_dir, status="queued")
+            self.pool.submit(self.process, run_dir, primer)
+
+    def process(self, run_dir, primer):
+        run = os.path.basename(run_dir.rstrip("/"))
+        os.makedirs(self.args.log_dir, exist_ok=True)
+        log_file = os.path.join(self.args.log_dir, run + ".log")
+
+        cmd = [self.args.command, run_dir, primer]
+        if self.args.freyja_version:
+            cmd.append(self.args.freyja_version)
+
+        self.update(run_dir, status="running", start=now())
+        logging.info("Starting %s", " ".join(cmd))
+        with open(log_file, "a") as log:
+            code = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+            covid_run_dir = os.path.join(BASE, "runs", run)
+            for then in self.args.then if code == 0 else []:
+                then = then.format(run=run, run_dir=covid_run_dir)
+                logging.info("Running %s", then)
+                code = subprocess.call(then, shell=True, stdout=log, stderr=subprocess.STDOUT)
+                if code != 0:
+                    break
+
+        status = "done" if code == 0 else "failed"
+        self.update(run_dir, status=status, end=now(), exit=str(code))
+        logging.info("%s %s with exit code %d, log in %s", run, status, code, log_file)
+
+    def wait(self):
+        if self.inotify:
+            self.inotify.wait(self.args.poll)
+        else:
+            time.sleep(self.args.poll)
+
+    def run(self):
+        while not self.stop:
+            self.scan()
+            if self.args.once and not self.tracker.pending():
+                break
+            self.wait()
+        self.pool.shutdown(wait=True)
+
+
+def run(args):
+
+    if not os.path.isdir(args.drop_dir):
+        sys.exit("Not a directory: " + str(args.drop_dir))
+
+    watcher = Watcher(args)
+
+    def shutdown(signum, frame):
+        logging.info("Stopping, waiting for running pipelines to finish")
+        watcher.stop = True
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    logging.info("Watching %s (%s)", args.drop_dir, "inotify" if watcher.inotify else "polling")
+    watcher.run()
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level)
+    return run(args)
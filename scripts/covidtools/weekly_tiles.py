@@ -0,0 +1,120 @@
+# Author: Andreas Wilke
+
+# Weekly rollups of demix abundances for every label dimension (site_id and
+# the sites2labels columns City, County, Region, ...) as one compact JSON
+# tile per dimension, <tiles>/<dimension>.json: label -> weeks (Monday of
+# the collection week), samples per week and mean lineage abundances.
+# index.json lists dimensions, labels and week ranges. Parsed outputs are
+# cached in tiles.cache.json, so an update parses only new or changed .out
+# files and rewrites only tiles whose content changed. --parquet also writes
+# a tidy <dimension>.parquet per tile (needs pyarrow).
+#
+#   weekly-tiles.py -s /local/incoming/covid/runs/*/output -m all.sample-mapping.tsv --sites2labels mapping.tsv -o aggregate/tiles
+#   weekly-tiles.py -s runs/*/output -m all.sample-mapping.tsv --sites2labels mapping.tsv -o aggregate/tiles/clades --clades BA.2 BA.5 XBB JN.1
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import numpy as np
+from lib import bundle
+from lib.mapping import Mapping
+from lib.prevalence import day_number, iso, lineage_matrix, memberships
+from lib.weekly import INDEX, TileCache, index, tidy_rows, tile, week_start, weekly_means, write_parquet, write_tile
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Weekly lineage rollups per label dimension as JSON tiles.')
+    parser.add_argument('--source-dir', '-s', dest='source', nargs='+', required=True,
+                        help='Directories with demix .out files')
+    parser.add_argument('--mapping-file', '-m', dest='mapping_file', required=True,
+                        help='Sample mapping for site and collection date')
+    parser.add_argument('--sites2labels', dest='sites_file', default=None, help='Site mapping with the label dimensions')
+    parser.add_argument('--groups', dest='groups', nargs='+', default=None,
+                        help='Label dimensions to export, default all; site_id for sites')
+    parser.add_argument('--output-dir', '-o', dest='output_dir', required=True, help='Tile directory')
+    parser.add_argument('--clades', '-c', dest='clades', nargs='+', default=None,
+                        help='Roll lineages up to these clades first')
+    parser.add_argument('--exclusive', dest='exclusive', default=False, action='store_true',
+                        help='With --clades, nearest listed clade only, rest to Other')
+    parser.add_argument('--lineages', dest='lineages', default=None, help='lineages.yml for --clades')
+    parser.add_argument('--parquet', dest='parquet', default=False, action='store_true',
+                        help='Also write <dimension>.parquet, tidy, needs pyarrow')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    if args.parquet:
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("--parquet needs pyarrow")
+
+    files = []
+    for d in args.source:
+        if not os.path.isdir(d):
+            sys.exit("Not a directory: " + d)
+        files += [os.path.join(d, f) for f in bundle.listdir(d) if f.endswith(".out")]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = TileCache(args.output_dir)
+    stats = cache.refresh(files)
+    logging.info("%d outputs parsed, %d unchanged, %d gone", stats['parsed'], stats['unchanged'], stats['dropped'])
+
+    mapping = Mapping()
+    with contextlib.redirect_stdout(sys.stderr):
+        mapping.load(args.mapping_file)
+        if args.sites_file:
+            mapping.load_site_mapping(args.sites_file)
+    result = mapping.resolve([os.path.basename(f) for f in files])
+    if args.level == "DEBUG":
+        mapping.report(result, stream=sys.stderr)
+
+    paths = {os.path.basename(f): f for f in files}
+    samples = [(paths[name], site, day_number(date)) for name, Id, date, site in result['samples']
+               if site and day_number(date) is not None]
+    logging.info("%d of %d outputs with site and collection date", len(samples), len(files))
+
+    demix = cache.demix([path for path, site, day in samples])
+    if args.clades:
+        from lib.lineages import DEFAULT_LINEAGES, load
+        hierarchy = load(args.lineages or DEFAULT_LINEAGES)
+        counts = hierarchy.abundance_matrix((d['lineages'], d['abundances']) for d in demix)
+        columns = list(args.clades) + (["Other"] if args.exclusive else [])
+        matrix = hierarchy.rollup(counts, args.clades, exclusive=args.exclusive)
+    else:
+        columns, matrix = lineage_matrix(demix)
+    weeks = week_start(np.array([day for path, site, day in samples], dtype=np.int64))
+
+    summary = {}
+    written = 0
+    for group, (labels, unit, sample) in memberships([site for path, site, day in samples], mapping, args.groups).items():
+        weekly = weekly_means(unit, sample, weeks, matrix)
+        name = group + ".json"
+        changed = write_tile(args.output_dir, name, tile(group, labels, columns, weekly), cache.tiles)
+        parquet = os.path.join(args.output_dir, group + ".parquet")
+        if args.parquet and (changed or not os.path.isfile(parquet)):
+            write_parquet(parquet, list(tidy_rows(group, labels, columns, weekly)))
+        written += changed
+        summary[group] = {'file': name, 'labels': len(labels), 'first_week': iso(weekly['week'].min()),
+                          'last_week': iso(weekly['week'].max())}
+        logging.debug("%s: %d labels, %d label weeks%s", group, len(labels), len(weekly['week']),
+                      "" if changed else ", unchanged")
+
+    write_tile(args.output_dir, INDEX, index(summary, len(samples)), {})
+    cache.save()
+    logging.info("%d of %d tiles rewritten", written, len(summary))
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
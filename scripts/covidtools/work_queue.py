@@ -0,0 +1,130 @@
+# Author: Andreas Wilke
+
+# Shared work queue for the per sample freyja steps, so every host that
+# mounts /local/incoming/covid/ can work on a run instead of one host running
+# make -j. enqueue writes a job file per pending sample (a bam without
+# output/<sample>.out) into <run>/queue/pending/; work starts --jobs workers
+# that claim jobs by renaming them into queue/claimed/, run the job's command
+# (make -B variants/<sample>.variants.tsv by default) in the run directory and
+# touch the claim as heartbeat. A claim without heartbeat for --stale seconds
+# is requeued by any worker, a failed job is retried up to --max-attempts.
+# Results land in variants/, depth/ and output/ as with make; queue events go
+# to queue/events.jsonl.
+#
+#   work-queue.py enqueue runs/220407 --command "make -B variants/{sample}.variants.tsv FREYJA_VERSION=1.5.3"
+#   work-queue.py work runs/220407 --jobs 8                   # on every idle node
+#   work-queue.py work /local/incoming/covid/runs/*/ --jobs 4 --follow
+#   work-queue.py status runs/220407
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from lib.workqueue import DEFAULT_COMMAND, HEARTBEAT, MAX_ATTEMPTS, STALE, Worker, enqueue, pending_samples, reap, status
+
+
+def CLI(argv=None):
+    """Define and parse command line options"""
+
+    parser = argparse.ArgumentParser(description='Shared file based work queue for per sample demix across hosts.')
+    parser.add_argument('--level', dest='level', default="INFO", choices=['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set level of verbosity')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('enqueue', help='Queue the pending samples of a run')
+    add.add_argument('run_dir')
+    add.add_argument('samples', nargs='*', help='Samples to queue, default all without output/<sample>.out')
+    add.add_argument('--all', dest='all', default=False, action='store_true', help='Queue every sample with a bam')
+    add.add_argument('--command', dest='job_command', default=DEFAULT_COMMAND,
+                     help='Command run in the run directory, {sample} is substituted; default "' + DEFAULT_COMMAND + '"')
+    add.add_argument('--max-attempts', dest='max_attempts', type=int, default=MAX_ATTEMPTS)
+
+    work = commands.add_parser('work', help='Claim and run jobs until the queues are empty')
+    work.add_argument('run_dirs', nargs='+')
+    work.add_argument('--jobs', '-j', dest='jobs', type=int, default=1, help='Workers in this process')
+    work.add_argument('--heartbeat', dest='heartbeat', type=float, default=HEARTBEAT,
+                      help='Seconds between heartbeats, default {}'.format(HEARTBEAT))
+    work.add_argument('--stale', dest='stale', type=float, default=STALE,
+                      help='Seconds without heartbeat before a claim is requeued, default {}'.format(STALE))
+    work.add_argument('--follow', dest='follow', default=False, action='store_true',
+                      help='Keep polling for new jobs instead of exiting when the queues are empty')
+
+    state = commands.add_parser('status', help='Jobs per state and claims with their heartbeat age')
+    state.add_argument('run_dir')
+    state.add_argument('--stale', dest='stale', type=float, default=STALE)
+    state.add_argument('--json', dest='json', default=False, action='store_true')
+
+    requeue = commands.add_parser('requeue', help='Requeue stale claims now')
+    requeue.add_argument('run_dir')
+    requeue.add_argument('--stale', dest='stale', type=float, default=STALE)
+    return parser.parse_args(argv)
+
+
+def run(args):
+
+    if args.command == 'enqueue':
+        samples = args.samples or pending_samples(args.run_dir, all_samples=args.all)
+        stats = enqueue(args.run_dir, samples, command=args.job_command, max_attempts=args.max_attempts)
+        logging.info("%s: %d jobs queued, %d already queued or running", args.run_dir, stats['queued'], stats['active'])
+        return 0
+
+    if args.command == 'work':
+        host = "{}.{}".format(socket.gethostname(), os.getpid())
+        workers = [Worker(args.run_dirs, name="{}.{}".format(host, i), heartbeat=args.heartbeat, stale=args.stale)
+                   for i in range(args.jobs)]
+        results = [None] * len(workers)
+
+        def stop(signum, frame):
+            # running jobs finish, no new ones are claimed
+            logging.warning("Stopping after the running jobs")
+            for w in workers:
+                w.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        def work(i):
+            results[i] = workers[i].run(follow=args.follow)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(workers))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            # join with a timeout so the main thread keeps handling signals
+            while t.is_alive():
+                t.join(1)
+        total = {k: sum(r[k] for r in results if r) for k in ('done', 'failed', 'lost', 'requeued')}
+        logging.info("%d done, %d failed attempts, %d lost to other workers, %d stale claims requeued",
+                     total['done'], total['failed'], total['lost'], total['requeued'])
+        failed = [j['sample'] for d in args.run_dirs for j in status(d, args.stale)['failed']]
+        if failed:
+            logging.error("Failed after the last attempt: %s", " ".join(failed))
+        return 1 if failed else 0
+
+    if args.command == 'requeue':
+        for sample in reap(args.run_dir, args.stale):
+            print(sample)
+        return 0
+
+    jobs = status(args.run_dir, args.stale)
+    if args.json:
+        print(json.dumps(jobs, indent=1, sort_keys=True))
+        return 0
+    print("\t".join(["state", "sample", "owner", "heartbeat"]))
+    for state in jobs:
+        for j in jobs[state]:
+            print("\t".join([state + (" (stale)" if j.get('stale') else ""), j['sample'], j.get('owner', ""),
+                             str(j.get('heartbeat', ""))]))
+    logging.info(", ".join("{} {}".format(len(jobs[s]), s) for s in jobs))
+    return 0
+
+
+def main(argv=None):
+
+    args = CLI(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s', level=args.level, stream=sys.stderr)
+    return run(args)
@@ -8,11 +8,12 @@ src=`basename $1`
 current=`pwd`
 cd $1
 
-for i in depth/* ; do sh ${base}/scripts/depth2cov.sh $i ; done | tee coverage.all.txt
-for i in output/* ; do python3 ${base}/scripts/out2spreadsheet.py $i ; done > summary.tsv
+python3 ${base}/scripts/depth-cache.py --level WARNING build . ; python3 ${base}/scripts/depth-cache.py coverage . | tee coverage.all.txt
+python3 ${base}/scripts/covidtools out2tab output/* > summary.tsv
 
 sort summary.tsv > summary.sorted.tsv
 sort coverage.all.txt > coverage.sorted.txt
 join -t $'\t' -a 1 -a 2 -e 'n/a' -j 1 summary.sorted.tsv <(cat coverage.sorted.txt | cut -f1,2) > summary.all.tsv
+python3 ${base}/scripts/qc-gate.py summary . --table summary.all.tsv
 cd $current
 
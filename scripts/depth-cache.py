@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools depth-cache`, the code lives in covidtools/depth_cache.py
+
+import sys
+from covidtools.depth_cache import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools fingerprint`, the code lives in covidtools/fingerprint.py
+
+import sys
+from covidtools.fingerprint import main
+
+if __name__ == '__main__':
+    sys.exit(main())
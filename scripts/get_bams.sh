@@ -4,18 +4,13 @@ base=/local/incoming/covid/
 run_dir=$1
 src=`basename ${run_dir}`
 
-echo rsync -zurvp --rsh="ssh -i /local/incoming/covid/config/covid_rsa" --include="*.bam" --exclude="*.*"  wilke@locust:${jim}/${src}/ ${run_dir}/
-
-rsync -zurvp --rsh="ssh -i /local/incoming/covid/config/covid_rsa" --include="*.bam" --exclude="*.*"  wilke@locust:${jim}/${src}/ ${run_dir}/
-
-find ${run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${run_dir}/bam/ \;
-find ${run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${run_dir}/bam/ \;
+python3 ${base}/scripts/sync-run.py wilke@locust:${jim}/${src}/ ${run_dir} --include "*.sorted.bam" --flatten bam --ssh "ssh -i /local/incoming/covid/config/covid_rsa"
 current=`pwd`
 cd ${run_dir}
 make -j 8 strain
 
 for i in depth/* ; do sh ${base}/scripts/depth2cov.sh $i ; done | tee coverage.all.txt
-for i in output/* ; do python3 ${base}/scripts/out2spreadsheet.py $i ; done > summary.tsv
+python3 ${base}/scripts/covidtools out2tab output/* > summary.tsv
 
 sort summary.tsv > summary.sorted.tsv
 sort coverage.all.txt > coverage.sorted.txt
@@ -0,0 +1,153 @@
+import csv
+import io
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from lib import bundle
+from lib.warehouse import AGGREGATE_HEADER
+
+logger = logging.getLogger(__name__)
+
+# <root>/<dimension>/<label>/ with the demix outputs linked into data/ (link-labels) or the label directory itself
+NUMBER_REGEX = re.compile(r"^\s*(-?\d+(?:\.\d*)?)")
+
+
+def label_dirs(root, dimensions=None) -> Dict[str, List[str]]:
+    """dimension -> label directories, all dimension directories under root by default"""
+
+    if not dimensions:
+        dimensions = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    found = {}
+    for dimension in dimensions:
+        path = os.path.join(root, dimension)
+        if not os.path.isdir(path):
+            found[dimension] = []
+            continue
+        found[dimension] = sorted(os.path.join(path, l) for l in os.listdir(path) if os.path.isdir(os.path.join(path, l)))
+    return found
+
+
+def out_files(label_dir) -> List[str]:
+    files = []
+    for d in (label_dir, os.path.join(label_dir, "data")):
+        if os.path.isdir(d):
+            files += [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith(".out")]
+    return files
+
+
+def aggregate_record(path) -> tuple:
+    """Row name and raw fields freyja aggregate takes from a demix output.
+
+    The name is the demix header column without its directory, e.g.
+    220327.20900_S36.variants.tsv; fields keep their text, wrapped lineage and
+    abundance lists included.
+    """
+
+    with bundle.open_file(path, newline="") as f:
+        lines = list(csv.reader(f, delimiter="\t", skipinitialspace=True))
+    name = lines[0][-1].split("/")[-1] if lines and lines[0] else ""
+    return name, {l[0]: l[1] for l in lines[1:] if len(l) > 1}
+
+
+def aggregate_rows(records) -> List[str]:
+    """Header and rows as freyja aggregate writes them: the columns are the tags found in any output,
+    missing ones empty, and fields are quoted as pandas quotes them, so wrapped lists span several lines"""
+
+    columns = [h for h in AGGREGATE_HEADER[1:] if any(h in fields for name, fields in records)] if records \
+        else AGGREGATE_HEADER[1:]
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    rows = ["\t".join([""] + columns)]
+    for name, fields in records:
+        writer.writerow([name] + [fields.get(c, "") for c in columns])
+        rows.append(out.getvalue()[:-1])
+        out.seek(0)
+        out.truncate()
+    return rows
+
+
+def join_wrapped(row) -> str:
+    """A row on one line, continuation lines appended with a space as sortAggregate.py does"""
+
+    return " ".join(l.strip() for l in row.split("\n"))
+
+
+def _parse_chunk(paths) -> List[Optional[tuple]]:
+    rows = []
+    for p in paths:
+        try:
+            rows.append(aggregate_record(p))
+        except (OSError, UnicodeDecodeError, csv.Error):
+            rows.append(None)
+    return rows
+
+
+def inode(path) -> tuple:
+    s = os.stat(path)
+    return (s.st_dev, s.st_ino)
+
+
+def parse_once(paths, jobs=1, chunk=200) -> Dict[str, Optional[tuple]]:
+    """path -> aggregate record, None if unreadable; hardlinks of one output in many labels are parsed once"""
+
+    unique = {}
+    keys = {}
+    for p in paths:
+        try:
+            keys[p] = inode(p)
+        except OSError as e:
+            logger.error("%s: %s", p, e)
+            keys[p] = None
+            continue
+        unique.setdefault(keys[p], p)
+    inodes = list(unique)
+    chunks = [[unique[k] for k in inodes[i:i + chunk]] for i in range(0, len(inodes), chunk)]
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = [r for rows in pool.map(_parse_chunk, chunks) for r in rows]
+    else:
+        parsed = [r for c in chunks for r in _parse_chunk(c)]
+    logger.info("%d outputs parsed once for %d paths", len(inodes), len(keys))
+    rows = dict(zip(inodes, parsed))
+    return {p: rows[k] if k is not None else None for p, k in keys.items()}
+
+
+def sort_n(lines) -> List[str]:
+    """Order of `sort -n`: leading number, lines without one count as 0, then the whole line"""
+
+    def key(l):
+        m = NUMBER_REGEX.match(l)
+        return (float(m[1]) if m else 0.0, l)
+    return sorted(lines, key=key)
+
+
+def _write(path, lines) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("".join(l + "\n" for l in lines))
+    os.replace(tmp, path)
+
+
+def write_label(label_dir, records: List[tuple]) -> Dict[str, str]:
+    """The files process_testing_group.sh made with freyja aggregate, sortAggregate.py, fgrep -v "[]" and sort -n"""
+
+    d = os.path.basename(label_dir)
+    path = lambda suffix: os.path.join(label_dir, d + suffix)
+    header, *rows = aggregate_rows(records)
+    # sortAggregate.py prints the header line with its newline, hence the empty line
+    lines = [header, ""] + [join_wrapped(r) for r in rows]
+    filtered = [l for l in lines if "[]" not in l]
+    files = {
+        'aggregate': path(".aggregate.tsv"),
+        'line': path(".aggregate.line.tsv"),
+        'filtered': path(".aggregate.line.filtered.tsv"),
+        'sorted': path(".aggregate.line.sorted.tsv")
+    }
+    _write(files['aggregate'], [header] + rows)
+    _write(files['line'], lines)
+    _write(files['filtered'], filtered)
+    _write(files['sorted'], sort_n(filtered))
+    return files
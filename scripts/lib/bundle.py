@@ -0,0 +1,381 @@
+import fnmatch
+import glob as _glob
+import io
+import json
+import os
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# One file per run: magic, index length, JSON index of the members, member data.
+# Offsets in the index are relative to the first data byte, member names are
+# paths relative to the run directory.
+BUNDLE = "results.bundle"
+MAGIC = b"CVBNDL01"
+HEADER = struct.Struct("<8sQ")
+FORMAT_VERSION = 1
+MEMBERS = ["output/*.out", "output/*.version", "output/*.freyja_version", "*.version", "*.freyja_version",
+           "variants/*.variants.tsv", "depth/*.depth"]
+# directories whose members live in the bundle of their parent, the run directory
+SUBDIRS = ("output", "variants", "depth")
+BLOCK = 1 << 20
+
+
+class Member(object):
+    """Size and mtime of a bundle member, the fields of os.stat callers use"""
+
+    __slots__ = ('st_size', 'st_mtime_ns', 'st_mtime')
+
+    def __init__(self, size, mtime_ns):
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+        self.st_mtime = mtime_ns / 1e9
+
+
+class Bundle(object):
+    """Read access to a results bundle with one open; members are read with pread at their offset"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            head = os.pread(self.fd, HEADER.size, 0)
+            if len(head) != HEADER.size:
+                raise ValueError("Not a results bundle: " + path)
+            magic, length = HEADER.unpack(head)
+            if magic != MAGIC:
+                raise ValueError("Not a results bundle: " + path)
+            self.index = json.loads(os.pread(self.fd, length, HEADER.size))
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.data = HEADER.size + length
+        self.members = self.index['members']
+        self._dirs = None
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def names(self) -> List[str]:
+        return sorted(self.members)
+
+    def listdir(self, subdir="") -> List[str]:
+        """Member base names directly in subdir ('' for the run directory)"""
+
+        if self._dirs is None:
+            self._dirs = {}
+            for name in self.members:
+                d, base = os.path.split(name)
+                self._dirs.setdefault(d, []).append(base)
+        return sorted(self._dirs.get(subdir, []))
+
+    def stat(self, name) -> Member:
+        offset, size, mtime_ns, crc = self.members[name]
+        return Member(size, mtime_ns)
+
+    def read(self, name) -> bytes:
+        offset, size, mtime_ns, crc = self.members[name]
+        data = os.pread(self.fd, size, self.data + offset)
+        if len(data) != size:
+            raise ValueError("Truncated member {} in {}".format(name, self.path))
+        return data
+
+    def verify(self) -> List[str]:
+        """Members whose data fails the crc32 in the index"""
+
+        return [n for n in self.names() if zlib.crc32(self.read(n)) != self.members[n][3]]
+
+
+def member_files(run_dir, patterns=MEMBERS) -> Dict[str, str]:
+    """Member name -> loose file of a run"""
+
+    files = {}
+    for pattern in patterns:
+        for p in _glob.glob(os.path.join(run_dir, pattern)):
+            if os.path.isfile(p):
+                files[os.path.relpath(p, run_dir)] = p
+    return files
+
+
+def pack(run_dir, patterns=MEMBERS, remove=False) -> dict:
+    """Write the run's result files into run_dir/results.bundle.
+
+    Loose files win over members of an existing bundle, members without a
+    loose file are carried over, so a run packed with remove can be packed
+    again after new outputs were written. The bundle is written to a
+    temporary file, verified and renamed into place; with remove the loose
+    files are deleted afterwards unless they changed while packing.
+    """
+
+    path = os.path.join(run_dir, BUNDLE)
+    files = member_files(run_dir, patterns)
+    old = None
+    if os.path.isfile(path):
+        old = Bundle(path)
+    stats = {'packed': 0, 'carried': 0, 'removed': 0, 'bytes': 0}
+    members = {}
+    sources = {}
+    try:
+        with tempfile.TemporaryFile(dir=run_dir) as data:
+            for name in sorted(set(files) | set(old.members if old else [])):
+                if name in files:
+                    s = os.stat(files[name])
+                    with open(files[name], "rb") as f:
+                        content = f.read()
+                    sources[name] = (s.st_size, s.st_mtime_ns)
+                    mtime_ns = s.st_mtime_ns
+                    stats['packed'] += 1
+                else:
+                    content = old.read(name)
+                    mtime_ns = old.members[name][2]
+                    stats['carried'] += 1
+                members[name] = [data.tell(), len(content), mtime_ns, zlib.crc32(content)]
+                data.write(content)
+            stats['bytes'] = data.tell()
+            index = json.dumps({'version': FORMAT_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+                                'members': members}, sort_keys=True).encode()
+            tmp = path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, "wb") as out:
+                out.write(HEADER.pack(MAGIC, len(index)))
+                out.write(index)
+                data.seek(0)
+                while True:
+                    block = data.read(BLOCK)
+                    if not block:
+                        break
+                    out.write(block)
+    finally:
+        if old:
+            old.close()
+    with Bundle(tmp) as b:
+        bad = b.verify()
+    if bad:
+        os.unlink(tmp)
+        raise ValueError("Bundle failed verification: " + " ".join(bad))
+    os.replace(tmp, path)
+    if remove:
+        for name, (size, mtime_ns) in sources.items():
+            s = os.stat(files[name])
+            if (s.st_size, s.st_mtime_ns) == (size, mtime_ns):
+                os.unlink(files[name])
+                stats['removed'] += 1
+    clear_cache()
+    return stats
+
+
+def unpack(run_dir, keep=False) -> int:
+    """Restore members without a loose file, with their mtime, and delete the bundle unless keep"""
+
+    path = os.path.join(run_dir, BUNDLE)
+    restored = 0
+    with Bundle(path) as b:
+        for name in b.names():
+            target = os.path.join(run_dir, name)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target) or run_dir, exist_ok=True)
+            tmp = target + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(b.read(name))
+            os.utime(tmp, ns=(b.members[name][2], b.members[name][2]))
+            os.replace(tmp, target)
+            restored += 1
+    if not keep:
+        os.unlink(path)
+    clear_cache()
+    return restored
+
+
+# Transparent reads: a file that is in its directory's listing is read from
+# disk, otherwise from the bundle of its run. Listings and bundles are cached
+# per directory and keyed on the directory's and bundle's mtime, so a packed
+# run costs one listdir per directory and one open of the bundle instead of an
+# open per file, and a long running caller sees new files and re-packs.
+_listings = {}      # directory -> (mtime_ns, names)
+_bundles = {}       # run directory -> ((mtime_ns, size, inode), Bundle or None)
+
+
+def clear_cache() -> None:
+    for key, b in _bundles.values():
+        if b is not None:
+            b.close()
+    _bundles.clear()
+    _listings.clear()
+
+
+def _listing(d) -> set:
+    try:
+        mtime_ns = os.stat(d).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        _listings.pop(d, None)
+        return set()
+    cached = _listings.get(d)
+    if cached is None or cached[0] != mtime_ns:
+        try:
+            cached = (mtime_ns, set(os.listdir(d)))
+        except (FileNotFoundError, NotADirectoryError):
+            cached = (mtime_ns, set())
+        _listings[d] = cached
+    return cached[1]
+
+
+def _bundle(run_dir) -> Optional[Bundle]:
+    key = None
+    if BUNDLE in _listing(run_dir):
+        try:
+            s = os.stat(os.path.join(run_dir, BUNDLE))
+            key = (s.st_mtime_ns, s.st_size, s.st_ino)
+        except FileNotFoundError:
+            pass
+    cached = _bundles.get(run_dir)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if cached is not None and cached[1] is not None:
+        cached[1].close()
+    b = Bundle(os.path.join(run_dir, BUNDLE)) if key else None
+    _bundles[run_dir] = (key, b)
+    return b
+
+
+def _locate(d) -> tuple:
+    """(bundle, member prefix) covering directory d"""
+
+    d = os.path.abspath(d)
+    if os.path.basename(d) in SUBDIRS:
+        b = _bundle(os.path.dirname(d))
+        if b is not None:
+            return b, os.path.basename(d)
+    return _bundle(d), ""
+
+
+def _member(path) -> tuple:
+    d, name = os.path.split(os.path.abspath(path))
+    b, prefix = _locate(d)
+    member = os.path.join(prefix, name)
+    if b is not None and member in b:
+        return b, member
+    return None, None
+
+
+def open_file(path, mode="r", encoding=None, errors=None, newline=None):
+    """open() for result files that may only exist in the run's bundle, read modes only"""
+
+    d, name = os.path.split(os.path.abspath(path))
+    if name not in _listing(d):
+        b, member = _member(path)
+        if b is not None:
+            raw = io.BytesIO(b.read(member))
+            if "b" in mode:
+                return raw
+            return io.TextIOWrapper(raw, encoding=encoding or "utf-8", errors=errors, newline=newline)
+    if "b" in mode:
+        return open(path, mode)
+    return open(path, mode, encoding=encoding, errors=errors, newline=newline)
+
+
+def isfile(path) -> bool:
+    d, name = os.path.split(os.path.abspath(path))
+    if name in _listing(d):
+        return os.path.isfile(path)
+    return _member(path)[0] is not None
+
+
+def stat(path):
+    """os.stat of a loose file, size and mtime from the index for a bundle member"""
+
+    d, name = os.path.split(os.path.abspath(path))
+    if name not in _listing(d):
+        b, member = _member(path)
+        if b is not None:
+            return b.stat(member)
+    return os.stat(path)
+
+
+def listdir(d) -> List[str]:
+    """Loose files and bundle members of a directory"""
+
+    b, prefix = _locate(d)
+    names = _listing(os.path.abspath(d))
+    if b is not None:
+        names = names | set(b.listdir(prefix))
+    return sorted(names - {BUNDLE})
+
+
+def members(run_dir) -> List[str]:
+    """Member names of the run's bundle, none without one"""
+
+    b = _bundle(os.path.abspath(run_dir))
+    return b.names() if b is not None else []
+
+
+def expand(pattern) -> List[str]:
+    """A shell pattern the shell left unexpanded, e.g. output/* of a packed run, matched against the bundle"""
+
+    if not _glob.has_magic(pattern):
+        return [pattern]
+    d, base = os.path.split(pattern)
+    return [os.path.join(d, n) for n in listdir(d or ".") if fnmatch.fnmatch(n, base)] or [pattern]
+
+
+def glob(run_dir, pattern) -> List[str]:
+    """Paths matching a run relative pattern with one directory level, e.g. depth/*.depth"""
+
+    subdir, base = os.path.split(pattern)
+    d = os.path.join(run_dir, subdir)
+    return [os.path.join(d, n) for n in listdir(d) if fnmatch.fnmatch(n, base)]
+
+
+def rglob(root, pattern) -> List[str]:
+    """Path(root).rglob(pattern) for result files, with the members of packed runs below root.
+
+    A packed member is returned as the path its loose file had, so callers
+    that link or read it go through link() or open_file().
+    """
+
+    found = []
+    for d, dirs, names in os.walk(root):
+        found += [os.path.join(d, n) for n in names if fnmatch.fnmatch(n, pattern)]
+        if BUNDLE in names:
+            b = _bundle(os.path.abspath(d))
+            if b is None:
+                continue
+            for name in b.names():
+                subdir, base = os.path.split(name)
+                if fnmatch.fnmatch(base, pattern) and base not in _listing(os.path.abspath(os.path.join(d, subdir))):
+                    found.append(os.path.join(d, name))
+    return sorted(found)
+
+
+def link(path, target) -> bool:
+    """Hardlink a result file to target, a packed member is written out as a copy with its mtime.
+
+    Returns False if path is neither on disk nor in its run's bundle.
+    """
+
+    if os.path.lexists(path):
+        os.link(path, target)
+        return True
+    b, member = _member(path)
+    if b is None:
+        return False
+    tmp = str(target) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b.read(member))
+    mtime_ns = b.members[member][2]
+    os.utime(tmp, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp, target)
+    return True
@@ -0,0 +1,175 @@
+import csv
+import os
+import re
+from typing import Dict, List, Optional
+
+from lib import bundle
+from lib.warehouse import parse_demix
+
+# ID rule shared with update-sample-mapping.py, <run prefix>.<sample id>_S<n>...
+SAMPLE_REGEX = re.compile(r"^(?:[^-_\.]+\.)?([^_\.]+)")
+
+# field: (tolerance, relative), relative tolerances are a fraction of the larger value
+DEFAULT_TOLERANCES = {
+    'ALT_FREQ': (0.01, False),
+    'ALT_DP': (0.05, True),
+    'REF_DP': (0.05, True),
+    'TOTAL_DP': (0.05, True),
+    'abundance': (0.01, False),
+    'summarized': (0.01, False),
+    'resid': (0.05, True),
+    'coverage': (0.5, False),
+}
+
+KINDS = {'variants': ".variants.tsv", 'demix': ".out"}
+
+
+def parse_tolerance(text) -> tuple:
+    """FIELD=0.01 absolute or FIELD=5% relative"""
+
+    field, _, value = text.partition("=")
+    if not field or not value:
+        raise ValueError("Expected FIELD=VALUE or FIELD=VALUE%, got " + text)
+    if value.endswith("%"):
+        return field, (float(value[:-1]) / 100, True)
+    return field, (float(value), False)
+
+
+def sample_key(name) -> Optional[str]:
+    res = SAMPLE_REGEX.match(name)
+    return res[1] if res else None
+
+
+def index_tree(root) -> Dict[str, Dict[str, str]]:
+    """kind -> sample ID -> path for one output tree, newest run prefix wins on duplicates"""
+
+    found = {k: {} for k in KINDS}
+    for dirpath, dirs, names in os.walk(root):
+        paths = [os.path.join(dirpath, n) for n in names]
+        if bundle.BUNDLE in names:
+            # a packed run, members are read through bundle.open_file
+            paths += [os.path.join(dirpath, m) for m in bundle.members(dirpath)]
+        for path in paths:
+            name = os.path.basename(path)
+            for kind, suffix in KINDS.items():
+                if not name.endswith(suffix):
+                    continue
+                key = sample_key(name)
+                if key and name >= os.path.basename(found[kind].get(key, "")):
+                    found[kind][key] = path
+    return found
+
+
+def read_variants(path) -> Dict[str, dict]:
+    """Mutation (REF POS ALT) -> row, first row per mutation when iVar repeats it per GFF feature"""
+
+    rows = {}
+    with bundle.open_file(path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            key = (row.get('REF') or "") + (row.get('POS') or "") + (row.get('ALT') or "")
+            rows.setdefault(key, row)
+    return rows
+
+
+def within(a, b, tolerance) -> bool:
+    limit, relative = tolerance
+    if relative:
+        limit = limit * max(abs(a), abs(b))
+    return abs(a - b) <= limit
+
+
+def _number(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def compare_variants(a, b, tolerances, min_af=0.0) -> dict:
+    ra, rb = read_variants(a), read_variants(b)
+
+    def called(rows):
+        return {k for k, r in rows.items()
+                if (r.get('PASS', 'TRUE').upper() == 'TRUE') and (_number(r.get('ALT_FREQ')) or 0) >= min_af}
+
+    ca, cb = called(ra), called(rb)
+    fields = [f for f in tolerances if f.isupper()]
+    changed = {}
+    for key in sorted(ca & cb):
+        for field in fields:
+            va, vb = _number(ra[key].get(field)), _number(rb[key].get(field))
+            if va is None or vb is None:
+                continue
+            if not within(va, vb, tolerances[field]):
+                changed.setdefault(key, {})[field] = [va, vb]
+
+    return {
+        'called': [len(ca), len(cb)],
+        'only_a': sorted(ca - cb),
+        'only_b': sorted(cb - ca),
+        'changed': changed,
+        'equal': not (ca ^ cb) and not changed
+    }
+
+
+def compare_demix(a, b, tolerances) -> dict:
+    da, db = parse_demix(a), parse_demix(b)
+
+    def abundances(d):
+        values = {}
+        for lineage, abundance in zip(d['lineages'], d['abundances']):
+            values[lineage] = values.get(lineage, 0.0) + float(abundance)
+        return values
+
+    la, lb = abundances(da), abundances(db)
+    deltas = {l: round(lb.get(l, 0.0) - la.get(l, 0.0), 8) for l in set(la) | set(lb)}
+    lineages = {l: d for l, d in deltas.items()
+                if not within(la.get(l, 0.0), lb.get(l, 0.0), tolerances['abundance'])}
+
+    sa = {c: float(v) for c, v in da['clades']}
+    sb = {c: float(v) for c, v in db['clades']}
+    clades = {c: round(sb.get(c, 0.0) - sa.get(c, 0.0), 8) for c in set(sa) | set(sb)
+              if not within(sa.get(c, 0.0), sb.get(c, 0.0), tolerances['summarized'])}
+
+    scalars = {}
+    for field in ['resid', 'coverage']:
+        va, vb = da[field + '_value'], db[field + '_value']
+        if va is not None and vb is not None and not within(va, vb, tolerances[field]):
+            scalars[field] = [va, vb]
+
+    return {
+        'lineages': [len(la), len(lb)],
+        'only_a': sorted(set(la) - set(lb)),
+        'only_b': sorted(set(lb) - set(la)),
+        'max_delta': max((abs(d) for d in deltas.values()), default=0.0),
+        'deltas': lineages,
+        'summarized': clades,
+        'scalars': scalars,
+        'equal': not lineages and not clades and not scalars
+    }
+
+
+def compare_pair(task) -> dict:
+    """Worker entry point: (kind, sample, path a, path b, tolerances, min_af)"""
+
+    kind, sample, a, b, tolerances, min_af = task
+    result = {'kind': kind, 'sample': sample, 'a': a, 'b': b}
+    try:
+        if kind == 'variants':
+            result.update(compare_variants(a, b, tolerances, min_af=min_af))
+        else:
+            result.update(compare_demix(a, b, tolerances))
+    except (OSError, ValueError, KeyError) as e:
+        result.update({'equal': False, 'error': str(e)})
+    return result
+
+
+def pair_trees(reference, others) -> List[tuple]:
+    """(tree, kind, sample, path in reference, path in tree or None) for every sample in either tree"""
+
+    pairs = []
+    for tree, index in others:
+        for kind in KINDS:
+            for sample in sorted(set(reference[kind]) | set(index[kind])):
+                pairs.append((tree, kind, sample, reference[kind].get(sample), index[kind].get(sample)))
+    return pairs
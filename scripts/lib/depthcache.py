@@ -0,0 +1,263 @@
+import fcntl
+import glob
+import json
+import os
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from lib import bundle
+from lib.qcgate import THRESHOLD
+
+# samples x positions uint32 in one file per run, rows in the order samples were added
+DATA_FILE = "depth.u32"
+INDEX_FILE = "depth.u32.json"
+DTYPE = np.dtype("<u4")
+INDEX_VERSION = 1
+DEFAULT_REFERENCE = "/local/incoming/covid/config/MN908947.3.trimmed.fa"
+
+
+def reference_length(path=DEFAULT_REFERENCE) -> Optional[int]:
+    """Length of the (single sequence) reference fasta"""
+
+    try:
+        with open(path) as f:
+            return sum(len(l.strip()) for l in f if not l.startswith(">"))
+    except OSError:
+        return None
+
+
+def parse_depth(path) -> tuple:
+    """Positions and depths of a samtools/freyja depth file (chrom, pos, base, depth)"""
+
+    with bundle.open_file(path, "rb") as f:
+        tokens = f.read().split()
+    if len(tokens) % 4:
+        raise ValueError("Not a four column depth file: " + path)
+    positions = np.array(tokens[1::4]).astype(np.int64)
+    depths = np.array(tokens[3::4]).astype(DTYPE)
+    return positions, depths
+
+
+def to_row(positions, depths, length) -> np.ndarray:
+    row = np.zeros(length, dtype=DTYPE)
+    if len(positions) == length and positions[0] == 1 and positions[-1] == length:
+        row[:] = depths
+    else:
+        inside = (positions >= 1) & (positions <= length)
+        row[positions[inside] - 1] = depths[inside]
+    return row
+
+
+def _crc(row) -> int:
+    return zlib.crc32(row.tobytes())
+
+
+class DepthCache(object):
+    """Memory-mapped depth matrix of one run with its sample index.
+
+    depth.u32 holds one fixed size row per sample, depth.u32.json maps sample
+    names to rows together with the source file's size, mtime, line count and
+    a crc32 of the row. Readers slice rows and columns of the memory map.
+    """
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.data_file = os.path.join(run_dir, DATA_FILE)
+        self.index_file = os.path.join(run_dir, INDEX_FILE)
+        self.index = self._read_index()
+        self._matrix = None
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'version': INDEX_VERSION, 'positions': 0, 'samples': {}}
+
+    @property
+    def positions(self) -> int:
+        return self.index['positions']
+
+    @property
+    def samples(self) -> List[str]:
+        """Sample names ordered by row"""
+
+        return sorted(self.index['samples'], key=lambda s: self.index['samples'][s]['row'])
+
+    def __len__(self):
+        return len(self.index['samples'])
+
+    def __contains__(self, sample):
+        return sample in self.index['samples']
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            rows = len(self.index['samples'])
+            if not rows:
+                self._matrix = np.zeros((0, self.positions), dtype=DTYPE)
+            else:
+                self._matrix = np.memmap(self.data_file, dtype=DTYPE, mode="r", shape=(rows, self.positions))
+        return self._matrix
+
+    def row(self, sample) -> int:
+        return self.index['samples'][sample]['row']
+
+    def depth(self, sample, start=1, end=None) -> np.ndarray:
+        """Depths of sample for 1-based inclusive positions start..end"""
+
+        return self.matrix[self.row(sample), start - 1:end or self.positions]
+
+    def region(self, start, end, samples=None) -> np.ndarray:
+        """samples x positions block for 1-based inclusive start..end, all samples by default"""
+
+        block = self.matrix[:, start - 1:end]
+        return block if samples is None else block[[self.row(s) for s in samples]]
+
+    def lines(self) -> np.ndarray:
+        """Line count of each sample's depth file, by row"""
+
+        return np.array([self.index['samples'][s]['lines'] for s in self.samples], dtype=np.int64)
+
+    def coverage(self, threshold=THRESHOLD) -> Dict[str, tuple]:
+        """Sample -> (positions with depth >= threshold, line count of its depth file)"""
+
+        counts = (self.matrix >= threshold).sum(axis=1) if len(self) else []
+        return {s: (int(c), n) for s, c, n in zip(self.samples, counts, self.lines())}
+
+    def _write_index(self) -> None:
+        tmp = self.index_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_file)
+
+    def update(self, files: Dict[str, str], length=None, force=False) -> dict:
+        """Add or refresh samples from their depth files (name -> path).
+
+        Files whose size and mtime match the index are skipped. A changed
+        sample's row is overwritten in place, new samples are appended; each
+        row is compared with the parsed text after it is written. Unreadable,
+        truncated or malformed files are skipped and reported, rows that do
+        not read back as written as failed. Positions beyond the reference
+        length are dropped and the sample reported as truncated.
+        """
+
+        stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'skipped': [], 'failed': [], 'truncated': []}
+        lock = os.open(self.index_file + ".lock", os.O_WRONLY | os.O_CREAT, 0o664)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.index = self._read_index()
+            self._matrix = None
+            if not self.positions:
+                if length is None:
+                    length = 0
+                    for path in sorted(files.values()):
+                        try:
+                            positions = parse_depth(path)[0]
+                        except (OSError, ValueError):
+                            continue
+                        if len(positions):
+                            length = int(positions.max())
+                            break
+                self.index['positions'] = length
+            entries = self.index['samples']
+            mode = "r+b" if os.path.isfile(self.data_file) else "w+b"
+            with open(self.data_file, mode) as data:
+                for sample in sorted(files):
+                    path = files[sample]
+                    try:
+                        s = bundle.stat(path)
+                    except OSError:
+                        stats['skipped'].append(sample)
+                        continue
+                    source = {'path': os.path.relpath(path, self.run_dir), 'size': s.st_size, 'mtime_ns': s.st_mtime_ns}
+                    known = entries.get(sample)
+                    if known and not force and all(known[k] == source[k] for k in ('path', 'size', 'mtime_ns')):
+                        stats['unchanged'] += 1
+                        continue
+                    try:
+                        positions, depths = parse_depth(path)
+                    except (OSError, ValueError):
+                        stats['skipped'].append(sample)
+                        continue
+                    if len(positions) and positions.max() > self.positions:
+                        stats['truncated'].append(sample)
+                    row = to_row(positions, depths, self.positions)
+                    number = known['row'] if known else len(entries)
+                    offset = number * self.positions * DTYPE.itemsize
+                    data.seek(offset)
+                    data.write(row.tobytes())
+                    data.flush()
+                    data.seek(offset)
+                    back = np.frombuffer(data.read(row.nbytes), dtype=DTYPE)
+                    if not np.array_equal(back, row):
+                        stats['failed'].append(sample)
+                        continue
+                    entries[sample] = dict(source, row=number, lines=len(depths), crc32=_crc(row))
+                    stats['updated' if known else 'added'] += 1
+            self._write_index()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            os.close(lock)
+        return stats
+
+    def verify(self, full=False) -> List[str]:
+        """Samples whose row fails its crc32, or with full differs from the depth file or is missing"""
+
+        bad = []
+        for sample in self.samples:
+            entry = self.index['samples'][sample]
+            row = np.asarray(self.matrix[entry['row']])
+            if _crc(row) != entry['crc32']:
+                bad.append(sample)
+                continue
+            if full:
+                path = os.path.join(self.run_dir, entry['path'])
+                try:
+                    positions, depths = parse_depth(path)
+                except (OSError, ValueError):
+                    bad.append(sample)
+                    continue
+                if len(depths) != entry['lines'] or not np.array_equal(to_row(positions, depths, self.positions), row):
+                    bad.append(sample)
+        return bad
+
+
+def depth_files(run_dir, depth_dir=None) -> Dict[str, str]:
+    """Sample name -> depth file of a run"""
+
+    if depth_dir:
+        paths = glob.glob(os.path.join(depth_dir, "*.depth"))
+    else:
+        # loose files and members of the run's results bundle
+        paths = bundle.glob(run_dir, os.path.join("depth", "*.depth"))
+    return {os.path.basename(p)[:-len(".depth")]: p for p in paths}
+
+
+def bc_percent(count, total) -> str:
+    """count * 100 / total the way `bc` prints it with scale=2: truncated, no leading zero"""
+
+    if not total or not count:
+        return "0"
+    hundredths = count * 10000 // total
+    whole, frac = divmod(hundredths, 100)
+    return (str(whole) if whole else "") + "." + "{:02d}".format(frac)
+
+
+def read_bed(path) -> List[tuple]:
+    """(name, start, end) with 1-based inclusive coordinates from a BED file"""
+
+    regions = []
+    with open(path) as f:
+        for l in f:
+            fields = l.rstrip("\n").split("\t")
+            if len(fields) < 3 or l.startswith(("#", "track", "browser")):
+                continue
+            name = fields[3] if len(fields) > 3 else "{}-{}".format(int(fields[1]) + 1, fields[2])
+            regions.append((name, int(fields[1]) + 1, int(fields[2])))
+    return regions
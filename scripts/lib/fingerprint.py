@@ -0,0 +1,176 @@
+import fcntl
+import getpass
+import json
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from lib.staging import md5sum
+
+logger = logging.getLogger(__name__)
+
+# Digests of containers and reference files, shared by all runs. $COVID_FINGERPRINTS overrides the location.
+CACHE_ENV = "COVID_FINGERPRINTS"
+DEFAULT_CACHE = "/local/incoming/covid/config/fingerprints.tsv"
+CACHE_HEADER = ["path", "inode", "size", "mtime_ns", "md5"]
+
+
+def cache_file(path=None) -> str:
+    return path or os.environ.get(CACHE_ENV) or DEFAULT_CACHE
+
+
+def read_cache(path) -> Dict[str, dict]:
+    entries = {}
+    try:
+        with open(path) as f:
+            f.readline()
+            for l in f:
+                values = l.rstrip("\n").split("\t")
+                if len(values) == len(CACHE_HEADER):
+                    entries[values[0]] = {'inode': int(values[1]), 'size': int(values[2]),
+                                          'mtime_ns': int(values[3]), 'md5': values[4]}
+    except (OSError, ValueError):
+        pass
+    return entries
+
+
+def write_cache(path, entries) -> None:
+    tmp = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write("\t".join(CACHE_HEADER) + "\n")
+            for p in sorted(entries):
+                e = entries[p]
+                f.write("\t".join([p, str(e['inode']), str(e['size']), str(e['mtime_ns']), e['md5']]) + "\n")
+        os.chmod(tmp, 0o664)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _key(s) -> dict:
+    return {'inode': s.st_ino, 'size': s.st_size, 'mtime_ns': s.st_mtime_ns}
+
+
+def _describe(path, resolved, s, md5) -> dict:
+    return {
+        'path': path,
+        'resolved_path': resolved,
+        'is_symlink': os.path.islink(path),
+        'size': s.st_size,
+        'mtime': datetime.fromtimestamp(s.st_mtime).isoformat(timespec='seconds'),
+        'md5': md5,
+    }
+
+
+def fingerprint(files: Dict[str, str], cache=None, cached_only=False) -> Dict[str, dict]:
+    """Name -> path, resolved path, size, mtime and md5 for each file.
+
+    Digests are looked up by the resolved path and only trusted while inode,
+    size and mtime still match; anything else is hashed once under a lock on
+    the cache, so parallel make jobs wait for the first one instead of all
+    reading the same container. Missing files get md5 None, as do uncached
+    ones with cached_only. If the cache can not be locked or written, e.g.
+    without write access to config/, the files are hashed without it.
+    """
+
+    cache = cache_file(cache)
+    result, stats, todo = {}, {}, []
+    entries = read_cache(cache)
+    for name, path in files.items():
+        resolved = os.path.realpath(path)
+        try:
+            s = os.stat(resolved)
+        except OSError:
+            result[name] = {'path': path, 'resolved_path': resolved, 'is_symlink': os.path.islink(path),
+                            'size': None, 'mtime': None, 'md5': None}
+            continue
+        stats[name] = (resolved, s)
+        known = entries.get(resolved)
+        if known and {k: known[k] for k in ('inode', 'size', 'mtime_ns')} == _key(s):
+            result[name] = _describe(path, resolved, s, known['md5'])
+        else:
+            todo.append(name)
+
+    if todo and cached_only:
+        for name in todo:
+            resolved, s = stats[name]
+            result[name] = _describe(path=files[name], resolved=resolved, s=s, md5=None)
+        todo = []
+    if todo:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+            fd = os.open(cache + ".lock", os.O_WRONLY | os.O_CREAT, 0o664)
+        except OSError as e:
+            logger.warning("Fingerprint cache %s not usable, hashing without it: %s", cache, e)
+            fd = None
+        if fd is None:
+            for name in todo:
+                resolved, s = stats[name]
+                result[name] = _describe(files[name], resolved, s, md5sum(resolved))
+        else:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # another job may have hashed them while we waited
+                entries = read_cache(cache)
+                for name in todo:
+                    resolved, s = stats[name]
+                    known = entries.get(resolved)
+                    if not (known and {k: known[k] for k in ('inode', 'size', 'mtime_ns')} == _key(s)):
+                        known = dict(_key(s), md5=md5sum(resolved))
+                        entries[resolved] = known
+                    result[name] = _describe(files[name], resolved, s, known['md5'])
+                try:
+                    write_cache(cache, entries)
+                except OSError as e:
+                    logger.warning("Can not update fingerprint cache %s: %s", cache, e)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+    return {name: result[name] for name in files}
+
+
+def version_lines(prints: Dict[str, dict]) -> List[str]:
+    """key=value lines in the style of output/*.version"""
+
+    lines = []
+    for name, p in prints.items():
+        lines.append(name + "=" + p['resolved_path'])
+        lines.append(name + "_md5=" + (p['md5'] or ""))
+    return lines
+
+
+def provenance(prints: Dict[str, dict], fields: Optional[Dict[str, str]] = None) -> dict:
+    """Run provenance record: fields, who ran it where, and the fingerprints"""
+
+    record = dict(fields or {})
+    record.update({
+        'timestamp': datetime.now().astimezone().isoformat(timespec='seconds'),
+        'user': getpass.getuser(),
+        'hostname': socket.gethostname(),
+        'pwd': os.getcwd(),
+    })
+    container = prints.get('container')
+    if container:
+        # keys of the provenance files written before fingerprints were recorded
+        record.update({
+            'container_path': container['path'],
+            'resolved_path': container['resolved_path'],
+            'container_md5': container['md5'],
+            'container_size': container['size'],
+            'is_symlink': container['is_symlink'],
+        })
+    record['fingerprints'] = prints
+    return record
+
+
+def write_json(path, record) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
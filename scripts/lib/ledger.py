@@ -0,0 +1,249 @@
+import fcntl
+import fnmatch
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from lib.warehouse import parse_version, sample_id
+
+# One append-only ledger per run, next to the provenance/freyja_run_*.json files
+LEDGER = os.path.join("provenance", "ledger.jsonl")
+INDEX = os.path.join("provenance", "ledger.index.json")
+INDEX_VERSION = 1
+# unique per record, an index on them would be as large as the ledger
+UNINDEXED = {"processed_date", "time", "timestamp", "pwd", "run_id"}
+
+
+def ledger_file(run_dir) -> str:
+    return os.path.join(run_dir, LEDGER)
+
+
+def index_file(run_dir) -> str:
+    return os.path.join(run_dir, INDEX)
+
+
+def append(run_dir, records: Iterable[dict]) -> int:
+    """Append records as JSON lines.
+
+    All lines go out in a single write under an exclusive lock, parallel make
+    jobs never interleave and a reader never sees half a record.
+    """
+
+    data = "".join(json.dumps(r, sort_keys=True) + "\n" for r in records).encode()
+    if not data:
+        return 0
+    path = ledger_file(run_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, data)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    return data.count(b"\n")
+
+
+def record(sample=None, stage=None, **fields) -> dict:
+    r = {'time': datetime.now().astimezone().isoformat(timespec='seconds')}
+    if sample:
+        r['sample'] = sample
+    if stage:
+        r['stage'] = stage
+    r.update((k, v) for k, v in fields.items() if v is not None)
+    return r
+
+
+def _read_index(path) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        return index if index.get('version') == INDEX_VERSION else None
+    except (OSError, ValueError):
+        return None
+
+
+def _extend(index, path, start) -> None:
+    """Add the records from byte offset start on, stops at an incomplete last line"""
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                r = json.loads(line)
+            except ValueError:
+                r = None
+            if isinstance(r, dict):
+                index['count'] += 1
+                for k, v in r.items():
+                    if k not in UNINDEXED and isinstance(v, (str, int, float, bool)):
+                        index['keys'].setdefault(k, {}).setdefault(str(v), []).append(offset)
+            offset += len(line)
+    index['size'] = offset
+
+
+def load_index(run_dir, save=True) -> dict:
+    """Index of the run's ledger: key -> value -> byte offsets of the records.
+
+    The ledger only grows, so a stale index is brought up to date by reading
+    the records appended since it was written; the result is saved when the
+    run directory is writable.
+    """
+
+    path = ledger_file(run_dir)
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return {'version': INDEX_VERSION, 'size': 0, 'count': 0, 'keys': {}}
+    index = _read_index(index_file(run_dir))
+    if index is None or index['size'] > size:
+        index = {'version': INDEX_VERSION, 'size': 0, 'count': 0, 'keys': {}}
+    if index['size'] < size:
+        _extend(index, path, index['size'])
+        if save:
+            tmp = index_file(run_dir) + "." + str(os.getpid()) + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(index, f, separators=(",", ":"))
+                os.replace(tmp, index_file(run_dir))
+            except OSError:
+                pass
+    return index
+
+
+def _offsets(index, where: Dict[str, str]) -> Optional[List[int]]:
+    """Offsets of records matching every key=glob, None for all records"""
+
+    result = None
+    for key, pattern in where.items():
+        values = index['keys'].get(key, {})
+        if any(c in pattern for c in "*?["):
+            found = set(o for v, offsets in values.items() if fnmatch.fnmatchcase(v, pattern) for o in offsets)
+        else:
+            found = set(values.get(pattern, []))
+        result = found if result is None else result & found
+        if not result:
+            return []
+    return sorted(result) if result is not None else None
+
+
+def read_records(run_dir, offsets=None) -> List[dict]:
+    records = []
+    path = ledger_file(run_dir)
+    if not os.path.isfile(path):
+        return records
+    with open(path, "rb") as f:
+        if offsets is None:
+            lines = iter(f.readline, b"")
+        else:
+            def lines():
+                for o in offsets:
+                    f.seek(o)
+                    yield f.readline()
+            lines = lines()
+        for line in lines:
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(r, dict):
+                records.append(r)
+    return records
+
+
+def query_run(run_dir, where: Dict[str, str], unindexed: Dict[str, str] = None) -> List[dict]:
+    offsets = _offsets(load_index(run_dir), where) if where else None
+    records = read_records(run_dir, offsets) if offsets != [] else []
+    # the run is the ledger's directory, attached before filtering so run=<name> matches
+    run = os.path.basename(os.path.abspath(run_dir))
+    for r in records:
+        r.setdefault('run', run)
+    if unindexed:
+        records = [r for r in records
+                   if all(fnmatch.fnmatchcase(str(r.get(k, "")), p) for k, p in unindexed.items())]
+    return records
+
+
+def query(run_dirs: List[str], where: Dict[str, str], threads=8) -> List[dict]:
+    """Records of all runs matching every key=value (glob patterns allowed), runs scanned in parallel"""
+
+    # run is usually not in the records themselves, query_run adds it
+    indexed = {k: v for k, v in where.items() if k not in UNINDEXED and k != 'run'}
+    unindexed = {k: v for k, v in where.items() if k in UNINDEXED or k == 'run'}
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        results = pool.map(lambda d: query_run(d, indexed, unindexed), run_dirs)
+        return [r for records in results for r in records]
+
+
+def find_runs(roots) -> List[str]:
+    """Run directories with a ledger, roots may be runs or directories of runs"""
+
+    runs = []
+    for root in roots:
+        if os.path.isfile(ledger_file(root)):
+            runs.append(root)
+        else:
+            runs += sorted(os.path.dirname(os.path.dirname(p)) for p in glob.glob(os.path.join(root, "*", LEDGER)))
+    return runs
+
+
+def _mtime(path) -> str:
+    return datetime.fromtimestamp(os.stat(path).st_mtime).astimezone().isoformat(timespec='seconds')
+
+
+def import_files(run_dir) -> dict:
+    """Add output/*.version, output/*.freyja_version and provenance/freyja_run_*.json to the ledger.
+
+    Each record keeps the file it came from as source, files already
+    imported are skipped, so the import can run again after new samples.
+    """
+
+    done = set(load_index(run_dir)['keys'].get('source', {}))
+    records = []
+    counts = {'version': 0, 'freyja_version': 0, 'run': 0, 'skipped': 0}
+    output = os.path.join(run_dir, "output")
+    names = sorted(os.listdir(output)) if os.path.isdir(output) else []
+    for name in names:
+        if name.endswith(".freyja_version"):
+            kind, sample = 'freyja_version', name[:-len(".freyja_version")]
+        elif name.endswith(".version"):
+            kind, sample = 'version', name[:-len(".version")]
+        else:
+            continue
+        source = os.path.join("output", name)
+        if source in done:
+            counts['skipped'] += 1
+            continue
+        path = os.path.join(run_dir, source)
+        fields = dict(parse_version(path))
+        r = record(sample=sample, stage='demix', sample_id=sample_id(name), source=source, **fields)
+        r['time'] = fields.get('processed_date') or _mtime(path)
+        records.append(r)
+        counts[kind] += 1
+
+    for path in sorted(glob.glob(os.path.join(run_dir, "provenance", "freyja_run_*.json"))):
+        source = os.path.relpath(path, run_dir)
+        if source in done:
+            counts['skipped'] += 1
+            continue
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        fields = {k: v for k, v in data.items() if isinstance(v, (str, int, float, bool))}
+        for name, p in (data.get('fingerprints') or {}).items():
+            fields[name] = p.get('resolved_path')
+            fields[name + "_md5"] = p.get('md5')
+        r = record(stage='run', source=source, **fields)
+        r['time'] = data.get('timestamp') or _mtime(path)
+        records.append(r)
+        counts['run'] += 1
+    counts['records'] = append(run_dir, records)
+    return counts
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LINEAGES = "/local/incoming/covid/config/lineages.yml"
+CACHE_VERSION = 2
+# arrays _derive() builds from parent, stored in the cache so a load does not rebuild them
+DERIVED = ("ancestor_ptr", "ancestor_idx", "descendant_ptr", "descendant_idx", "depth")
+
+
+def _sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _csr(lists, n) -> tuple:
+    """List of index lists as (indptr, indices) arrays"""
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(l) for l in lists])
+    indices = np.fromiter((i for l in lists for i in l), dtype=np.int32, count=int(indptr[-1]))
+    return indptr, indices
+
+
+def _alias_prefixes(entries) -> Dict[str, str]:
+    """Alias prefix to full name from yml entries, e.g. BA -> B.1.1.529 from BA.2 / B.1.1.529.2"""
+
+    aliases = {}
+    for e in entries:
+        name, full = e.get('name'), e.get('alias')
+        if not name or not full or name == full:
+            continue
+        n, a = name.split("."), full.split(".")
+        if len(a) >= len(n) and a[len(a) - len(n) + 1:] == n[1:]:
+            aliases.setdefault(n[0], ".".join(a[:len(a) - len(n) + 1]))
+    return aliases
+
+
+class Hierarchy(object):
+    """Lineage hierarchy compiled from lineages.yml.
+
+    Lineages are placed in a prefix trie over their unaliased names
+    (BA.2 -> B.1.1.529.2); the parent of a lineage is the nearest trie
+    ancestor that is itself a lineage, or the yml 'parent' if given.
+    Ancestors and descendants are kept as CSR index arrays so rollups
+    are array operations instead of name matching.
+    """
+
+    def __init__(self, names, full, parent, aliases, derived=None):
+        self.names = list(names)
+        self.full = list(full)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.aliases = dict(aliases)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.full_index = {f: i for i, f in enumerate(self.full)}
+        self._resolved = {}     # name -> index, per hierarchy
+        if derived is None:
+            self._derive()
+        else:
+            for name in DERIVED:
+                setattr(self, name, derived[name])
+
+    def _derive(self):
+        n = len(self.names)
+        ancestors = []
+        for i in range(n):
+            chain = []
+            p = int(self.parent[i])
+            while p >= 0 and len(chain) <= n:
+                chain.append(p)
+                p = int(self.parent[p])
+            ancestors.append(chain)
+        descendants = [[] for _ in range(n)]
+        for i, chain in enumerate(ancestors):
+            for a in chain:
+                descendants[a].append(i)
+        self.ancestor_ptr, self.ancestor_idx = _csr(ancestors, n)
+        self.descendant_ptr, self.descendant_idx = _csr(descendants, n)
+        self.depth = np.diff(self.ancestor_ptr).astype(np.int32)
+
+    @classmethod
+    def compile(cls, entries, aliases=None) -> 'Hierarchy':
+        aliases = dict(_alias_prefixes(entries), **(aliases or {}))
+        names, full, explicit = [], [], []
+        seen = set()
+        for e in entries:
+            name = e.get('name')
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            names.append(name)
+            full.append(e.get('alias') or cls._unalias(name, aliases))
+            explicit.append(e.get('parent'))
+
+        # prefix trie over unaliased name components, a node is a lineage index or -1
+        trie = {}
+        for i, f in enumerate(full):
+            node = trie
+            for part in f.split("."):
+                node = node.setdefault(part, [-1, {}])
+                last = node
+                node = node[1]
+            last[0] = i
+
+        index = {n: i for i, n in enumerate(names)}
+        parent = np.full(len(names), -1, dtype=np.int32)
+        for i, f in enumerate(full):
+            if explicit[i] in index and index[explicit[i]] != i:
+                parent[i] = index[explicit[i]]
+                continue
+            node = trie
+            nearest = -1
+            for part in f.split(".")[:-1]:
+                node = node.get(part)
+                if node is None:
+                    break
+                if node[0] >= 0:
+                    nearest = node[0]
+                node = node[1]
+            parent[i] = nearest
+        return cls(names, full, parent, aliases)
+
+    @staticmethod
+    def _unalias(name, aliases) -> str:
+        parts = name.split(".")
+        target = aliases.get(parts[0])
+        if isinstance(target, str) and target:
+            return ".".join([target] + parts[1:])
+        return name
+
+    def save(self, path) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, names=np.array(self.names), full=np.array(self.full), parent=self.parent,
+                            aliases=np.array(json.dumps(self.aliases)), version=np.array(CACHE_VERSION),
+                            **{name: getattr(self, name) for name in DERIVED})
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_cache(cls, path) -> Optional['Hierarchy']:
+        try:
+            with np.load(path) as z:
+                if int(z['version']) != CACHE_VERSION:
+                    return None
+                return cls(z['names'].tolist(), z['full'].tolist(), z['parent'], json.loads(str(z['aliases'])),
+                           derived={name: z[name] for name in DERIVED})
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def __len__(self):
+        return len(self.names)
+
+    def ancestors(self, i) -> np.ndarray:
+        return self.ancestor_idx[self.ancestor_ptr[i]:self.ancestor_ptr[i + 1]]
+
+    def descendants(self, i) -> np.ndarray:
+        return self.descendant_idx[self.descendant_ptr[i]:self.descendant_ptr[i + 1]]
+
+    def resolve(self, name) -> int:
+        """Index of a lineage, or of its nearest known ancestor, -1 if unknown"""
+
+        i = self._resolved.get(name)
+        if i is None:
+            i = self._resolved[name] = self._resolve(name)
+        return i
+
+    def _resolve(self, name) -> int:
+        if name in self.index:
+            return self.index[name]
+        parts = self._unalias(name, self.aliases).split(".")
+        while parts:
+            i = self.full_index.get(".".join(parts))
+            if i is not None:
+                return i
+            parts.pop()
+        return -1
+
+    def rollup_matrix(self, clades: Sequence[str], exclusive=False) -> sp.csr_matrix:
+        """Lineage x clade 0/1 matrix, with one extra row for unknown lineages.
+
+        Inclusive: a lineage counts towards every listed ancestor (BA.2.75 is
+        in BA.2 and in B.1.1.529). Exclusive: only towards its nearest listed
+        ancestor, anything else goes to a trailing 'Other' column.
+        """
+
+        n = len(self.names)
+        targets = []
+        for c in clades:
+            i = self.resolve(c)
+            if i < 0 or self.names[i] != c and self.full[i] != c:
+                logger.warning("Unknown clade %s", c)
+            targets.append(i)
+
+        rows, cols = [], []
+        if not exclusive:
+            for j, t in enumerate(targets):
+                if t < 0:
+                    continue
+                members = np.concatenate([[t], self.descendants(t)])
+                rows.append(members)
+                cols.append(np.full(len(members), j, dtype=np.int32))
+            width = len(targets)
+        else:
+            # nearest listed ancestor-or-self per lineage, deepest target wins
+            assigned = np.full(n + 1, len(targets), dtype=np.int32)
+            best = np.full(n + 1, -1, dtype=np.int32)
+            for j, t in enumerate(targets):
+                if t < 0:
+                    continue
+                members = np.concatenate([[t], self.descendants(t)])
+                deeper = best[members] < self.depth[t]
+                assigned[members[deeper]] = j
+                best[members[deeper]] = self.depth[t]
+            rows.append(np.arange(n + 1))
+            cols.append(assigned)
+            width = len(targets) + 1
+
+        if rows:
+            r = np.concatenate(rows)
+            c = np.concatenate(cols)
+        else:
+            r = c = np.zeros(0, dtype=np.int32)
+        return sp.csr_matrix((np.ones(len(r), dtype=np.float64), (r, c)), shape=(n + 1, width))
+
+    def abundance_matrix(self, samples: Iterable[tuple]) -> sp.csr_matrix:
+        """Sample x lineage matrix from (lineages, abundances) pairs, unknown lineages in the last column"""
+
+        n = len(self.names)
+        indptr = [0]
+        indices = []
+        data = []
+        for lineages, abundances in samples:
+            for l, a in zip(lineages, abundances):
+                i = self.resolve(l)
+                indices.append(i if i >= 0 else n)
+                data.append(float(a))
+            indptr.append(len(indices))
+        m = sp.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32),
+                           np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, n + 1))
+        m.sum_duplicates()
+        return m
+
+    def rollup(self, abundances: sp.csr_matrix, clades: Sequence[str], exclusive=False) -> np.ndarray:
+        """Sample x clade abundances, one sparse matrix multiply"""
+
+        return np.asarray((abundances @ self.rollup_matrix(clades, exclusive=exclusive)).todense())
+
+
+def read_entries(path) -> List[dict]:
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    if isinstance(data, dict):
+        # {name: {parent: ..., alias: ...}} variant
+        data = [dict(v or {}, name=k) for k, v in data.items()]
+    return [e for e in data or [] if isinstance(e, dict)]
+
+
+def read_alias_key(path) -> Dict[str, str]:
+    """Pango alias_key.json, recombinant entries (lists) are kept out"""
+
+    with open(path) as f:
+        data = json.load(f)
+    return {k: v for k, v in data.items() if isinstance(v, str) and v}
+
+
+def load(path=DEFAULT_LINEAGES, alias_key=None, cache_dir=None) -> Hierarchy:
+    """Compiled hierarchy for a lineages.yml, cached next to it as lineages.<sha256>.npz"""
+
+    digest = _sha256(path)
+    if alias_key:
+        digest = hashlib.sha256((digest + _sha256(alias_key)).encode()).hexdigest()
+    cache_dir = cache_dir or os.path.dirname(os.path.abspath(path))
+    cache = os.path.join(cache_dir, "lineages." + digest[:16] + ".npz")
+
+    if os.path.isfile(cache):
+        h = Hierarchy.from_cache(cache)
+        if h is not None:
+            return h
+
+    h = Hierarchy.compile(read_entries(path), read_alias_key(alias_key) if alias_key else None)
+    try:
+        h.save(cache)
+    except OSError as e:
+        logger.warning("Can not cache lineage hierarchy in %s: %s", cache_dir, e)
+    return h
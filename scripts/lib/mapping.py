@@ -2,10 +2,65 @@ from pathlib import Path
 import os
 import sys
 import json
+import logging
 import re
-from typing import List
+from functools import lru_cache
+from typing import Iterable, List
+from lib import bundle
 # from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+# compiled once, get_id and the date lookups run for every file in an archive
+RUN_PREFIX_REGEX = re.compile(r"^([^-_\.]{6})\.([^_\.]+).*")
+LEGACY_DATE_REGEX = re.compile(r"^(\d{2})(\d{2})(\d{2})[_-].+")
+DATE_REGEX = re.compile(r"^(\d+)/(\d+)/(\d+)")
+
+
+@lru_cache(maxsize=None)
+def _id_regex(legacy, suffix):
+    if legacy:
+        return re.compile(r"^(\d{6}[-_].+[-_].+)" + suffix)
+    return re.compile(r"^([^_\.]+).*" + suffix)
+
+
+@lru_cache(maxsize=None)
+def normalize_date(d):
+    """M/D/YY from the mapping file to the YYMMDD style run prefix, None if not a date"""
+
+    res = DATE_REGEX.match(d)
+    if res is None:
+        return None
+    return "".join([res[3], res[1] if int(res[1]) > 9 else "0" + res[1], res[2] if int(res[2]) > 9 else "0" + res[2]])
+
+
+class Sample(object):
+    """One sample row: collection date, site and its (group, label) pairs.
+
+    Item access returns the fields in the shape the per sample dicts had
+    before, sample['labels'] the label texts and sample['columns'] the
+    header/group dicts, for callers still indexing by key.
+    """
+
+    __slots__ = ('date', 'site', 'labels')
+
+    def __init__(self, date, site, labels=()):
+        self.date = date
+        self.site = site
+        self.labels = labels
+
+    def __getitem__(self, key):
+        if key == 'labels':
+            return [label for group, label in self.labels]
+        if key == 'columns':
+            return [{'header': group, 'group': label} for group, label in self.labels]
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __repr__(self):
+        return "Sample({!r}, {!r}, {!r})".format(self.date, self.site, self.labels)
+
 
 class Mapping(object):
 
@@ -14,8 +69,9 @@ class Mapping(object):
         self.data = None
         self.legacy = False
         self.mapping = {}
-        self.sites = {}     # map sites to other locations
-        self.ids = {}       # map ids to sites
+        self.sites = {}     # map sites to an ordered set of (group, label) pairs
+        self.ids = {}       # map ids to Sample records
+        self._pairs = {}    # one shared tuple per distinct (group, label)
         self.id_column = 0
         self.include_columns = []
         self.exclude_columns = []
@@ -25,32 +81,20 @@ class Mapping(object):
         Id = None
         basename = os.path.basename(path)
 
-        # date_regex = re.compile("^(\d{6})\.((\d+)([-_].+))" + suffix)
-        date_regex = re.compile("^([^-_\.]{6})\.([^_\.]+).*")
-
-        res = date_regex.match(basename)
+        res = RUN_PREFIX_REGEX.match(basename)
         if res:
             basename = res[2]
 
-        if self.legacy:
-            regex = re.compile("^(\d{6}[-_].+[-_].+)" + suffix)
-            res = regex.match(basename)
-            if res:
-                Id = res[1]
-        else:
-            regex = re.compile("^([^_\.]+).*" + suffix)
-            res = regex.match(basename)
-            # print(res[0] , res[1])
-            if res:
-                Id = res[1]
+        res = _id_regex(self.legacy, suffix).match(basename)
+        if res:
+            Id = res[1]
 
         return Id
 
     def _id_legacy2date(self, Id):
         # 011022-9-C-1_S92.sorted.bam
 
-        regex = re.compile("^(\d{2})(\d{2})(\d{2})[_-].+")
-        res = regex.match(Id)
+        res = LEGACY_DATE_REGEX.match(Id)
 
         if res:
             return "".join([res[3], res[1], res[2]])
@@ -59,19 +103,16 @@ class Mapping(object):
 
     def _id2date(self, Id) -> str:
 
-        if Id in self.mapping['values']:
-            d = self.mapping['values'][Id]['date']
-            regex = re.compile("^(\d+)/(\d+)/(\d+)")
-            res = regex.match(d)
+        if Id in self.ids:
+            d = self.ids[Id].date
+            date = normalize_date(d) if d is not None else None
 
-            if res is None:
-                print("No date from " + d + ", skipping ")
-                return None
-            else:
-                return "".join([res[3], res[1] if int(res[1]) > 9 else "0" + res[1], res[2] if int(res[2]) > 9 else "0" + res[2]])
+            if date is None:
+                logger.debug("No date from %s, skipping", d)
+            return date
 
         else:
-            print("ID " + Id + " not in mapping, skipping.")
+            logger.debug("ID %s not in mapping, skipping", Id)
             return None
 
     def id2date(self, Id):
@@ -82,22 +123,83 @@ class Mapping(object):
 
     def id2site(self, Id):
         if Id in self.ids:
-            return self.ids[Id]['site']
+            return self.ids[Id].site
         else:
-            print("ID " + str(Id) + " not in sides")
+            logger.debug("ID %s not in sites", Id)
         return None
 
+    def resolve(self, paths: Iterable, suffix="") -> dict:
+        """Resolve ID, date and site for many paths or basenames in one call.
+
+        Returns {'samples': [(path, Id, date, site), ...], 'missing': {...}}.
+        Every path with an ID is in 'samples', date or site may be None;
+        'missing' collects paths without an ID, IDs not in the mapping and
+        IDs without a date so callers can print a single report instead of
+        one line per miss.
+        """
+
+        samples = []
+        missing = {'id': [], 'mapping': [], 'date': []}
+
+        for path in paths:
+            Id = self.get_id(path, suffix=suffix)
+            if not Id:
+                missing['id'].append(path)
+                continue
+
+            site = None
+            if self.legacy:
+                date = self._id_legacy2date(Id)
+            elif Id in self.ids:
+                sample = self.ids[Id]
+                site = sample.site
+                date = normalize_date(sample.date) if sample.date is not None else None
+            else:
+                missing['mapping'].append(Id)
+                samples.append((path, Id, None, None))
+                continue
+
+            if date is None:
+                missing['date'].append(Id)
+            samples.append((path, Id, date, site))
+
+        return {'samples': samples, 'missing': missing}
+
+    def report(self, result, stream=None, limit=10) -> None:
+        """Print a summary of the misses collected by resolve()"""
+
+        stream = stream or sys.stdout
+        stream.write("Resolved " + str(len(result['samples'])) + " IDs\n")
+        labels = {'id': "No ID for ", 'mapping': "Not in mapping: ", 'date': "No date for "}
+        for what, items in result['missing'].items():
+            if not items:
+                continue
+            shown = ", ".join(map(str, items[:limit])) + (" ..." if len(items) > limit else "")
+            stream.write(labels[what] + str(len(items)) + ": " + shown + "\n")
+
     def site2labels(self, site):
         if site in self.sites:
-            return self.sites[site]
+            return list(self.sites[site])
         else:
             return None
 
+    def _pair(self, group, label) -> tuple:
+        # intern strings and share the pair, sites and samples hold references only
+        key = (sys.intern(group), sys.intern(label))
+        return self._pairs.setdefault(key, key)
+
+    def _add_site_label(self, site, pair) -> None:
+        # dict as insertion ordered set
+        if not site in self.sites:
+            self.sites[site] = {}
+        self.sites[site][pair] = None
+
     def get_files(self, dir, pattern="*", suffix=".bam") -> List:
 
         if dir and os.path.isdir(dir):
             pattern = str(pattern) + suffix
-            return list(map(lambda x: x.joinpath(), Path(dir).rglob(pattern)))
+            # outputs of packed runs are bundle members, not files
+            return [Path(p) for p in bundle.rglob(dir, pattern)]
         else:
             sys.exit("Not a directory: " + dir)
 
@@ -132,7 +234,7 @@ class Mapping(object):
 
     def load_site_mapping(self, mapping_file):
 
-        print("Sites file: " + mapping_file)
+        logger.info("Sites file: %s", mapping_file)
         site2labels = self.sites
 
         with open(mapping_file) as f:
@@ -142,7 +244,7 @@ class Mapping(object):
             tags = header_line.strip().split("\t")
 
             if not (tags[0].lower() == "id_pattern" and tags[1].lower() == "siteid"):
-                print(tags[0].lower(), tags[1].lower())
+                logger.error("Header starts with %s, %s", tags[0].lower(), tags[1].lower())
                 sys.exit(
                     "Not a valid site mapping file, missing id_pattern and siteId")
 
@@ -152,20 +254,17 @@ class Mapping(object):
 
             for line in f:
                 values = line.strip().split("\t")
+                site = sys.intern(values[primary_column])
 
-                if not values[primary_column] in site2labels:
-                    site2labels[values[primary_column]] = []  # set([])
+                if not site in site2labels:
+                    site2labels[site] = {}
 
                 for idx, val in enumerate(values):
                     text = val.strip().replace(" ", "_").replace("/", "_").replace("(", "_").replace(")",
                                                                                                      "_").replace("'", "_").replace("`", "_").replace("&", "_").replace(",", "_").replace('"', '_')
                     group = tags[idx].strip().replace(" ", "_").replace("/", "_").replace("(", "_").replace(
                         ")", "_").replace("'", "_").replace("`", "_").replace("&", "_").replace(",", "_").replace('"', '_')
-                    site2labels[values[primary_column]].append(
-                        {
-                            'group': group,
-                            'label': text
-                        })
+                    self._add_site_label(site, self._pair(group, text))
 
     def _load_id_mapping(self):
 
@@ -194,7 +293,7 @@ class Mapping(object):
                     include_columns.append(idx)
                 if value in ["site_id", "siteid"]:
                     site_column = idx
-                    print("Found siteid column: " + str(idx))
+                    logger.info("Found siteid column: %d", idx)
                 if value == "sample_id" or value == "sample id":
                     primary_column = idx
                 elif val == "sample_collect_date" or val == "date":
@@ -203,9 +302,8 @@ class Mapping(object):
                 mapping['header'].append(val.strip().replace(" ", "_").replace("/", "_").replace("(", "_").replace(
                     ")", "_").replace("'", "_").replace("`", "_").replace("&", "_").replace(",", "_").replace('"', '_'))
 
-            print("Primary column:\t" + str(primary_column))
-            print("Excluding columns:\t" +
-                  ",".join(map(lambda x: str(x), exclude_columns)))
+            logger.info("Primary column: %d", primary_column)
+            logger.info("Excluding columns: %s", ",".join(map(str, exclude_columns)))
 
             for l in f:
                 values = l.strip().split("\t")
@@ -214,40 +312,26 @@ class Mapping(object):
                     continue
                 # print(values)
                 Id = values[primary_column]
-                site = values[site_column]
-
-                mapping['values'][Id] = {
-                    'date': None,
-                    'columns': []
-                }
-
-                ids2sites2dates[Id] = {
-                    'date': values[date_column],
-                    'site': values[site_column],
-                    'labels': []
-                }
+                site = sys.intern(values[site_column])
 
                 if not site in sites2labels:
-                    sites2labels[site] = []  # set([])
-
-                if not date_column is None:
-                    mapping['values'][Id]['date'] = values[date_column]
+                    sites2labels[site] = {}
 
-                for i, v in enumerate(values):
-                    text = v.strip().replace(" ", "_").replace("/", "_").replace("(", "_").replace(")", "_").replace("\\",
-                                                                                                                     "_").replace("'", "_").replace("`", "_").replace("&", "_").replace(",", "_").replace('"', '_')
+                labels = []
+                for i in include_columns:
                     if i in exclude_columns:
-                        pass
-                    elif i in include_columns:
-                        mapping['values'][Id]['columns'].append({
-                                                                'header': mapping['header'][i],
-                                                                'group': text
-                                                                })
-
-                        ids2sites2dates[Id]['labels'].append(text)
-                        sites2labels[site].append(
-                            {'group': mapping['header'][i], 'label': text})
-
+                        continue
+                    text = values[i].strip().replace(" ", "_").replace("/", "_").replace("(", "_").replace(")", "_").replace("\\",
+                                                                                                                             "_").replace("'", "_").replace("`", "_").replace("&", "_").replace(",", "_").replace('"', '_')
+                    pair = self._pair(mapping['header'][i], text)
+                    labels.append(pair)
+                    self._add_site_label(site, pair)
+
+                date = sys.intern(values[date_column]) if not date_column is None else None
+                ids2sites2dates[Id] = Sample(date, site, tuple(labels))
+
+        # per sample values are the Sample records, not a second copy
+        mapping['values'] = ids2sites2dates
         self.mapping = mapping
         self.ids = ids2sites2dates
         self.sites = sites2labels
@@ -0,0 +1,318 @@
+import fcntl
+import glob
+import logging
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from lib import bundle
+from lib.warehouse import read_mapping, sample_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE = "/local/incoming/covid/warehouse/mutations"
+MUTATIONS = "mutations.tsv"     # interned dictionary, id = line number, append only
+SAMPLES = "samples.tsv"         # matrix columns, append only
+RUNS = "runs.tsv"               # run -> fingerprint of its variants files
+SHARDS = "shards"               # <run>.npz: mutation, sample, af, dp per observation
+SAMPLE_HEADER = ["id", "run", "sample", "sample_id", "site_id", "collect_date"]
+EPOCH = date(1970, 1, 1)
+NO_DAY = np.iinfo(np.int32).max
+
+
+def _day(iso) -> int:
+    """YYYY-MM-DD as days since 1970, NO_DAY if unknown"""
+
+    try:
+        return (date(int(iso[0:4]), int(iso[5:7]), int(iso[8:10])) - EPOCH).days
+    except (TypeError, ValueError):
+        return NO_DAY
+
+
+def _iso(day) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat() if day != NO_DAY else ""
+
+
+def run_date(run) -> Optional[str]:
+    """YYMMDD run folder names as YYYY-MM-DD"""
+
+    if len(run) >= 6 and run[:6].isdigit():
+        iso = "20{}-{}-{}".format(run[0:2], run[2:4], run[4:6])
+        return iso if _day(iso) != NO_DAY else None
+    return None
+
+
+def read_variants(path) -> tuple:
+    """Mutation keys (REF POS ALT), ALT_FREQ and TOTAL_DP of an iVar/freyja variants TSV.
+
+    iVar repeats a mutation once per overlapping GFF feature, the first row counts.
+    """
+
+    keys, afs, dps = [], [], []
+    seen = set()
+    with bundle.open_file(path, errors='replace') as f:
+        header = f.readline().rstrip("\n").split("\t")
+        try:
+            pos, ref, alt, freq = (header.index(c) for c in ("POS", "REF", "ALT", "ALT_FREQ"))
+        except ValueError:
+            raise ValueError("Not a variants TSV: " + path)
+        total = header.index("TOTAL_DP") if "TOTAL_DP" in header else None
+        need = max(pos, ref, alt, freq, total or 0)
+        for l in f:
+            fields = l.rstrip("\n").split("\t")
+            if len(fields) <= need:
+                continue
+            key = fields[ref] + fields[pos] + fields[alt]
+            if key in seen:
+                continue
+            seen.add(key)
+            try:
+                af = float(fields[freq])
+                dp = int(float(fields[total])) if total is not None else 0
+            except ValueError:
+                continue
+            keys.append(key)
+            afs.append(af)
+            dps.append(dp)
+    return keys, np.array(afs, dtype=np.float32), np.array(dps, dtype=np.uint32)
+
+
+def variants_files(run_dir) -> Dict[str, str]:
+    return {os.path.basename(p)[:-len(".variants.tsv")]: p
+            for p in bundle.glob(run_dir, os.path.join("variants", "*.variants.tsv"))}
+
+
+def fingerprint(files) -> str:
+    newest = max((bundle.stat(p).st_mtime_ns for p in files.values()), default=0)
+    return "{}:{}".format(len(files), newest)
+
+
+class MutationStore(object):
+    """Mutation x sample allele frequencies and depths of many runs.
+
+    Mutations are interned once in mutations.tsv and samples numbered in
+    samples.tsv, both only ever appended to, so ids stay valid as runs are
+    added. Each run is a shard of (mutation, sample, af, dp) arrays; the
+    shards are stacked into CSR matrices with one row per mutation, so a
+    mutation's samples are a row slice and per-sample values gather by index.
+    """
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self.mutations = []         # type: List[str]
+        self.ids = {}               # type: Dict[str, int]
+        self.samples = []           # type: List[dict]
+        self.columns = {}           # type: Dict[tuple, int]
+        self.runs = {}              # type: Dict[str, str]
+        self._af = self._dp = None
+        self._load()
+
+    def _file(self, *name) -> str:
+        return os.path.join(self.path, *name)
+
+    def _load(self) -> None:
+        if os.path.isfile(self._file(MUTATIONS)):
+            with open(self._file(MUTATIONS)) as f:
+                self.mutations = [l.rstrip("\n") for l in f]
+            self.ids = {m: i for i, m in enumerate(self.mutations)}
+        if os.path.isfile(self._file(SAMPLES)):
+            with open(self._file(SAMPLES)) as f:
+                f.readline()
+                for l in f:
+                    values = l.rstrip("\n").split("\t")
+                    self.samples.append(dict(zip(SAMPLE_HEADER, values)))
+            self.columns = {(s['run'], s['sample']): int(s['id']) for s in self.samples}
+        if os.path.isfile(self._file(RUNS)):
+            with open(self._file(RUNS)) as f:
+                self.runs = dict(l.rstrip("\n").split("\t")[:2] for l in f if "\t" in l)
+
+    def intern(self, key) -> int:
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.mutations)
+            self.mutations.append(key)
+        return i
+
+    def _column(self, run, sample, sid, site, collect_date) -> int:
+        c = self.columns.get((run, sample))
+        if c is None:
+            c = self.columns[(run, sample)] = len(self.samples)
+            self.samples.append({'id': str(c), 'run': run, 'sample': sample})
+        self.samples[c].update({'sample_id': sid or "", 'site_id': site or "", 'collect_date': collect_date or ""})
+        return c
+
+    def add_run(self, run_dir, force=False) -> Optional[dict]:
+        """(Re)build the shard of one run, None if its variants files did not change"""
+
+        run = os.path.basename(os.path.normpath(run_dir))
+        files = variants_files(run_dir)
+        fp = fingerprint(files)
+        if self.runs.get(run) == fp and not force:
+            return None
+
+        meta = {}
+        for mapping_file in sorted(glob.glob(os.path.join(run_dir, "*.sample-mapping.tsv"))):
+            header, rows = read_mapping(mapping_file)
+            for sid, site, collect_date, wwtp, row in rows:
+                meta.setdefault(sid, (site, collect_date))
+        fallback = run_date(run)
+
+        mutation, column, afs, dps = [], [], [], []
+        stats = {'samples': 0, 'observations': 0, 'new_mutations': 0, 'failed': 0}
+        before = len(self.mutations)
+        for sample in sorted(files):
+            try:
+                keys, af, dp = read_variants(files[sample])
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping %s: %s", files[sample], e)
+                stats['failed'] += 1
+                continue
+            sid = sample_id(sample) or sample.split("_")[0]
+            site, collect_date = meta.get(sid, (None, None))
+            c = self._column(run, sample, sid, site, collect_date or fallback)
+            mutation.append(np.fromiter((self.intern(k) for k in keys), dtype=np.int32, count=len(keys)))
+            column.append(np.full(len(keys), c, dtype=np.int32))
+            afs.append(af)
+            dps.append(dp)
+            stats['samples'] += 1
+            stats['observations'] += len(keys)
+        stats['new_mutations'] = len(self.mutations) - before
+
+        def cat(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+        # the shard refers to the new mutation and sample ids, they go to disk first
+        self._write_dictionary()
+        os.makedirs(self._file(SHARDS), exist_ok=True)
+        tmp = self._file(SHARDS, run + ".tmp.npz")
+        np.savez_compressed(tmp, mutation=cat(mutation, np.int32), sample=cat(column, np.int32),
+                            af=cat(afs, np.float32), dp=cat(dps, np.uint32))
+        os.replace(tmp, self._file(SHARDS, run + ".npz"))
+        self.runs[run] = fp
+        self._af = self._dp = None
+        return stats
+
+    def _write(self, name, lines) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file(name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write("".join(l + "\n" for l in lines))
+        os.replace(tmp, self._file(name))
+
+    def _write_dictionary(self) -> None:
+        self._write(MUTATIONS, self.mutations)
+        self._write(SAMPLES, ["\t".join(SAMPLE_HEADER)] + ["\t".join(s.get(h, "") for h in SAMPLE_HEADER)
+                                                           for s in self.samples])
+
+    def save(self) -> None:
+        """Write dictionary, samples and runs; shards are written by add_run"""
+
+        self._write_dictionary()
+        self._write(RUNS, ["\t".join(i) for i in sorted(self.runs.items())])
+
+    def lock(self):
+        """Exclusive lock on the store for the duration of a build, returns the descriptor"""
+
+        os.makedirs(self.path, exist_ok=True)
+        fd = os.open(self._file(".lock"), os.O_WRONLY | os.O_CREAT, 0o664)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _matrices(self) -> None:
+        parts = {'mutation': [], 'sample': [], 'af': [], 'dp': []}
+        for run in sorted(self.runs):
+            path = self._file(SHARDS, run + ".npz")
+            if not os.path.isfile(path):
+                continue
+            with np.load(path) as z:
+                shard = {k: z[k] for k in parts}
+            # ids beyond the dictionary, e.g. a shard written by an older build that died before save()
+            if len(shard['mutation']) and (shard['mutation'].max() >= len(self.mutations)
+                                           or shard['sample'].max() >= len(self.samples)):
+                logger.warning("Skipping %s: refers to mutations or samples not in the store, rebuild run %s", path, run)
+                continue
+            for k in parts:
+                parts[k].append(shard[k])
+        arrays = {k: np.concatenate(v) if v else np.zeros(0) for k, v in parts.items()}
+        shape = (len(self.mutations), len(self.samples))
+        coords = (arrays['mutation'].astype(np.int64), arrays['sample'].astype(np.int64))
+        self._af = sp.csr_matrix((arrays['af'].astype(np.float32), coords), shape=shape)
+        self._dp = sp.csr_matrix((arrays['dp'].astype(np.uint32), coords), shape=shape)
+
+    @property
+    def af(self) -> sp.csr_matrix:
+        """mutations x samples allele frequency"""
+
+        if self._af is None:
+            self._matrices()
+        return self._af
+
+    @property
+    def dp(self) -> sp.csr_matrix:
+        """mutations x samples total depth at the mutation's position"""
+
+        if self._dp is None:
+            self._matrices()
+        return self._dp
+
+    def days(self) -> np.ndarray:
+        """Collection day of each sample, NO_DAY if unknown"""
+
+        return np.array([_day(s.get('collect_date')) for s in self.samples], dtype=np.int64)
+
+    def carriers(self, mutation, min_af=0.0, min_dp=0) -> List[tuple]:
+        """(sample column, af, dp) of samples with mutation at or above min_af"""
+
+        m = self.ids.get(mutation)
+        if m is None:
+            return []
+        start, end = self.af.indptr[m], self.af.indptr[m + 1]
+        cols = self.af.indices[start:end]
+        af = self.af.data[start:end]
+        dp = self.dp.data[start:end]
+        keep = (af >= min_af) & (dp >= min_dp)
+        return list(zip(cols[keep].tolist(), af[keep].tolist(), dp[keep].tolist()))
+
+    def first_seen(self, min_af=0.0) -> np.ndarray:
+        """Earliest collection day per mutation over samples with af >= min_af, NO_DAY if none"""
+
+        m = self.af.copy()
+        if min_af > 0:
+            m.data[m.data < min_af] = 0
+            m.eliminate_zeros()
+        days = self.days()
+        first = np.full(m.shape[0], NO_DAY, dtype=np.int64)
+        counts = np.diff(m.indptr)
+        rows = np.flatnonzero(counts)
+        if len(rows):
+            # minimum over each row's samples, one reduceat over the CSR index array
+            first[rows] = np.minimum.reduceat(days[m.indices], m.indptr[rows])
+        return first
+
+    def new_mutations(self, since, until=None, min_af=0.0) -> List[tuple]:
+        """(mutation, first seen) for mutations first seen between since and until"""
+
+        first = self.first_seen(min_af)
+        lo, hi = _day(since), _day(until) if until else NO_DAY - 1
+        rows = np.flatnonzero((first >= lo) & (first <= hi))
+        return [(self.mutations[i], _iso(first[i])) for i in rows[np.argsort(first[rows], kind='stable')]]
+
+    def prevalence(self, mutation, min_af=0.0, since=None, until=None) -> List[tuple]:
+        """(site, samples with mutation, samples) per site, samples restricted to the collection window"""
+
+        sites = [s.get('site_id') or "" for s in self.samples]
+        names, codes = np.unique(np.array(sites, dtype=object), return_inverse=True)
+        days = self.days()
+        window = np.ones(len(self.samples), dtype=bool)
+        if since:
+            window &= days >= _day(since)
+        if until:
+            window &= days <= _day(until)
+        total = np.bincount(codes[window], minlength=len(names))
+        cols = np.array([c for c, af, dp in self.carriers(mutation, min_af)], dtype=np.int64)
+        cols = cols[window[cols]] if len(cols) else cols
+        found = np.bincount(codes[cols], minlength=len(names)) if len(cols) else np.zeros(len(names), dtype=np.int64)
+        return [(names[i], int(found[i]), int(total[i])) for i in np.flatnonzero(total)]
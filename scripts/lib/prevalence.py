@@ -0,0 +1,134 @@
+import os
+from datetime import date
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+
+from lib.mapping import Mapping
+
+SITE_GROUP = "site_id"
+WINDOW = 14     # days
+HEADER = ["group", "label", "date", "samples", "window_samples", "lineage", "prevalence"]
+EPOCH = date(2000, 1, 1).toordinal()
+
+
+def lineage_matrix(demix: Iterable[dict]) -> tuple:
+    """Lineage names and the sample x lineage abundance matrix of parsed demix outputs"""
+
+    columns = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for d in demix:
+        for l, a in zip(d['lineages'], d['abundances']):
+            indices.append(columns.setdefault(l, len(columns)))
+            data.append(float(a))
+        indptr.append(len(indices))
+    m = sp.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32),
+                       np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(columns)))
+    m.sum_duplicates()
+    return list(columns), m
+
+
+def day_number(yymmdd) -> Optional[int]:
+    """Days since 2000-01-01 of a YYMMDD date as returned by mapping.normalize_date"""
+
+    try:
+        return date(2000 + int(yymmdd[0:2]), int(yymmdd[2:4]), int(yymmdd[4:6])).toordinal() - EPOCH
+    except (TypeError, ValueError):
+        return None
+
+
+def iso(day) -> str:
+    return date.fromordinal(int(day) + EPOCH).isoformat()
+
+
+def memberships(sites: Sequence[Optional[str]], mapping: Mapping, groups=None) -> Dict[str, tuple]:
+    """group -> (labels, unit, sample): every sample's labels in each group, from the site mapping.
+
+    unit indexes labels (sorted) and sample indexes sites, one entry per
+    (label, sample); site_id is a group of its own with the site as label.
+    """
+
+    pairs = {}
+    for i, site in enumerate(sites):
+        if site is None:
+            continue
+        pairs.setdefault(SITE_GROUP, []).append((site, i))
+        for group, label in mapping.site2labels(site) or []:
+            if group != SITE_GROUP:
+                pairs.setdefault(group, []).append((label, i))
+    result = {}
+    for group in sorted(pairs):
+        if groups and group not in groups:
+            continue
+        labels = sorted({l for l, i in pairs[group]})
+        index = {l: n for n, l in enumerate(labels)}
+        unit = np.fromiter((index[l] for l, i in pairs[group]), dtype=np.int64, count=len(pairs[group]))
+        sample = np.fromiter((i for l, i in pairs[group]), dtype=np.int64, count=len(pairs[group]))
+        result[group] = (labels, unit, sample)
+    return result
+
+
+def smooth(unit, sample, days, abundances, window=WINDOW, center=False) -> dict:
+    """Rolling window mean abundance of every unit (site or label) at each of its collection dates.
+
+    unit and sample are parallel arrays assigning samples to units, days the
+    collection day of every sample, abundances the sample x lineage matrix.
+    Samples are summed per unit and day with one sparse multiply; sorted by
+    (unit, day), the window of each row is a searchsorted range over the
+    combined key and its sum a difference of cumulative sums, so all units
+    are smoothed at once. The window covers the window days ending at the
+    date, or centered on it.
+    """
+
+    days = np.asarray(days, dtype=np.int64)
+    first = int(days[sample].min()) if len(sample) else 0
+    span = (int(days[sample].max()) - first if len(sample) else 0) + window + 1
+    # one key per unit and day, keys of different units more than a window apart
+    keys, daily = np.unique(unit * span + days[sample] - first, return_inverse=True)
+    indicator = sp.csr_matrix((np.ones(len(sample)), (daily, sample)), shape=(len(keys), abundances.shape[0]))
+    sums = np.asarray((indicator @ abundances).todense()) if sp.issparse(abundances) else indicator @ abundances
+    counts = np.bincount(daily, minlength=len(keys))
+
+    before, after = (window // 2, window - 1 - window // 2) if center else (window - 1, 0)
+    start = np.searchsorted(keys, keys - before, side='left')
+    end = np.searchsorted(keys, keys + after, side='right')
+    csum = np.zeros((len(keys) + 1, sums.shape[1]))
+    np.cumsum(sums, axis=0, out=csum[1:])
+    ccount = np.concatenate([[0], np.cumsum(counts)])
+    n = ccount[end] - ccount[start]
+    # cumulative sums leave rounding noise where a lineage is absent from the window
+    means = np.maximum((csum[end] - csum[start]) / n[:, None], 0.0)
+    means[means < 1e-12] = 0.0
+    return {
+        'unit': keys // span,
+        'day': keys % span + first,
+        'samples': counts,
+        'window_samples': n,
+        'prevalence': means
+    }
+
+
+def rows(group, labels, columns, result, min_prevalence=0.0) -> Iterable[list]:
+    """Tidy rows, one per label, date and lineage above min_prevalence"""
+
+    prevalence = result['prevalence']
+    r, c = np.nonzero((prevalence > 0) & (prevalence >= min_prevalence))
+    dates = [iso(d) for d in result['day']]
+    for i, j in zip(r, c):
+        yield [group, labels[result['unit'][i]], dates[i], str(result['samples'][i]), str(result['window_samples'][i]),
+               columns[j], "{:.6g}".format(prevalence[i, j])]
+
+
+def write_table(path, rows_: Iterable[list]) -> int:
+    tmp = path + ".tmp"
+    n = 0
+    with open(tmp, "w") as f:
+        f.write("\t".join(HEADER) + "\n")
+        for r in rows_:
+            f.write("\t".join(r) + "\n")
+            n += 1
+    os.replace(tmp, path)
+    return n
@@ -0,0 +1,171 @@
+import fcntl
+import os
+from datetime import datetime
+from typing import Dict, List
+
+from lib import bundle
+
+# every decision, appended by the parallel make jobs; rewritten one line per sample by summarize()
+DECISIONS = "qc_gate.tsv"
+FAILED = "qc_failed.tsv"
+# placeholder outputs of skipped samples, outside output/ so aggregates and summaries do not pick them up
+SKIPPED_DIR = "qc_failed"
+THRESHOLD = 3   # same as depth2cov.sh
+HEADER = ["sample", "decision", "breadth", "mean_depth", "reason", "min_breadth", "min_mean_depth", "depth", "time"]
+FAILED_HEADER = ["sample", "reason"]
+# gate columns added to summary.all.tsv
+SUMMARY_COLUMNS = ["decision", "breadth", "mean_depth", "reason"]
+
+
+def depth_stats(path, depth=THRESHOLD) -> tuple:
+    """Breadth (% of positions with at least depth reads, of all lines like depth2cov.sh) and mean depth"""
+
+    # plain python, the gate runs once per sample and should not pay for importing numpy
+    lines = covered = total = 0
+    with bundle.open_file(path, "rb") as f:
+        for l in f:
+            columns = l.split()
+            if not columns:
+                continue
+            if len(columns) != 4:
+                raise ValueError("Not a four column depth file: " + path)
+            reads = int(columns[3])
+            lines += 1
+            covered += reads >= depth
+            total += reads
+    if not lines:
+        return 0.0, 0.0
+    return 100.0 * covered / lines, total / lines
+
+
+def decide(sample, depth_file, min_breadth=0.0, min_mean_depth=0.0, depth=THRESHOLD) -> dict:
+    """pass or fail for one sample, with the reason for a fail"""
+
+    d = {
+        'sample': sample,
+        'breadth': None,
+        'mean_depth': None,
+        'min_breadth': min_breadth,
+        'min_mean_depth': min_mean_depth,
+        'depth': depth,
+        'time': datetime.now().astimezone().isoformat(timespec='seconds')
+    }
+    reasons = []
+    try:
+        d['breadth'], d['mean_depth'] = depth_stats(depth_file, depth)
+    except (OSError, ValueError) as e:
+        reasons.append("no depth: " + str(e))
+    else:
+        if d['breadth'] < min_breadth:
+            reasons.append("breadth {:.2f}% at depth {} < {}%".format(d['breadth'], depth, min_breadth))
+        if d['mean_depth'] < min_mean_depth:
+            reasons.append("mean depth {:.2f} < {}".format(d['mean_depth'], min_mean_depth))
+    d['decision'] = "fail" if reasons else "pass"
+    d['reason'] = "; ".join(reasons)
+    return d
+
+
+def placeholder(out_file, variants_file, decision) -> None:
+    """A demix .out without lineages so downstream steps see the sample, with the reason after the file name"""
+
+    breadth = decision['breadth']
+    lines = [
+        "\t" + variants_file + "\tqc_failed: " + decision['reason'],
+        "summarized\t[]",
+        "lineages\t[]",
+        "abundances\t[]",
+        "resid\t",
+        "coverage\t" + ("{:.2f}".format(breadth) if breadth is not None else "0.00"),
+        ""
+    ]
+    tmp = out_file + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines))
+    os.replace(tmp, out_file)
+
+
+def _value(v) -> str:
+    if v is None:
+        return ""
+    return "{:.4g}".format(v) if isinstance(v, float) else str(v)
+
+
+def append_rows(path, header, rows: List[dict]) -> None:
+    """Append rows under an exclusive lock, with the header if the file is new"""
+
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        text = "" if os.fstat(fd).st_size else "\t".join(header) + "\n"
+        text += "".join("\t".join(_value(r.get(h)) for h in header) + "\n" for r in rows)
+        os.write(fd, text.encode())
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def record(run_dir, decision) -> None:
+    append_rows(os.path.join(run_dir, DECISIONS), HEADER, [decision])
+    if decision['decision'] == "fail":
+        append_rows(os.path.join(run_dir, FAILED), FAILED_HEADER, [decision])
+
+
+def read_decisions(run_dir) -> Dict[str, dict]:
+    """Latest decision per sample"""
+
+    decisions = {}
+    try:
+        with open(os.path.join(run_dir, DECISIONS)) as f:
+            header = f.readline().rstrip("\n").split("\t")
+            for l in f:
+                values = l.rstrip("\n").split("\t")
+                if len(values) == len(header) and values != header:
+                    decisions[values[0]] = dict(zip(header, values))
+    except OSError:
+        pass
+    return decisions
+
+
+def summarize(run_dir) -> Dict[str, dict]:
+    """Rewrite the decision and qc_failed lists with one line per sample, a re-run's decision wins"""
+
+    decisions = read_decisions(run_dir)
+    for name, header, rows in [(DECISIONS, HEADER, [decisions[s] for s in sorted(decisions)]),
+                               (FAILED, FAILED_HEADER, [decisions[s] for s in sorted(decisions)
+                                                        if decisions[s]['decision'] == "fail"])]:
+        path = os.path.join(run_dir, name)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\t".join(header) + "\n")
+            for r in rows:
+                f.write("\t".join(r.get(h, "") for h in header) + "\n")
+        os.replace(tmp, path)
+    return decisions
+
+
+def join_summary(path, decisions) -> int:
+    """Append the gate columns to the run summary, keyed on its first column like join -a -e 'n/a'.
+
+    Samples the gate skipped have no demix output, so they get a row if the
+    summary has none. Returns the number of rows with a decision.
+    """
+
+    if not decisions:
+        return 0
+    with open(path) as f:
+        lines = [l.rstrip("\n") for l in f if l.strip()]
+    rows = []
+    seen = set()
+    for l in lines:
+        sample = l.split("\t", 1)[0]
+        d = decisions.get(sample)
+        if d:
+            seen.add(sample)
+        rows.append("\t".join([l] + [d.get(c, "") if d else "n/a" for c in SUMMARY_COLUMNS]))
+    for sample in sorted(set(decisions) - seen):
+        rows.append("\t".join([sample, "n/a"] + [decisions[sample].get(c, "") for c in SUMMARY_COLUMNS]))
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("".join(r + "\n" for r in sorted(rows)))
+    os.replace(tmp, path)
+    return len(decisions)
@@ -0,0 +1,253 @@
+import logging
+import os
+import re
+from fnmatch import translate
+from typing import Dict, Iterable, List
+
+from lib import bundle
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+OUT_DIR = "out"
+TMP_SUFFIX = ".reconcile.tmp"
+
+# labels2aggregates.py matches *.<YYMMDD>[-_]<ID pattern>*.out
+PATTERN_ANCHOR = re.compile(r"\.\d{6}[-_]")
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class Source(object):
+    """File in the output archive a link should point to, inode None for a member of a packed run"""
+
+    __slots__ = ('path', 'inode')
+
+    def __init__(self, path, inode):
+        self.path = path
+        self.inode = inode
+
+
+def _walk(root) -> Iterable[os.DirEntry]:
+    """Files below root, one scandir per directory"""
+
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError as e:
+            logger.warning("Can not read %s: %s", d, e)
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    yield entry
+
+
+def scan_sources(dirs, suffix=".out") -> Dict[str, Source]:
+    """Basename -> file for every output below dirs, the newest copy wins if a name repeats.
+
+    Outputs that only exist in a run's results.bundle are added for names
+    without a loose copy.
+    """
+
+    sources = {}
+    mtimes = {}
+    packed = {}
+    for d in dirs:
+        for entry in _walk(d):
+            if entry.name == bundle.BUNDLE:
+                run_dir = os.path.dirname(entry.path)
+                for member in bundle.members(run_dir):
+                    path = os.path.join(run_dir, member)
+                    name = os.path.basename(member)
+                    if not name.endswith(suffix) or os.path.lexists(path):
+                        continue
+                    if name not in packed or bundle.stat(path).st_mtime > bundle.stat(packed[name]).st_mtime:
+                        packed[name] = path
+                continue
+            if not entry.name.endswith(suffix):
+                continue
+            known = sources.get(entry.name)
+            if known is not None and known.inode != entry.inode():
+                # recomputed output next to an old copy, stat only when names collide
+                if entry.name not in mtimes:
+                    mtimes[entry.name] = os.stat(known.path).st_mtime
+                mtime = entry.stat().st_mtime
+                if mtime <= mtimes[entry.name]:
+                    continue
+                mtimes[entry.name] = mtime
+            sources[entry.name] = Source(entry.path, entry.inode())
+    for name, path in packed.items():
+        if name not in sources:
+            sources[name] = Source(path, None)
+    return sources
+
+
+def desired_by_site(sources, mapping) -> tuple:
+    """(group, label) -> name -> Source from the sample's site labels, as samples2aggregates.py links them"""
+
+    tree = {}
+    result = mapping.resolve(sorted(sources))
+    for name, Id, date, site in result['samples']:
+        if site is None:
+            continue
+        for pair in mapping.sites.get(site, ()):
+            # an empty label would link into <group>/data, outside any label directory
+            if pair[1]:
+                tree.setdefault(pair, {})[name] = sources[name]
+    return tree, result
+
+
+def desired_by_pattern(sources, patterns, suffix=".out") -> Dict[tuple, Dict[str, Source]]:
+    """(group, label) -> name -> Source for ID patterns, as labels2aggregates.py links them.
+
+    patterns maps an ID pattern to its (group, label) pairs. Plain patterns
+    are looked up by prefix length instead of matching every pattern against
+    every file; patterns with glob characters fall back to fnmatch.
+    """
+
+    plain, globbed = {}, []
+    for p, pairs in patterns.items():
+        if not p:
+            continue
+        if GLOB_CHARS.search(p):
+            globbed.append((re.compile(translate(p + "*" + suffix)), p))
+        else:
+            plain[p] = pairs
+    lengths = sorted({len(p) for p in plain})
+
+    tree = {}
+    for name, source in sources.items():
+        if not name.endswith(suffix):
+            continue
+        matched = set()
+        for m in PATTERN_ANCHOR.finditer(name):
+            rest = name[m.end():]
+            for n in lengths:
+                if len(rest) - n < len(suffix):
+                    break
+                if rest[:n] in plain:
+                    matched.add(rest[:n])
+            for regex, p in globbed:
+                if regex.match(rest):
+                    matched.add(p)
+        for p in matched:
+            for pair in patterns[p]:
+                if pair[1]:
+                    tree.setdefault(pair, {})[name] = source
+    return tree
+
+
+def scan_tree(dest, groups=None, suffix=".out") -> Dict[tuple, Dict[str, int]]:
+    """(group, label) -> name -> inode for the files in <dest>/<group>/<label>/data"""
+
+    tree = {}
+    with os.scandir(dest) as it:
+        group_dirs = [e for e in it if e.is_dir() and (not groups or e.name in groups)]
+    for g in group_dirs:
+        with os.scandir(g.path) as it:
+            label_dirs = [e for e in it if e.is_dir()]
+        for l in label_dirs:
+            files = {}
+            try:
+                with os.scandir(os.path.join(l.path, DATA_DIR)) as it:
+                    for e in it:
+                        if e.name.endswith(suffix) and e.is_file(follow_symlinks=False):
+                            files[e.name] = e.inode()
+            except FileNotFoundError:
+                pass
+            tree[(g.name, l.name)] = files
+    return tree
+
+
+class Plan(object):
+    """Links to add, replace (same name, different inode) and remove per (group, label)"""
+
+    def __init__(self):
+        self.add = []           # (pair, name, Source)
+        self.replace = []       # (pair, name, Source)
+        self.remove = []        # (pair, name)
+        self.unchanged = 0
+        self.failed = []        # (target, error)
+
+    @property
+    def changed(self) -> List[tuple]:
+        pairs = {c[0] for c in self.add} | {c[0] for c in self.replace} | {c[0] for c in self.remove}
+        return sorted(pairs)
+
+    def summary(self) -> dict:
+        return {'add': len(self.add), 'replace': len(self.replace), 'remove': len(self.remove),
+                'unchanged': self.unchanged, 'failed': len(self.failed), 'groups': len(self.changed)}
+
+
+def diff(desired, actual, groups=None) -> Plan:
+    """Compare the desired tree against the actual one, groups limits removals to those group dirs"""
+
+    plan = Plan()
+    for pair, files in desired.items():
+        if groups and pair[0] not in groups:
+            continue
+        have = actual.get(pair, {})
+        for name, source in files.items():
+            inode = have.get(name)
+            if inode is None:
+                plan.add.append((pair, name, source))
+            # a packed source has no inode to compare, the link made before packing stays
+            elif source.inode is not None and inode != source.inode:
+                plan.replace.append((pair, name, source))
+            else:
+                plan.unchanged += 1
+    for pair, files in actual.items():
+        want = desired.get(pair, {})
+        for name in files:
+            if name not in want:
+                plan.remove.append((pair, name))
+    return plan
+
+
+def apply(plan, dest, dry_run=False) -> Plan:
+    """Carry out a plan, replacements go through a temporary link and rename so readers never see a gap.
+
+    A source that only exists in its run's bundle is written out as a copy.
+    """
+
+    if dry_run:
+        return plan
+
+    created = set()
+    for pair, name, source in plan.add + plan.replace:
+        label_dir = os.path.join(dest, pair[0], pair[1])
+        target = os.path.join(label_dir, DATA_DIR, name)
+        try:
+            if pair not in created:
+                os.makedirs(os.path.join(label_dir, DATA_DIR), exist_ok=True)
+                os.makedirs(os.path.join(label_dir, OUT_DIR), exist_ok=True)
+                created.add(pair)
+            tmp = target + TMP_SUFFIX
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            if not bundle.link(source.path, tmp):
+                raise FileNotFoundError("No such file or bundle member: " + source.path)
+            os.replace(tmp, target)
+            # rename() is a no-op if both names are already the same inode
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+        except OSError as e:
+            plan.failed.append((target, str(e)))
+
+    for pair, name in plan.remove:
+        target = os.path.join(dest, pair[0], pair[1], DATA_DIR, name)
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            plan.failed.append((target, str(e)))
+    return plan
+
+
+def reconcile(desired, dest, groups=None, suffix=".out", dry_run=False) -> Plan:
+    return apply(diff(desired, scan_tree(dest, groups=groups, suffix=suffix), groups=groups), dest, dry_run=dry_run)
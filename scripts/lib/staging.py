@@ -0,0 +1,227 @@
+import bisect
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# 4MB reads keep NFS round trips low without blowing up memory per worker
+BUFFER_SIZE = 4 * 1024 * 1024
+MANIFEST_HEADER = ["path", "size", "mtime", "md5", "method"]
+
+
+def discover(src, patterns) -> Dict[str, List[str]]:
+    """Walk src once and return matching files grouped by pattern"""
+
+    found = {p: [] for p in patterns}
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in sorted(files):
+            for p in patterns:
+                if fnmatch(name, p):
+                    found[p].append(os.path.join(root, name))
+                    break
+    return found
+
+
+class ReadIndex(object):
+    """Sorted fastq names of a reads directory, listed once, looked up by sample prefix"""
+
+    def __init__(self, reads_dir, recursive=False):
+        self.dir = reads_dir
+        self.paths = {}
+        if recursive:
+            for root, dirs, files in os.walk(reads_dir):
+                for name in files:
+                    if ".fastq" in name:
+                        self.paths.setdefault(name, os.path.join(root, name))
+        else:
+            with os.scandir(reads_dir) as it:
+                for e in it:
+                    if ".fastq" in e.name and not e.is_dir():
+                        self.paths[e.name] = e.path
+        self.names = sorted(self.paths)
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, prefix) -> List[str]:
+        """Same files as glob(<reads_dir>/<prefix>*.fastq*)"""
+
+        found = []
+        i = bisect.bisect_left(self.names, prefix)
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            if ".fastq" in self.names[i][len(prefix):]:
+                found.append(self.paths[self.names[i]])
+            i += 1
+        return found
+
+
+def md5sum(path, buffer_size=BUFFER_SIZE) -> str:
+    """Stream a file through md5 without loading it into memory"""
+
+    digest = hashlib.md5()
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def copy_with_checksum(src, dest, buffer_size=BUFFER_SIZE) -> str:
+    """Copy src to dest and return the md5 of the bytes written.
+
+    The data is written to dest.part and renamed once complete, so an
+    interrupted copy never leaves a truncated file under the final name.
+    """
+
+    digest = hashlib.md5()
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    tmp = dest + ".part"
+    written = 0
+    with open(src, "rb", buffering=0) as fin, open(tmp, "wb", buffering=0) as fout:
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+            fout.write(view[:n])
+            written += n
+    size = os.stat(src).st_size
+    if written != size:
+        os.remove(tmp)
+        raise IOError("Short copy for " + src + ": " + str(written) + "/" + str(size) + " bytes")
+    shutil.copymode(src, tmp)
+    os.replace(tmp, dest)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_file) -> Dict[str, dict]:
+    """Load a staging manifest, keyed by destination path"""
+
+    entries = {}
+    if manifest_file and os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            header = f.readline().rstrip("\n").split("\t")
+            for l in f:
+                values = l.rstrip("\n").split("\t")
+                if len(values) != len(header):
+                    continue
+                entry = dict(zip(header, values))
+                entry['size'] = int(entry['size'])
+                entries[entry['path']] = entry
+    return entries
+
+
+def write_manifest(manifest_file, entries) -> None:
+    """Atomically rewrite the manifest"""
+
+    tmp = manifest_file + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("\t".join(MANIFEST_HEADER) + "\n")
+        for path in sorted(entries):
+            e = entries[path]
+            f.write("\t".join([path, str(e['size']), str(e['mtime']), e['md5'], e['method']]) + "\n")
+    os.replace(tmp, manifest_file)
+
+
+def is_staged(src, dest, entry) -> bool:
+    """True if dest is an identical, already recorded copy of src"""
+
+    if entry is None or not os.path.isfile(dest):
+        return False
+    s = os.stat(src)
+    d = os.stat(dest)
+    if (s.st_dev, s.st_ino) == (d.st_dev, d.st_ino):
+        return True
+    return entry['size'] == s.st_size == d.st_size and entry['mtime'] == str(int(s.st_mtime))
+
+
+def stage_file(src, dest, link=True, verify=False) -> dict:
+    """Hardlink src to dest if possible, otherwise copy it with a checksum, md5 is "-" for links"""
+
+    s = os.stat(src)
+    method = None
+    checksum = None
+
+    if os.path.exists(dest):
+        os.remove(dest)
+
+    if link and os.stat(os.path.dirname(dest) or ".").st_dev == s.st_dev:
+        try:
+            os.link(src, dest)
+            method = "link"
+        except OSError as e:
+            logger.debug("Can not link %s: %s", src, e)
+
+    # a hardlink is the same inode, hashing it would only reread the source
+    if method == "link":
+        checksum = "-"
+    else:
+        checksum = copy_with_checksum(src, dest)
+        method = "copy"
+        if verify and md5sum(dest) != checksum:
+            raise IOError("Checksum mismatch after copy: " + dest)
+
+    return {
+        'size': s.st_size,
+        'mtime': str(int(s.st_mtime)),
+        'md5': checksum,
+        'method': method
+    }
+
+
+def stage(files, dest_dir, manifest_file, base_dir=None, threads=8, link=True, verify=False) -> dict:
+    """Stage files into dest_dir in parallel, skipping files already in the manifest.
+
+    Manifest paths are stored relative to base_dir (default dest_dir) so the
+    run directory can be moved without invalidating it. Returns a dict of
+    counts and the list of failed files.
+    """
+
+    base_dir = base_dir or dest_dir
+    entries = read_manifest(manifest_file)
+    stats = {'staged': 0, 'linked': 0, 'copied': 0, 'skipped': 0, 'bytes': 0, 'failed': []}
+    todo = {}
+
+    for src in files:
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        key = os.path.relpath(dest, base_dir)
+        if key in todo:
+            logger.error("Duplicate file name %s, keeping %s", src, todo[key][0])
+            continue
+        if is_staged(src, dest, entries.get(key)):
+            stats['skipped'] += 1
+            continue
+        todo[key] = (src, dest)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        jobs = {pool.submit(stage_file, src, dest, link, verify): key for key, (src, dest) in todo.items()}
+        for job in as_completed(jobs):
+            key = jobs[job]
+            try:
+                entry = job.result()
+            except (OSError, IOError) as e:
+                logger.error("Failed staging %s: %s", todo[key][0], e)
+                stats['failed'].append(todo[key][0])
+                continue
+            entry['path'] = key
+            entries[key] = entry
+            stats['staged'] += 1
+            stats['bytes'] += entry['size']
+            stats['linked' if entry['method'] == "link" else 'copied'] += 1
+
+    stats['seconds'] = round(time.time() - start, 2)
+    write_manifest(manifest_file, entries)
+    return stats
@@ -0,0 +1,407 @@
+import ftplib
+import hashlib
+import logging
+import os
+import posixpath
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from lib.staging import md5sum, read_manifest, write_manifest
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+PART_SUFFIX = ".part"
+PROTOCOLS = ["sftp", "ftp", "ftps", "file"]
+# worth a reconnect and retry, ftplib.all_errors includes OSError
+RETRY_ERRORS = (EOFError,) + ftplib.all_errors
+
+
+class _Digesting(object):
+    """File reader updating a digest with every block read"""
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+
+    def read(self, n=-1) -> bytes:
+        data = self.f.read(n)
+        if self.digest is not None:
+            self.digest.update(data)
+        return data
+
+
+def _md5_prefix(path, size, buffer_size=CHUNK_SIZE):
+    """md5 object over the first size bytes of path, the part a resumed upload does not send again"""
+
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        while size > 0:
+            block = f.read(min(buffer_size, size))
+            if not block:
+                break
+            digest.update(block)
+            size -= len(block)
+    return digest
+
+
+class Transport(object):
+    """One connection to the submission endpoint, paths are relative to its root"""
+
+    scheme = None
+
+    def size(self, remote) -> Optional[int]:
+        raise NotImplementedError
+
+    def upload(self, local, remote, offset=0, chunk_size=CHUNK_SIZE, digest=None) -> bool:
+        """Send local from offset on, appending to remote.
+
+        A transport that reads the file itself feeds the bytes it sends to
+        digest and returns True, so they are not read a second time for the
+        manifest md5.
+        """
+
+        raise NotImplementedError
+
+    def rename(self, src, dest) -> None:
+        raise NotImplementedError
+
+    def makedirs(self, path) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LocalTransport(Transport):
+    """Directory standing in for the endpoint, for tests and dry runs against a mount"""
+
+    scheme = "file"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, remote) -> str:
+        return os.path.join(self.root, remote.lstrip("/"))
+
+    def size(self, remote) -> Optional[int]:
+        try:
+            return os.stat(self._path(remote)).st_size
+        except FileNotFoundError:
+            return None
+
+    def upload(self, local, remote, offset=0, chunk_size=CHUNK_SIZE, digest=None) -> bool:
+        with open(local, "rb") as fin, open(self._path(remote), "r+b" if offset else "wb") as fout:
+            fin.seek(offset)
+            fout.seek(offset)
+            fout.truncate()
+            shutil.copyfileobj(_Digesting(fin, digest), fout, chunk_size)
+        return digest is not None
+
+    def rename(self, src, dest) -> None:
+        os.replace(self._path(src), self._path(dest))
+
+    def makedirs(self, path) -> None:
+        os.makedirs(self._path(path), exist_ok=True)
+
+
+class FTPTransport(Transport):
+    """FTP or explicit FTPS, resumes with REST"""
+
+    scheme = "ftp"
+
+    def __init__(self, host, port=None, user=None, password=None, root="/", tls=False, timeout=60):
+        self.root = root or "/"
+        self.ftp = ftplib.FTP_TLS(timeout=timeout) if tls else ftplib.FTP(timeout=timeout)
+        self.ftp.connect(host, port or 21)
+        self.ftp.login(user or "anonymous", password or "")
+        if tls:
+            self.ftp.prot_p()
+            self.scheme = "ftps"
+        self.ftp.voidcmd("TYPE I")
+
+    def _path(self, remote) -> str:
+        return posixpath.join(self.root, remote.lstrip("/"))
+
+    def size(self, remote) -> Optional[int]:
+        try:
+            return self.ftp.size(self._path(remote))
+        except ftplib.error_perm:
+            return None
+
+    def upload(self, local, remote, offset=0, chunk_size=CHUNK_SIZE, digest=None) -> bool:
+        with open(local, "rb") as f:
+            f.seek(offset)
+            self.ftp.storbinary("STOR " + self._path(remote), _Digesting(f, digest), blocksize=chunk_size,
+                                rest=offset or None)
+        return digest is not None
+
+    def rename(self, src, dest) -> None:
+        try:
+            self.ftp.delete(self._path(dest))
+        except ftplib.error_perm:
+            pass
+        self.ftp.rename(self._path(src), self._path(dest))
+
+    def makedirs(self, path) -> None:
+        current = self.root
+        for part in path.strip("/").split("/"):
+            current = posixpath.join(current, part)
+            try:
+                self.ftp.mkd(current)
+            except ftplib.error_perm:
+                pass
+
+    def close(self) -> None:
+        try:
+            self.ftp.quit()
+        except ftplib.all_errors:
+            self.ftp.close()
+
+
+class SFTPTransport(Transport):
+    """OpenSSH sftp in batch mode over one multiplexed connection, resumes with reput.
+
+    Batch mode can not answer password prompts, the account needs key
+    authentication (or an agent).
+    """
+
+    scheme = "sftp"
+
+    def __init__(self, host, port=None, user=None, root="/", sftp="sftp"):
+        self.root = root or "/"
+        self.target = (user + "@" + host) if user else host
+        self.control = os.path.join(tempfile.gettempdir(), "sra-submit-%d-%d.ssh" % (os.getpid(), id(self)))
+        self.options = ["-o", "BatchMode=yes", "-o", "ControlMaster=auto", "-o", "ControlPath=" + self.control,
+                        "-o", "ControlPersist=300"] + (["-P", str(port)] if port else [])
+        self.sftp = sftp
+
+    def _path(self, remote) -> str:
+        return '"' + posixpath.join(self.root, remote.lstrip("/")) + '"'
+
+    def _batch(self, commands) -> str:
+        with tempfile.NamedTemporaryFile("w", suffix=".sftp", delete=False) as f:
+            f.write("\n".join(commands) + "\n")
+        try:
+            p = subprocess.run([self.sftp, "-b", f.name] + self.options + [self.target],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        finally:
+            os.unlink(f.name)
+        if p.returncode:
+            raise IOError("sftp failed: " + p.stderr.strip())
+        return p.stdout
+
+    def size(self, remote) -> Optional[int]:
+        name = posixpath.basename(remote)
+        for line in self._batch(["-ls -ln " + self._path(remote)]).splitlines():
+            fields = line.split()
+            if len(fields) >= 9 and posixpath.basename(fields[-1]) == name and fields[4].isdigit():
+                return int(fields[4])
+        return None
+
+    def upload(self, local, remote, offset=0, chunk_size=CHUNK_SIZE, digest=None) -> bool:
+        # sftp reads the file, the caller hashes it
+        self._batch([("reput " if offset else "put ") + '"' + local + '" ' + self._path(remote)])
+        return False
+
+    def rename(self, src, dest) -> None:
+        self._batch(["-rm " + self._path(dest), "rename " + self._path(src) + " " + self._path(dest)])
+
+    def makedirs(self, path) -> None:
+        parts = path.strip("/").split("/")
+        self._batch(["-mkdir " + self._path("/".join(parts[:i + 1])) for i in range(len(parts))])
+
+    def close(self) -> None:
+        subprocess.run(["ssh", "-O", "exit", "-o", "ControlPath=" + self.control, self.target],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def connector(url, user=None, password=None, dest="/", protocol="sftp"):
+    """Factory for new connections to url; a bare host name uses protocol"""
+
+    if "://" not in url:
+        url = protocol + "://" + url
+    u = urlparse(url)
+    if u.scheme not in PROTOCOLS:
+        raise ValueError("Unsupported protocol " + u.scheme)
+    root = posixpath.join(u.path or "/", dest.lstrip("/")) if u.scheme != "file" else os.path.join(u.path, dest.lstrip("/"))
+
+    def connect() -> Transport:
+        if u.scheme == "file":
+            return LocalTransport(root)
+        if u.scheme == "sftp":
+            return SFTPTransport(u.hostname, port=u.port, user=u.username or user, root=root)
+        return FTPTransport(u.hostname, port=u.port, user=u.username or user, password=u.password or password,
+                            root=root, tls=u.scheme == "ftps")
+    return connect
+
+
+class Upload(object):
+    """One local file, its name on the endpoint and the manifest recording it"""
+
+    __slots__ = ('local', 'remote', 'manifest', 'size', 'mtime')
+
+    def __init__(self, local, remote, manifest):
+        self.local = local
+        self.remote = remote
+        self.manifest = manifest
+        s = os.stat(local)
+        self.size = s.st_size
+        self.mtime = str(int(s.st_mtime))
+
+
+def is_uploaded(upload, entry) -> bool:
+    return entry is not None and entry['size'] == upload.size and entry['mtime'] == upload.mtime
+
+
+def send(transport, upload, chunk_size=CHUNK_SIZE) -> dict:
+    """Upload to <remote>.part, resuming from whatever is there, and rename when complete"""
+
+    part = upload.remote + PART_SUFFIX
+    resumed = 0
+    md5 = None
+    if transport.size(upload.remote) != upload.size:
+        offset = transport.size(part) or 0
+        if offset > upload.size:
+            offset = 0
+        if offset < upload.size or upload.size == 0:
+            # the md5 for the manifest is taken from the bytes as they are sent
+            digest = _md5_prefix(upload.local, offset)
+            if transport.upload(upload.local, part, offset=offset, chunk_size=chunk_size, digest=digest):
+                md5 = digest.hexdigest()
+        resumed = offset
+        have = transport.size(part)
+        if have != upload.size:
+            raise IOError("Incomplete upload of " + upload.remote + ": " + str(have) + "/" + str(upload.size) + " bytes")
+        transport.rename(part, upload.remote)
+    return {
+        'path': upload.remote,
+        'size': upload.size,
+        'mtime': upload.mtime,
+        'md5': md5 or md5sum(upload.local),
+        'method': transport.scheme,
+        'resumed': resumed
+    }
+
+
+def submit(uploads: List[Upload], connect, connections=4, retries=3, retry_wait=5.0, chunk_size=CHUNK_SIZE,
+           dry_run=False) -> dict:
+    """Upload files over parallel connections, skipping those already in their manifest.
+
+    Each worker keeps one connection and reconnects after a failure; a file
+    is retried up to retries times and picks up where the partial upload
+    stopped. Manifests are rewritten after every completed file, so an
+    interrupted batch resumes without sending anything twice.
+    """
+
+    manifests = {}      # type: Dict[str, Dict[str, dict]]
+    stats = {'uploaded': 0, 'skipped': 0, 'resumed': 0, 'bytes': 0, 'failed': [], 'planned': []}
+    todo = queue.Queue()
+    for u in uploads:
+        if u.manifest not in manifests:
+            manifests[u.manifest] = read_manifest(u.manifest)
+        if is_uploaded(u, manifests[u.manifest].get(u.remote)):
+            stats['skipped'] += 1
+        else:
+            stats['planned'].append(u.remote)
+            todo.put(u)
+    if dry_run or todo.empty():
+        return stats
+
+    lock = threading.Lock()
+    start = time.time()
+
+    def worker():
+        transport = None
+        while True:
+            try:
+                u = todo.get_nowait()
+            except queue.Empty:
+                break
+            for attempt in range(retries + 1):
+                try:
+                    if transport is None:
+                        transport = connect()
+                    entry = send(transport, u, chunk_size=chunk_size)
+                except RETRY_ERRORS as e:
+                    logger.warning("Upload of %s failed (attempt %d): %s", u.remote, attempt + 1, e)
+                    if transport is not None:
+                        try:
+                            transport.close()
+                        except RETRY_ERRORS:
+                            pass
+                        transport = None
+                    if attempt < retries:
+                        time.sleep(retry_wait * (attempt + 1))
+                    continue
+                with lock:
+                    resumed = entry.pop('resumed')
+                    manifests[u.manifest][u.remote] = entry
+                    write_manifest(u.manifest, manifests[u.manifest])
+                    stats['uploaded'] += 1
+                    stats['resumed'] += 1 if resumed else 0
+                    stats['bytes'] += u.size - resumed
+                logger.debug("Uploaded %s", u.remote)
+                break
+            else:
+                with lock:
+                    stats['failed'].append(u.remote)
+        if transport is not None:
+            transport.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, connections))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats['seconds'] = round(time.time() - start, 2)
+    return stats
+
+
+class _Keep(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def read_template(path) -> tuple:
+    """Header and optional value row of a RUN/BIOSAMPLE template"""
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        rows = [l.rstrip("\r\n").split("\t") for l in f if l.strip()]
+    if not rows:
+        raise ValueError("Empty template " + path)
+    return rows[0], rows[1] if len(rows) > 1 else []
+
+
+def fill(header, values, record) -> List[str]:
+    """One metadata row: template values with {placeholders} from record, else the record field named like the column"""
+
+    row = []
+    for i, column in enumerate(header):
+        value = values[i] if i < len(values) else ""
+        if value:
+            row.append(value.format_map(_Keep(record)))
+        else:
+            row.append(record.get(column.strip().lower().replace(" ", "_"), ""))
+    return row
+
+
+def write_metadata(path, header, rows) -> bool:
+    """Write a metadata TSV, the file is left alone (and keeps its mtime) if nothing changed"""
+
+    text = "\t".join(header) + "\n" + "".join("\t".join(r) + "\n" for r in rows)
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            if f.read() == text:
+                return False
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
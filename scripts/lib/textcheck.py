@@ -0,0 +1,239 @@
+import codecs
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CHUNK_SIZE = 16 * 1024 * 1024
+BOM = codecs.BOM_UTF8
+ID_COLUMNS = ["sample_id", "sample id"]
+
+ERROR = "error"
+WARNING = "warning"
+
+
+class Issue(object):
+
+    __slots__ = ('level', 'kind', 'line', 'column', 'message')
+
+    def __init__(self, level, kind, line, column, message):
+        self.level = level
+        self.kind = kind
+        self.line = line
+        self.column = column
+        self.message = message
+
+    def __str__(self):
+        where = str(self.line) + (":" + str(self.column) if self.column else "")
+        return "\t".join([self.level.upper(), self.kind, where, self.message])
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def _chunks(f, size):
+    """Raw byte blocks ending on a line boundary"""
+
+    rest = b""
+    while True:
+        block = f.read(size)
+        if not block:
+            if rest:
+                yield rest
+            return
+        block = rest + block
+        end = block.rfind(b"\n")
+        if end < 0:
+            rest = block
+            continue
+        rest = block[end + 1:]
+        yield block[:end + 1]
+
+
+def _field(line, idx) -> bytes:
+    parts = line.split(b"\t", idx + 1)
+    return parts[idx].strip() if idx < len(parts) else b""
+
+
+class Scanner(object):
+    """Scan a tab separated mapping file as raw bytes.
+
+    Blocks that are pure ASCII only get the tab and newline counts; blocks
+    with high bytes get their offsets from one numpy comparison and only the
+    affected lines are decoded. Reports invalid UTF-8, non-ASCII characters,
+    column counts that differ from the header, rows Mapping.load() would skip
+    and duplicate sample IDs.
+    """
+
+    def __init__(self, limit=1000):
+        self.limit = limit
+        self.issues = []        # type: List[Issue]
+        self.counts = {}        # type: Dict[str, int]
+        self.lines = 0
+        self.header = None
+        self.columns = 0
+        self.stripped_columns = 0
+        self.id_column = 0
+        self.ids = {}           # type: Dict[bytes, int]
+        self.crlf = 0
+
+    def add(self, level, kind, line, column, message):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.counts[kind] <= self.limit:
+            self.issues.append(Issue(level, kind, line, column, message))
+
+    @property
+    def errors(self) -> int:
+        return sum(n for k, n in self.counts.items() if k in ("invalid-utf8", "columns", "duplicate-id"))
+
+    def _header(self, line):
+        if line.startswith(BOM):
+            self.add(WARNING, "bom", 1, 1, "UTF-8 byte order mark")
+            line = line[len(BOM):]
+        text = line.rstrip(b"\r\n")
+        self.header = text
+        self.columns = text.count(b"\t") + 1
+        self.stripped_columns = len(text.strip().split(b"\t"))
+        names = [n.strip().lower() for n in text.decode("utf-8", "replace").split("\t")]
+        for n in ID_COLUMNS:
+            if n in names:
+                self.id_column = names.index(n)
+                break
+
+    def scan(self, path, chunk_size=CHUNK_SIZE) -> 'Scanner':
+        with open(path, "rb") as f:
+            first = True
+            for block in _chunks(f, chunk_size):
+                if first:
+                    end = block.find(b"\n") + 1 or len(block)
+                    header = block[:end]
+                    self._header(header)
+                    self._bytes(header[len(BOM):] if header.startswith(BOM) else header, 1)
+                    self.lines = 1
+                    block = block[end:]
+                    first = False
+                if block:
+                    self._block(block)
+        return self
+
+    def _block(self, block):
+        arr = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(arr == 10)
+        if len(ends) == 0 or ends[-1] != len(block) - 1:
+            ends = np.append(ends, len(block))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        first_line = self.lines + 1
+
+        # column counts for every line at once
+        tabs = np.flatnonzero(arr == 9)
+        ntabs = np.searchsorted(tabs, ends) - np.searchsorted(tabs, starts)
+        length = ends - starts
+        blank = (length == 0) | ((length == 1) & (arr[np.minimum(starts, len(arr) - 1)] == 13))
+        self.crlf += int(np.count_nonzero(arr[ends[ends > 0] - 1] == 13)) if len(ends) else 0
+        for i in np.flatnonzero((ntabs + 1 != self.columns) & ~blank):
+            self.add(ERROR, "columns", first_line + int(i), None,
+                     "{} columns, header has {}".format(int(ntabs[i]) + 1, self.columns))
+        for i in np.flatnonzero(blank):
+            self.add(WARNING, "blank", first_line + int(i), None, "empty line")
+
+        if not block.isascii():
+            self._bytes(block, first_line, arr=arr, starts=starts, ends=ends)
+
+        lines = block.split(b"\n")[:len(starts)]
+
+        # only rows starting or ending in whitespace can lose fields to strip() in Mapping.load()
+        cr = (length > 0) & (arr[np.maximum(ends - 1, 0)] == 13)
+        head = arr[np.minimum(starts, len(arr) - 1)]
+        tail = arr[np.maximum(ends - cr - 1, 0)]
+        ragged = ~blank & ((head == 9) | (head == 32) | (tail == 9) | (tail == 32))
+        for i in np.flatnonzero(ragged):
+            if len(lines[i].strip().split(b"\t")) < self.stripped_columns:
+                self.add(WARNING, "short", first_line + int(i), None,
+                         "trailing empty fields, Mapping.load() skips this row")
+
+        # first line per ID, built in C; rows are walked only if something is missing or repeated
+        if self.id_column == 0:
+            ids = [l.split(b"\t", 1)[0].strip() for l in lines]
+        else:
+            ids = [_field(l, self.id_column) for l in lines]
+        first = dict(zip(reversed(ids), reversed(range(first_line, first_line + len(ids)))))
+        empty = first.pop(b"", None)
+        if empty is None and len(first) == len(ids) and self.ids.keys().isdisjoint(first):
+            self.ids.update(first)
+        else:
+            for i, sid in enumerate(ids):
+                n = first_line + i
+                if not sid:
+                    if not blank[i]:
+                        self.add(WARNING, "missing-id", n, None, "no sample ID")
+                elif sid in self.ids:
+                    self.add(ERROR, "duplicate-id", n, None, "sample ID {} already on line {}".format(
+                        sid.decode("utf-8", "replace"), self.ids[sid]))
+                else:
+                    self.ids[sid] = n
+        self.lines += len(starts)
+
+    def _bytes(self, block, first_line, arr=None, starts=None, ends=None):
+        """Invalid UTF-8 and non-ASCII characters with line and column"""
+
+        if block.isascii():
+            return
+        if arr is None:
+            arr = np.frombuffer(block, dtype=np.uint8)
+            ends = np.array([len(block)])
+            starts = np.array([0])
+        high = np.flatnonzero(arr >= 0x80)
+        rows = np.unique(np.searchsorted(ends, high))
+        for r in rows:
+            line = block[starts[r]:ends[r]]
+            n = first_line + int(r)
+            try:
+                text = line.decode("utf-8")
+            except UnicodeDecodeError as e:
+                self.add(ERROR, "invalid-utf8", n, e.start + 1,
+                         "byte 0x{:02x} is not UTF-8, cp1252 reads it as {!r}".format(
+                             line[e.start], line[e.start:e.start + 1].decode("cp1252", "replace")))
+                continue
+            for col, ch in enumerate(text, 1):
+                if ord(ch) > 127:
+                    self.add(WARNING, "non-ascii", n, col, "{!r} U+{:04X} {}".format(
+                        ch, ord(ch), unicodedata.name(ch, "")))
+
+    def summary(self) -> dict:
+        return {'lines': self.lines, 'columns': self.columns, 'ids': len(self.ids), 'crlf': self.crlf,
+                'errors': self.errors, 'counts': dict(self.counts)}
+
+
+def normalize_line(line, ascii=False) -> str:
+    """Bytes of one line as NFC text, cp1252 for anything that is not UTF-8"""
+
+    try:
+        text = line.decode("utf-8")
+    except UnicodeDecodeError:
+        text = line.decode("cp1252", "replace")
+    text = unicodedata.normalize("NFC", text.lstrip("\ufeff").rstrip("\r\n"))
+    if ascii:
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return text
+
+
+def normalize(src, dest, ascii=False, chunk_size=CHUNK_SIZE, columns: Optional[int] = None) -> int:
+    """Stream src to dest as UTF-8 with LF line endings, rows padded or cut to the header width"""
+
+    count = 0
+    with open(src, "rb") as f, open(dest, "w", encoding="utf-8", newline="\n") as out:
+        for block in _chunks(f, chunk_size):
+            for line in block.split(b"\n"):
+                if not line.strip(b"\r"):
+                    continue
+                text = normalize_line(line, ascii=ascii)
+                fields = text.split("\t")
+                if columns is None:
+                    columns = len(fields)
+                elif len(fields) < columns:
+                    fields += [""] * (columns - len(fields))
+                elif len(fields) > columns and not any(fields[columns:]):
+                    fields = fields[:columns]
+                out.write("\t".join(fields) + "\n")
+                count += 1
+    return count
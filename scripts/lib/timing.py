@@ -0,0 +1,193 @@
+import fcntl
+import json
+import os
+import resource
+import socket
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Events go to $COVID_TIMING_LOG, or logs/timing.jsonl in the current (run) directory
+LOG_ENV = "COVID_TIMING_LOG"
+DEFAULT_LOG = os.path.join("logs", "timing.jsonl")
+BLOCK_SIZE = 512    # ru_inblock/ru_oublock are counted in 512 byte blocks
+
+
+def log_file(path=None) -> str:
+    return path or os.environ.get(LOG_ENV) or DEFAULT_LOG
+
+
+def run_name(log) -> str:
+    # <run>/logs/timing.jsonl
+    return os.environ.get("COVID_RUN") or os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(log))))
+
+
+def write_event(event, path=None) -> None:
+    """Append one event as a JSON line.
+
+    Parallel make jobs share the file, so the line is written under an
+    exclusive lock with a single write call.
+    """
+
+    log = log_file(path)
+    d = os.path.dirname(log)
+    if d and not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    line = (json.dumps(event, sort_keys=True) + "\n").encode()
+    fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _event(stage, sample, start, end, usage, status, log) -> dict:
+    return {
+        'run': run_name(log),
+        'stage': stage,
+        'sample': sample,
+        'start': datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+        'end': datetime.fromtimestamp(end).isoformat(timespec='seconds'),
+        'wall': round(end - start, 3),
+        'cpu_user': round(usage['utime'], 3),
+        'cpu_sys': round(usage['stime'], 3),
+        'cpu': round(usage['utime'] + usage['stime'], 3),
+        'max_rss_kb': usage['maxrss'],
+        'read_bytes': usage['inblock'] * BLOCK_SIZE,
+        'write_bytes': usage['oublock'] * BLOCK_SIZE,
+        'status': status,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'freyja_version': os.environ.get("FREYJA_VERSION")
+    }
+
+
+def _usage(who) -> dict:
+    r = resource.getrusage(who)
+    return {'utime': r.ru_utime, 'stime': r.ru_stime, 'maxrss': r.ru_maxrss,
+            'inblock': r.ru_inblock, 'oublock': r.ru_oublock}
+
+
+@contextmanager
+def timed(stage, sample=None, path=None):
+    """Record wall/cpu time, peak RSS and block I/O of a block of Python code.
+
+    Only records if a log is given or $COVID_TIMING_LOG is set, so running a
+    script by hand does not leave logs/ directories behind.
+    """
+
+    if not (path or os.environ.get(LOG_ENV)):
+        yield
+        return
+
+    before = _usage(resource.RUSAGE_SELF)
+    start = time.time()
+    status = 0
+    try:
+        yield
+    except BaseException:
+        status = 1
+        raise
+    finally:
+        end = time.time()
+        after = _usage(resource.RUSAGE_SELF)
+        usage = {k: after[k] - before[k] for k in before}
+        # peak RSS is a high water mark, not a counter
+        usage['maxrss'] = after['maxrss']
+        write_event(_event(stage, sample, start, end, usage, status, log_file(path)), path)
+
+
+def run_command(cmd, stage, sample=None, path=None) -> int:
+    """Run cmd and record its resource usage, including all of its children"""
+
+    start = time.time()
+    p = subprocess.Popen(cmd)
+    while True:
+        try:
+            _, status, r = os.wait4(p.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    end = time.time()
+    p.returncode = os.waitstatus_to_exitcode(status)
+    usage = {'utime': r.ru_utime, 'stime': r.ru_stime, 'maxrss': r.ru_maxrss,
+             'inblock': r.ru_inblock, 'oublock': r.ru_oublock}
+    write_event(_event(stage, sample, start, end, usage, p.returncode, log_file(path)), path)
+    return p.returncode
+
+
+def read_events(files) -> List[dict]:
+    events = []
+    for f in files:
+        with open(f) as fh:
+            for l in fh:
+                l = l.strip()
+                if not l:
+                    continue
+                try:
+                    events.append(json.loads(l))
+                except ValueError:
+                    continue
+    return events
+
+
+def percentile(values, p) -> Optional[float]:
+    """Linear interpolation between closest ranks, p in [0,100]"""
+
+    if not values:
+        return None
+    v = sorted(values)
+    k = (len(v) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(v) - 1)
+    return v[f] + (v[c] - v[f]) * (k - f)
+
+
+METRICS = ['wall', 'cpu', 'max_rss_kb', 'read_bytes', 'write_bytes']
+
+
+def summarize(events) -> Dict[str, dict]:
+    """Per stage counts, totals and p50/p90/max for each metric"""
+
+    stages = {}
+    for e in events:
+        stages.setdefault(e['stage'], []).append(e)
+
+    summary = {}
+    for stage, es in stages.items():
+        s = {'count': len(es), 'failed': sum(1 for e in es if e.get('status')),
+             'versions': sorted(set(str(e.get('freyja_version')) for e in es))}
+        for m in METRICS:
+            values = [e[m] for e in es if e.get(m) is not None]
+            s[m] = {
+                'total': sum(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'max': max(values) if values else None
+            }
+        summary[stage] = s
+    return summary
+
+
+def compare(baseline, current, threshold=0.2, metrics=('wall', 'cpu', 'max_rss_kb')) -> List[dict]:
+    """Flag stages whose p50 or p90 grew by more than threshold (fraction)"""
+
+    regressions = []
+    for stage in sorted(current):
+        if stage not in baseline:
+            continue
+        for m in metrics:
+            for p in ['p50', 'p90']:
+                old = baseline[stage][m][p]
+                new = current[stage][m][p]
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if change > threshold:
+                    regressions.append({'stage': stage, 'metric': m, 'stat': p,
+                                        'baseline': old, 'current': new, 'change': round(change, 3)})
+    return regressions
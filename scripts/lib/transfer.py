@@ -0,0 +1,404 @@
+# Manifest based delta transfers between a run directory and its copy on
+# another host. Only the standard library is used: for a remote endpoint this
+# file is piped to `ssh host python3 -` to build the manifest over there.
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BUFFER_SIZE = 4 * 1024 * 1024
+CACHE_FILE = ".transfer.manifest.tsv"
+CACHE_HEADER = ["path", "size", "mtime", "md5"]
+# compressing these again costs CPU and gains nothing
+COMPRESSED = (".bam", ".gz", ".bz2", ".xz", ".zip", ".cram", ".sif", ".feather", ".pdf", ".png")
+REMOTE_REGEX = re.compile(r"^(?:[^/:@]+@)?[^/:]+:")
+CHMOD_REGEX = re.compile(r"^([ugoa]*)([-+=])([rwxX]*)$")
+WHO_BITS = {'u': 0o700, 'g': 0o070, 'o': 0o007, 'a': 0o777}
+PERM_BITS = {'r': 0o444, 'w': 0o222, 'x': 0o111, 'X': 0o111}
+
+
+def _md5(path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _matches(relpath, includes, excludes) -> bool:
+    name = os.path.basename(relpath)
+    if excludes and any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p) for p in excludes):
+        return False
+    return not includes or any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p) for p in includes)
+
+
+def read_cache(root) -> dict:
+    entries = {}
+    try:
+        with open(os.path.join(root, CACHE_FILE)) as f:
+            f.readline()
+            for l in f:
+                values = l.rstrip("\n").split("\t")
+                if len(values) == len(CACHE_HEADER):
+                    entries[values[0]] = {'size': int(values[1]), 'mtime': int(values[2]), 'md5': values[3]}
+    except (OSError, ValueError):
+        pass
+    return entries
+
+
+def write_cache(root, entries) -> bool:
+    """Rewrite the checksum cache, False if root is not writable for us"""
+
+    path = os.path.join(root, CACHE_FILE)
+    try:
+        with open(path + ".tmp", "w") as f:
+            f.write("\t".join(CACHE_HEADER) + "\n")
+            for p in sorted(entries):
+                e = entries[p]
+                if e.get('md5'):
+                    f.write("\t".join([p, str(e['size']), str(e['mtime']), e['md5']]) + "\n")
+        os.replace(path + ".tmp", path)
+        return True
+    except OSError:
+        return False
+
+
+def build_manifest(root, includes=(), excludes=(), checksum=True, cache=True) -> dict:
+    """Relative path -> size, mtime and md5 for the files below root.
+
+    Checksums are cached in root/.transfer.manifest.tsv under (size, mtime),
+    so only new or changed files are read.
+    """
+
+    cached = read_cache(root) if cache else {}
+    manifest = {}
+    hashed = False
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in files:
+            if name.startswith(CACHE_FILE) or name.endswith(".part"):
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            if not _matches(rel, includes, excludes):
+                continue
+            try:
+                s = os.stat(path)
+            except OSError:
+                continue
+            entry = {'size': s.st_size, 'mtime': int(s.st_mtime), 'md5': None}
+            known = cached.get(rel)
+            if known and known['size'] == entry['size'] and known['mtime'] == entry['mtime']:
+                entry['md5'] = known['md5']
+            elif checksum:
+                entry['md5'] = _md5(path)
+                hashed = True
+            manifest[rel] = entry
+    if cache and hashed:
+        write_cache(root, dict(cached, **manifest))
+    return manifest
+
+
+def is_remote(endpoint) -> bool:
+    return bool(REMOTE_REGEX.match(endpoint)) and not os.path.exists(endpoint)
+
+
+def split_endpoint(endpoint) -> tuple:
+    """host:/path -> (host, path), local paths -> (None, path)"""
+
+    if is_remote(endpoint):
+        host, _, path = endpoint.partition(":")
+        return host, path
+    return None, endpoint
+
+
+def _remote(host, args, ssh="ssh", python="python3"):
+    """Run this file on host by piping it to its python, the JSON it prints"""
+
+    args = [python, "-"] + list(args)
+    with open(os.path.abspath(__file__.replace(".pyc", ".py"))) as source:
+        p = subprocess.run(shlex.split(ssh) + [host, " ".join(shlex.quote(a) for a in args)], stdin=source,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode:
+        raise IOError("Remote " + args[2] + " on " + host + " failed: " + p.stderr.strip())
+    return json.loads(p.stdout)
+
+
+def remote_manifest(host, root, includes=(), excludes=(), checksum=True, ssh="ssh", python="python3") -> dict:
+    """Run build_manifest on host"""
+
+    args = ["manifest", root]
+    args += ["--include"] + list(includes) if includes else []
+    args += ["--exclude"] + list(excludes) if excludes else []
+    args += [] if checksum else ["--no-checksum"]
+    return _remote(host, args, ssh=ssh, python=python)
+
+
+def checksums(root, paths, cache=True) -> dict:
+    """Relative path -> md5 for the given files below root, through the checksum cache"""
+
+    cached = read_cache(root) if cache else {}
+    result = {}
+    hashed = False
+    for rel in paths:
+        path = os.path.join(root, rel)
+        try:
+            s = os.stat(path)
+        except OSError:
+            continue
+        known = cached.get(rel)
+        if known and known['size'] == s.st_size and known['mtime'] == int(s.st_mtime):
+            result[rel] = known['md5']
+            continue
+        result[rel] = _md5(path)
+        cached[rel] = {'size': s.st_size, 'mtime': int(s.st_mtime), 'md5': result[rel]}
+        hashed = True
+    if cache and hashed:
+        write_cache(root, cached)
+    return result
+
+
+def manifest(endpoint, includes=(), excludes=(), checksum=True, ssh="ssh") -> dict:
+    host, root = split_endpoint(endpoint)
+    if host:
+        return remote_manifest(host, root, includes, excludes, checksum=checksum, ssh=ssh)
+    if not os.path.isdir(root):
+        return {}
+    return build_manifest(root, includes, excludes, checksum=checksum)
+
+
+def add_checksums(endpoint, entries, paths, ssh="ssh") -> None:
+    """Fill in the md5 of paths in a manifest built without checksums, hashing on the endpoint's host"""
+
+    if not paths:
+        return
+    host, root = split_endpoint(endpoint)
+    md5s = _remote(host, ["checksum", root] + list(paths), ssh=ssh) if host else checksums(root, paths)
+    for rel, md5 in md5s.items():
+        if rel in entries:
+            entries[rel]['md5'] = md5
+
+
+def target_path(rel, flatten=None) -> str:
+    return os.path.join(flatten, os.path.basename(rel)) if flatten is not None else rel
+
+
+def unsettled(source, dest, flatten=None) -> list:
+    """Source paths whose destination has the same size but another mtime, and no md5 on both sides to compare.
+
+    Files of different size differ and files of equal size and mtime are
+    taken as identical, only these need hashing.
+    """
+
+    result = []
+    for rel in sorted(source):
+        s = source[rel]
+        d = dest.get(target_path(rel, flatten))
+        if d is not None and d['size'] == s['size'] and d['mtime'] != s['mtime'] and not (s['md5'] and d['md5']):
+            result.append(rel)
+    return result
+
+
+def delta(source, dest, flatten=None, checksum=True) -> list:
+    """Source paths that are missing or differ at the destination"""
+
+    changed = []
+    for rel in sorted(source):
+        s = source[rel]
+        d = dest.get(target_path(rel, flatten))
+        if d is None or d['size'] != s['size']:
+            changed.append(rel)
+        elif checksum and s['md5'] and d['md5']:
+            if s['md5'] != d['md5']:
+                changed.append(rel)
+        elif d['mtime'] != s['mtime']:
+            changed.append(rel)
+    return changed
+
+
+def batches(files, sizes, streams) -> list:
+    """Split files into up to streams batches of similar byte size, compressed and compressible kept apart"""
+
+    result = []
+    for compressed in [True, False]:
+        group = [f for f in files if f.lower().endswith(COMPRESSED) == compressed]
+        if not group:
+            continue
+        n = max(1, min(streams, len(group)))
+        bins = [[0, []] for _ in range(n)]
+        for f in sorted(group, key=lambda f: -sizes[f]):
+            b = min(bins, key=lambda b: b[0])
+            b[0] += sizes[f]
+            b[1].append(f)
+        result += [(compressed, b[1]) for b in bins if b[1]]
+    return result
+
+
+def parse_chmod(text) -> list:
+    """g+w,o-rwx -> [(who bits, permission bits, op)], the subset of chmod symbolic modes rsync --chmod takes too"""
+
+    rules = []
+    for part in filter(None, (text or "").split(",")):
+        m = CHMOD_REGEX.match(part)
+        if not m:
+            raise ValueError("Unsupported mode " + part)
+        who = 0
+        for w in m[1] or "a":
+            who |= WHO_BITS[w]
+        perm = 0
+        for p in m[3]:
+            perm |= PERM_BITS[p]
+        rules.append((who, who & perm, m[2]))
+    return rules
+
+
+def apply_mode(mode, rules) -> int:
+    for who, bits, op in rules:
+        if op == "+":
+            mode |= bits
+        elif op == "-":
+            mode &= ~bits
+        else:
+            mode = (mode & ~who) | bits
+    return mode
+
+
+def copy_file(src, dest, rules=(), gid=-1) -> None:
+    """Copy with mtime, mode and group set on the temporary file before it gets its final name"""
+
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    tmp = dest + ".part"
+    shutil.copyfile(src, tmp)
+    s = os.stat(src)
+    os.chmod(tmp, apply_mode(stat.S_IMODE(s.st_mode), rules))
+    if gid >= 0:
+        os.chown(tmp, -1, gid)
+    os.utime(tmp, (s.st_atime, s.st_mtime))
+    os.replace(tmp, dest)
+
+
+def rsync_command(src_root, dest_root, files_from, compress, flatten=None, chmod=None, group=None,
+                  ssh="ssh", rsync="rsync") -> list:
+    """One rsync stream for a batch, permissions applied on the receiving side as files are written"""
+
+    cmd = [rsync, "-t", "--partial", "--files-from=" + files_from, "--rsh=" + ssh]
+    if compress:
+        cmd.append("-z")
+    if flatten is not None:
+        cmd.append("--no-relative")
+        dest_root = os.path.join(dest_root, flatten)
+    if chmod:
+        cmd += ["-p", "--chmod=" + chmod]
+    if group:
+        cmd += ["--chown=:" + group]
+    return cmd + [src_root.rstrip("/") + "/", dest_root.rstrip("/") + "/"]
+
+
+def transfer(src, dest, files, sizes, streams=4, flatten=None, chmod=None, group=None, ssh="ssh",
+             rsync="rsync") -> dict:
+    """Send files (relative to src) to dest over parallel streams"""
+
+    src_host, src_root = split_endpoint(src)
+    dest_host, dest_root = split_endpoint(dest)
+    stats = {'files': 0, 'bytes': 0, 'failed': [], 'streams': 0}
+    work = batches(files, sizes, streams)
+    stats['streams'] = len(work)
+    start = time.time()
+
+    if src_host or dest_host:
+        def run(batch):
+            compressed, names = batch
+            with tempfile.NamedTemporaryFile("w", suffix=".files", delete=False) as f:
+                f.write("\n".join(names) + "\n")
+            try:
+                cmd = rsync_command(src, dest, f.name, not compressed, flatten=flatten, chmod=chmod, group=group,
+                                    ssh=ssh, rsync=rsync)
+                p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            finally:
+                os.unlink(f.name)
+            if p.returncode:
+                raise IOError(p.stderr.strip())
+            return names
+    else:
+        rules = parse_chmod(chmod)
+        gid = -1
+        if group:
+            import grp
+            gid = grp.getgrnam(group).gr_gid
+
+        def run(batch):
+            for name in batch[1]:
+                copy_file(os.path.join(src_root, name), os.path.join(dest_root, target_path(name, flatten)),
+                          rules=rules, gid=gid)
+            return batch[1]
+
+    with ThreadPoolExecutor(max_workers=max(1, len(work))) as pool:
+        jobs = {pool.submit(run, b): b for b in work}
+        for job in as_completed(jobs):
+            try:
+                names = job.result()
+            except (OSError, IOError) as e:
+                stats['failed'] += jobs[job][1]
+                stats.setdefault('errors', []).append(str(e))
+                continue
+            stats['files'] += len(names)
+            stats['bytes'] += sum(sizes[n] for n in names)
+    stats['seconds'] = round(time.time() - start, 2)
+    return stats
+
+
+def record(dest, source, files, flatten=None) -> None:
+    """Add transferred files to a local destination's checksum cache, no need to read them again"""
+
+    host, root = split_endpoint(dest)
+    if host:
+        return
+    entries = read_cache(root)
+    for rel in files:
+        path = target_path(rel, flatten)
+        try:
+            s = os.stat(os.path.join(root, path))
+        except OSError:
+            continue
+        if s.st_size == source[rel]['size'] and source[rel]['md5']:
+            entries[path] = {'size': s.st_size, 'mtime': int(s.st_mtime), 'md5': source[rel]['md5']}
+    write_cache(root, entries)
+
+
+def _remote_main(argv) -> int:
+    """python3 - manifest ROOT [--include P ...] [--exclude P ...] [--no-checksum] | checksum ROOT PATH ..., run over ssh"""
+
+    if len(argv) < 2 or argv[0] not in ("manifest", "checksum"):
+        sys.stderr.write(_remote_main.__doc__ + "\n")
+        return 2
+    root = argv[1]
+    if argv[0] == "checksum":
+        json.dump(checksums(root, argv[2:]) if os.path.isdir(root) else {}, sys.stdout)
+        return 0
+    opts = {'--include': [], '--exclude': []}
+    checksum = True
+    current = None
+    for a in argv[2:]:
+        if a == "--no-checksum":
+            checksum = False
+        elif a in opts:
+            current = opts[a]
+        elif current is not None:
+            current.append(a)
+    result = build_manifest(root, opts['--include'], opts['--exclude'], checksum=checksum) if os.path.isdir(root) else {}
+    json.dump(result, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_remote_main(sys.argv[1:]))
@@ -0,0 +1,454 @@
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from lib import bundle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = "/local/incoming/covid/warehouse/results.sqlite"
+
+SUMMARY_COLUMNS = ['summarized', 'lineages', 'abundances', 'resid', 'coverage']
+AGGREGATE_HEADER = ["", "summarized", "lineages", "abundances", "resid", "coverage"]
+
+# same ID rule as update-sample-mapping.py: <run prefix>.<sample id>_S<n>...
+SAMPLE_ID_REGEX = re.compile(r"^[^-_\.]+\.([^_\.]+).*")
+TAG_REGEX = re.compile(r'^(summarized|lineages|abundances|resid|coverage)\s+(.*)$')
+SUMMARIZED_REGEX = re.compile(r'\(\'([^\']+)\',\s*([\d\.e-]+)\)')
+LINEAGE_REGEX = re.compile(r'([\w\.\d]+)')
+ABUNDANCE_REGEX = re.compile(r'([\d\.e-]+)')
+DATE_REGEX = re.compile(r"^(\d+)/(\d+)/(\d+)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    path TEXT,
+    fingerprint TEXT,
+    mapping_header TEXT,
+    ingested TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run TEXT NOT NULL,
+    sample_id TEXT NOT NULL,
+    site_id TEXT,
+    collect_date TEXT,
+    wwtp_name TEXT,
+    row TEXT,
+    PRIMARY KEY (run, sample_id)
+);
+CREATE TABLE IF NOT EXISTS demix (
+    run TEXT NOT NULL,
+    file TEXT NOT NULL,
+    sample_id TEXT,
+    summarized TEXT,
+    resid REAL,
+    resid_text TEXT,
+    coverage REAL,
+    coverage_text TEXT,
+    PRIMARY KEY (run, file)
+);
+CREATE TABLE IF NOT EXISTS abundances (
+    run TEXT NOT NULL,
+    file TEXT NOT NULL,
+    sample_id TEXT,
+    position INTEGER,
+    lineage TEXT,
+    abundance REAL,
+    abundance_text TEXT
+);
+CREATE TABLE IF NOT EXISTS clades (
+    run TEXT NOT NULL,
+    file TEXT NOT NULL,
+    sample_id TEXT,
+    clade TEXT,
+    abundance REAL,
+    abundance_text TEXT
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    run TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    sample_id TEXT,
+    coverage REAL,
+    coverage_text TEXT,
+    detail TEXT,
+    PRIMARY KEY (run, sample)
+);
+CREATE TABLE IF NOT EXISTS provenance (
+    run TEXT NOT NULL,
+    file TEXT NOT NULL,
+    sample_id TEXT,
+    key TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_sample_id ON samples (sample_id);
+CREATE INDEX IF NOT EXISTS samples_site_id ON samples (site_id);
+CREATE INDEX IF NOT EXISTS samples_collect_date ON samples (collect_date);
+CREATE INDEX IF NOT EXISTS demix_sample_id ON demix (sample_id);
+CREATE INDEX IF NOT EXISTS abundances_lineage ON abundances (lineage);
+CREATE INDEX IF NOT EXISTS abundances_sample_id ON abundances (sample_id);
+CREATE INDEX IF NOT EXISTS abundances_file ON abundances (run, file);
+CREATE INDEX IF NOT EXISTS clades_file ON clades (run, file);
+CREATE INDEX IF NOT EXISTS coverage_sample_id ON coverage (sample_id);
+CREATE INDEX IF NOT EXISTS provenance_file ON provenance (run, file);
+"""
+
+RUN_TABLES = ["samples", "demix", "abundances", "clades", "coverage", "provenance"]
+
+
+def connect(path=DEFAULT_DB) -> sqlite3.Connection:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def sample_id(name) -> Optional[str]:
+    res = SAMPLE_ID_REGEX.match(os.path.basename(name))
+    return res[1] if res else None
+
+
+def iso_date(d) -> Optional[str]:
+    """M/D/YY or M/D/YYYY from the mapping file as YYYY-MM-DD"""
+
+    res = DATE_REGEX.match(d or "")
+    if res is None:
+        return None
+    year = int(res[3]) + (2000 if len(res[3]) == 2 else 0)
+    try:
+        return datetime(year, int(res[1]), int(res[2])).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def parse_demix(path) -> dict:
+    """Freyja demix output, wrapped list continuation lines joined to their tag"""
+
+    fields = {}
+    tag = None
+    with bundle.open_file(path) as f:
+        f.readline()
+        for l in f:
+            m = TAG_REGEX.match(l)
+            if m:
+                tag = m[1]
+                fields[tag] = m[2].strip()
+            elif tag:
+                fields[tag] += " " + l.strip()
+
+    def number(v):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return None
+
+    summarized = fields.get('summarized', '').strip('"')
+    return {
+        'summarized': summarized,
+        'clades': SUMMARIZED_REGEX.findall(summarized),
+        'lineages': LINEAGE_REGEX.findall(fields.get('lineages', '')),
+        'abundances': ABUNDANCE_REGEX.findall(fields.get('abundances', '')),
+        'resid': fields.get('resid', ''),
+        'resid_value': number(fields.get('resid')),
+        'coverage': fields.get('coverage', ''),
+        'coverage_value': number(fields.get('coverage'))
+    }
+
+
+def parse_version(path) -> List[tuple]:
+    """key=value lines from .version, a bare version string from .freyja_version"""
+
+    pairs = []
+    with bundle.open_file(path, errors='replace') as f:
+        for l in f:
+            l = l.strip()
+            if not l:
+                continue
+            if "=" in l:
+                k, v = l.split("=", 1)
+                pairs.append((k.strip(), v.strip()))
+            else:
+                pairs.append(("freyja_version", l))
+    return pairs
+
+
+def read_mapping(path):
+    """Header and rows of a sample mapping file, keyed by sample_id"""
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        # header and row as update-sample-mapping.py splits them, trailing empty columns dropped
+        header = f.readline().strip().split("\t")
+        lower = [h.strip().lower() for h in header]
+
+        def column(*names):
+            for n in names:
+                if n in lower:
+                    return lower.index(n)
+            return None
+
+        id_col = column("sample_id", "sample id")
+        site_col = column("site_id", "siteid")
+        date_col = column("sample_collect_date", "date")
+        wwtp_col = column("wwtp_name")
+        id_col = 0 if id_col is None else id_col
+
+        rows = []
+        skipped = 0
+        for l in f:
+            values = l.rstrip("\n").split("\t")
+            # blank and short rows are skipped, as Mapping.load() does
+            if len(values) < len(header) or len(values) <= id_col or not values[id_col].strip():
+                if l.strip():
+                    skipped += 1
+                continue
+
+            def get(i):
+                return values[i].strip() if i is not None and i < len(values) else None
+
+            rows.append((get(id_col), get(site_col), iso_date(get(date_col)), get(wwtp_col),
+                         json.dumps(l.strip().split("\t"))))
+    if skipped:
+        logger.warning("%s: %d rows with fewer columns than the header or without sample ID skipped", path, skipped)
+    return header, rows
+
+
+def fingerprint(run_dir) -> str:
+    """Count and newest mtime of the files ingest reads, to skip unchanged runs"""
+
+    count = 0
+    newest = 0
+    for pattern in ["*.sample-mapping.tsv", "coverage.all.txt", "output/*", "provenance/ledger.jsonl", bundle.BUNDLE]:
+        for p in glob.glob(os.path.join(run_dir, pattern)):
+            count += 1
+            newest = max(newest, os.stat(p).st_mtime_ns)
+    return "{}:{}".format(count, newest)
+
+
+def ingest_run(conn, run_dir, force=False) -> Optional[dict]:
+    """Replace everything stored for one run in a single transaction, None if unchanged"""
+
+    run = os.path.basename(os.path.normpath(run_dir))
+    fp = fingerprint(run_dir)
+    row = conn.execute("SELECT fingerprint FROM runs WHERE run = ?", (run,)).fetchone()
+    if row and row[0] == fp and not force:
+        return None
+
+    counts = {t: 0 for t in RUN_TABLES}
+    with conn:
+        for t in RUN_TABLES:
+            conn.execute("DELETE FROM " + t + " WHERE run = ?", (run,))
+
+        header = None
+        for mapping_file in sorted(glob.glob(os.path.join(run_dir, "*.sample-mapping.tsv"))):
+            header, rows = read_mapping(mapping_file)
+            conn.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                             [(run,) + r for r in rows])
+            counts['samples'] += len(rows)
+
+        output_dir = os.path.join(run_dir, "output")
+        # loose files and members of the run's results bundle
+        names = bundle.listdir(output_dir)
+        loaded = set()
+        for name in names:
+            path = os.path.join(output_dir, name)
+            if name.endswith(".out"):
+                sid = sample_id(name)
+                d = parse_demix(path)
+                conn.execute("INSERT OR REPLACE INTO demix VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (run, name, sid, d['summarized'], d['resid_value'], d['resid'],
+                              d['coverage_value'], d['coverage']))
+                conn.executemany("INSERT INTO abundances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [(run, name, sid, i, l, float(a), a)
+                                  for i, (l, a) in enumerate(zip(d['lineages'], d['abundances']))])
+                conn.executemany("INSERT INTO clades VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(run, name, sid, c, float(a), a) for c, a in d['clades']])
+                counts['demix'] += 1
+                counts['abundances'] += len(d['lineages'])
+                counts['clades'] += len(d['clades'])
+            elif name.endswith(".version") or name.endswith(".freyja_version"):
+                pairs = parse_version(path)
+                conn.executemany("INSERT INTO provenance VALUES (?, ?, ?, ?, ?)",
+                                 [(run, name, sample_id(name), k, v) for k, v in pairs])
+                counts['provenance'] += len(pairs)
+                loaded.add(os.path.join("output", name))
+
+        # run provenance ledger, minus records imported from files loaded above
+        ledger = os.path.join(run_dir, "provenance", "ledger.jsonl")
+        if os.path.isfile(ledger):
+            with open(ledger, errors='replace') as f:
+                for l in f:
+                    try:
+                        r = json.loads(l)
+                    except ValueError:
+                        continue
+                    if not isinstance(r, dict) or r.get('source') in loaded:
+                        continue
+                    sid = r.get('sample_id') or sample_id(r.get('sample') or "")
+                    pairs = [(k, str(v)) for k, v in r.items() if k not in ('sample', 'sample_id') and v is not None]
+                    conn.executemany("INSERT INTO provenance VALUES (?, ?, ?, ?, ?)",
+                                     [(run, "provenance/ledger.jsonl", sid, k, v) for k, v in pairs])
+                    counts['provenance'] += len(pairs)
+
+        coverage_file = os.path.join(run_dir, "coverage.all.txt")
+        if os.path.isfile(coverage_file):
+            with open(coverage_file) as f:
+                for l in f:
+                    fields = l.rstrip("\n").split("\t")
+                    if len(fields) < 2:
+                        continue
+                    try:
+                        value = float(fields[1])
+                    except ValueError:
+                        value = None
+                    conn.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                                 (run, fields[0], sample_id(fields[0]), value, fields[1],
+                                  fields[2] if len(fields) > 2 else None))
+                    counts['coverage'] += 1
+
+        conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)",
+                     (run, os.path.abspath(run_dir), fp, json.dumps(header) if header else None,
+                      datetime.now().isoformat(timespec='seconds')))
+    return counts
+
+
+def _where(run=None, sites=None, samples=None, lineage=None, since=None, until=None, alias="s"):
+    clauses = []
+    params = []
+    if run:
+        clauses.append(alias + ".run = ?")
+        params.append(run)
+    if sites:
+        clauses.append(alias + ".site_id IN (" + ",".join("?" * len(sites)) + ")")
+        params += list(sites)
+    if samples:
+        clauses.append(alias + ".sample_id IN (" + ",".join("?" * len(samples)) + ")")
+        params += list(samples)
+    if since:
+        clauses.append(alias + ".collect_date >= ?")
+        params.append(since)
+    if until:
+        clauses.append(alias + ".collect_date <= ?")
+        params.append(until)
+    if lineage:
+        clauses.append("EXISTS (SELECT 1 FROM abundances a WHERE a.sample_id = " + alias +
+                       ".sample_id AND (a.lineage = ? OR a.lineage LIKE ?))")
+        params += [lineage, lineage + ".%"]
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+# per sample: coverage of the sample's own run, else of its newest run, and the newest demix output
+EXPORT_QUERY = """
+WITH cov AS (
+    SELECT sample_id, run, coverage_text,
+           ROW_NUMBER() OVER (PARTITION BY sample_id, run ORDER BY rowid) AS in_run,
+           ROW_NUMBER() OVER (PARTITION BY sample_id ORDER BY run DESC, rowid) AS newest
+    FROM coverage WHERE sample_id IS NOT NULL),
+latest AS (
+    SELECT sample_id, run, file, resid_text, coverage_text,
+           ROW_NUMBER() OVER (PARTITION BY sample_id ORDER BY file DESC) AS newest
+    FROM demix WHERE sample_id IS NOT NULL)
+SELECT s.run, s.sample_id, s.site_id, s.collect_date, s.wwtp_name, s.row,
+       COALESCE(c1.coverage_text, c2.coverage_text), l.run, l.file, l.resid_text, l.coverage_text
+FROM samples s
+LEFT JOIN cov c1 ON c1.sample_id = s.sample_id AND c1.run = s.run AND c1.in_run = 1
+LEFT JOIN cov c2 ON c2.sample_id = s.sample_id AND c2.newest = 1
+LEFT JOIN latest l ON l.sample_id = s.sample_id AND l.newest = 1
+"""
+
+
+def _demix_records(conn, where, params) -> dict:
+    """(run, file) -> summarized clades, lineages and abundances of the newest demix output of every sample matching where"""
+
+    latest = ("SELECT run, file FROM (SELECT run, file, ROW_NUMBER() OVER (PARTITION BY sample_id ORDER BY file DESC) "
+              "AS newest FROM demix WHERE sample_id IN (SELECT s.sample_id FROM samples s" + where + ")) "
+              "WHERE newest = 1")
+    records = {}
+    for run, file in conn.execute(latest, params):
+        records[(run, file)] = {'summarized': {}, 'lineages': [], 'abundances': [], 'resid': '', 'coverage': ''}
+    for run, file, clade, text in conn.execute("SELECT c.run, c.file, c.clade, c.abundance_text FROM clades c "
+                                               "JOIN (" + latest + ") l ON l.run = c.run AND l.file = c.file "
+                                               "ORDER BY c.rowid", params):
+        records[(run, file)]['summarized'][clade] = text
+    for run, file, lineage, text in conn.execute("SELECT a.run, a.file, a.lineage, a.abundance_text FROM abundances a "
+                                                 "JOIN (" + latest + ") l ON l.run = a.run AND l.file = a.file "
+                                                 "ORDER BY a.run, a.file, a.position", params):
+        records[(run, file)]['lineages'].append(lineage)
+        records[(run, file)]['abundances'].append(text)
+    return records
+
+
+def export_mapping(conn, stream=None, **filters) -> int:
+    """Mapping rows plus coverage and demix columns, as update-sample-mapping.py prints them"""
+
+    stream = stream or sys.stdout
+    header = None
+    if filters.get('run'):
+        row = conn.execute("SELECT mapping_header FROM runs WHERE run = ?", (filters['run'],)).fetchone()
+        header = json.loads(row[0]) if row and row[0] else None
+
+    # one joined query for the rows and two for the lineage lists instead of several queries per row
+    where, params = _where(**filters)
+    rows = conn.execute(EXPORT_QUERY + where + " ORDER BY s.run, s.rowid", params).fetchall()
+    demix = _demix_records(conn, where, params)
+
+    stream.write("\t".join((header or ["sample_id", "site_id", "sample_collect_date", "wwtp_name"]) +
+                           ["coverage"] + SUMMARY_COLUMNS) + "\n")
+    for run, sid, site, date, wwtp, values, cov, demix_run, demix_file, resid, coverage in rows:
+        fields = json.loads(values) if header else [sid, site or "", date or "", wwtp or ""]
+        fields.append(cov if cov is not None else "not found")
+        if demix_file is not None:
+            d = dict(demix[(demix_run, demix_file)], resid=resid, coverage=coverage)
+            fields += [d[h] for h in SUMMARY_COLUMNS]
+        else:
+            fields += ["N/A"] * len(SUMMARY_COLUMNS)
+        stream.write("\t".join(map(str, fields)) + "\n")
+    return len(rows)
+
+
+def export_aggregate(conn, stream=None, **filters) -> int:
+    """One line per demix output, as freyja aggregate followed by sortAggregate.py"""
+
+    stream = stream or sys.stdout
+    where, params = _where(**filters)
+    if where:
+        selected = "SELECT DISTINCT d.run, d.file FROM demix d JOIN samples s ON s.sample_id = d.sample_id" + where
+    else:
+        selected = "SELECT run, file FROM demix"
+
+    # the rows and the lineage lists of all of them in two queries instead of one per row
+    rows = conn.execute("SELECT d.run, d.file, d.summarized, d.resid_text, d.coverage_text FROM demix d "
+                        "JOIN (" + selected + ") k ON k.run = d.run AND k.file = d.file ORDER BY d.file", params).fetchall()
+    lists = {}
+    for run, file, lineage, text in conn.execute("SELECT a.run, a.file, a.lineage, a.abundance_text FROM abundances a "
+                                                 "JOIN (" + selected + ") k ON k.run = a.run AND k.file = a.file "
+                                                 "ORDER BY a.run, a.file, a.position", params):
+        lineages, abundances = lists.setdefault((run, file), ([], []))
+        lineages.append(lineage)
+        abundances.append(text)
+
+    stream.write("\t".join(AGGREGATE_HEADER) + "\n")
+    for run, file, summarized, resid, coverage in rows:
+        lineages, abundances = lists.get((run, file), ([], []))
+        stream.write("\t".join([file, summarized, " ".join(lineages), " ".join(abundances),
+                                resid or "", coverage or ""]) + "\n")
+    return len(rows)
+
+
+def query(conn, sql, params: Iterable = (), stream=None) -> int:
+    stream = stream or sys.stdout
+    cursor = conn.execute(sql, tuple(params))
+    if cursor.description:
+        stream.write("\t".join(c[0] for c in cursor.description) + "\n")
+    count = 0
+    for row in cursor:
+        stream.write("\t".join("" if v is None else str(v) for v in row) + "\n")
+        count += 1
+    return count
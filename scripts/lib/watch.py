@@ -0,0 +1,197 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import logging
+import os
+import select
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIMERS = ["qiagen", "swift", "midnight"]
+
+
+class Inotify(object):
+    """Minimal inotify binding, used only as a wake-up signal for the scan loop.
+
+    inotify does not see changes made by other NFS clients, so the caller
+    still rescans on a timeout; events just make local drops show up sooner.
+    """
+
+    MASK = 0x00000100 | 0x00000080 | 0x00000008 | 0x00000004   # IN_CREATE, IN_MOVED_TO, IN_CLOSE_WRITE, IN_ATTRIB
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def watch(self, path) -> None:
+        if path in self.watches:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            logger.debug("Can not watch %s: errno %d", path, ctypes.get_errno())
+            return
+        self.watches[path] = wd
+
+    def unwatch(self, path) -> None:
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout) -> bool:
+        """Block up to timeout seconds, True if anything changed"""
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def snapshot(run_dir) -> tuple:
+    """Sorted (relative path, size, mtime) of all fastqs below run_dir"""
+
+    files = []
+    for root, dirs, names in os.walk(run_dir):
+        for name in names:
+            if name.endswith(".fastq.gz"):
+                path = os.path.join(root, name)
+                try:
+                    s = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((os.path.relpath(path, run_dir), s.st_size, s.st_mtime))
+    return tuple(sorted(files))
+
+
+class RunTracker(object):
+    """Decides when a run in the drop directory is complete.
+
+    A run is complete once its sentinel file exists and the fastqs and the
+    sentinel have not changed for `settle` seconds. The time since the last
+    change is taken from the file mtimes, so a run that finished before the
+    watcher started is complete the first time it is seen.
+    """
+
+    def __init__(self, sentinel="CopyComplete.txt", settle=300):
+        self.sentinel = sentinel
+        self.settle = settle
+        self.seen = {}      # run_dir -> (snapshot, time unchanged since)
+
+    def complete(self, run_dir, now=None) -> bool:
+        now = now or time.time()
+        sentinels = glob.glob(os.path.join(run_dir, self.sentinel)) if self.sentinel else []
+        if self.sentinel and not sentinels:
+            return False
+
+        snap = snapshot(run_dir)
+        if not snap:
+            return False
+
+        if self.settle <= 0:
+            return True
+        previous = self.seen.get(run_dir)
+        if previous is None or previous[0] != snap:
+            mtimes = [mtime for path, size, mtime in snap]
+            for path in sentinels:
+                try:
+                    mtimes.append(os.stat(path).st_mtime)
+                except FileNotFoundError:
+                    continue
+            previous = (snap, min(now, max(mtimes)))
+            self.seen[run_dir] = previous
+        return now - previous[1] >= self.settle
+
+    def pending(self) -> bool:
+        """True while a run with its sentinel is still waiting to settle"""
+
+        return bool(self.seen)
+
+    def forget(self, run_dir) -> None:
+        self.seen.pop(run_dir, None)
+
+
+def read_primer_config(config_file) -> list:
+    """Run name glob and primer per line, tab separated, first match wins"""
+
+    rules = []
+    if config_file and os.path.isfile(config_file):
+        with open(config_file) as f:
+            for l in f:
+                l = l.strip()
+                if not l or l.startswith("#"):
+                    continue
+                columns = l.split("\t")
+                if len(columns) >= 2:
+                    rules.append((columns[0], columns[1].strip().lower()))
+    return rules
+
+
+def primer_from_mapping(run_dir) -> Optional[str]:
+    """Primer from a 'primer' column in the run's sample mapping, if it has one"""
+
+    for root, dirs, names in os.walk(run_dir):
+        for name in names:
+            if not name.endswith(".sample-mapping.tsv"):
+                continue
+            with open(os.path.join(root, name), encoding='utf-8', errors='replace') as f:
+                header = [h.strip().lower() for h in f.readline().split("\t")]
+                if "primer" not in header:
+                    continue
+                idx = header.index("primer")
+                for l in f:
+                    values = l.rstrip("\n").split("\t")
+                    if len(values) > idx and values[idx].strip():
+                        return values[idx].strip().lower()
+    return None
+
+
+def primer_for(run_dir, rules, default=None) -> Optional[str]:
+    primer = primer_from_mapping(run_dir)
+    if not primer:
+        name = os.path.basename(run_dir.rstrip("/"))
+        for pattern, p in rules:
+            if fnmatch.fnmatch(name, pattern):
+                primer = p
+                break
+    primer = primer or default
+    if primer and primer not in PRIMERS:
+        logger.error("Unknown primer %s for %s", primer, run_dir)
+        return None
+    return primer
+
+
+def read_state(state_file) -> Dict[str, dict]:
+    """Runs already queued or processed: run dir -> status, start, end, exit code"""
+
+    state = {}
+    if state_file and os.path.isfile(state_file):
+        with open(state_file) as f:
+            for l in f:
+                columns = l.rstrip("\n").split("\t")
+                if len(columns) == 5 and columns[0] != "run_dir":
+                    state[columns[0]] = {'status': columns[1], 'start': columns[2],
+                                         'end': columns[3], 'exit': columns[4]}
+    return state
+
+
+def write_state(state_file, state) -> None:
+    tmp = state_file + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("\t".join(["run_dir", "status", "start", "end", "exit"]) + "\n")
+        for run_dir in sorted(state):
+            s = state[run_dir]
+            f.write("\t".join([run_dir, s['status'], s['start'], s['end'], s['exit']]) + "\n")
+    os.replace(tmp, state_file)
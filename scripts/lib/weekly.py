@@ -0,0 +1,142 @@
+import json
+import os
+import zlib
+from datetime import date, datetime
+from typing import Dict, Iterable, List
+
+import numpy as np
+import scipy.sparse as sp
+
+from lib import bundle
+from lib.prevalence import EPOCH, iso
+from lib.warehouse import parse_demix
+
+# <tiles>/<group>.json per label dimension, index.json, and the parsed demix
+# outputs in tiles.cache.json so an update only parses new or changed files
+CACHE = "tiles.cache.json"
+INDEX = "index.json"
+CACHE_VERSION = 1
+TIDY_HEADER = ["group", "label", "week", "samples", "lineage", "abundance"]
+
+
+def week_start(days) -> np.ndarray:
+    """Day number of the Monday of each day's week"""
+
+    days = np.asarray(days, dtype=np.int64)
+    # weekday of day 0, 2000-01-01, is a Saturday (5)
+    return days - (days + date.fromordinal(EPOCH).weekday()) % 7
+
+
+class TileCache(object):
+    """Lineages and abundances of every demix output the tiles were built from, by path"""
+
+    def __init__(self, tiles_dir):
+        self.path = os.path.join(tiles_dir, CACHE)
+        self.samples = {}
+        self.tiles = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.samples = data['samples']
+                self.tiles = data['tiles']
+        except (OSError, ValueError):
+            pass
+
+    def refresh(self, files: Iterable[str]) -> dict:
+        """Parse files that are new or changed since the last update, forget files that are gone"""
+
+        stats = {'parsed': 0, 'unchanged': 0, 'dropped': 0}
+        seen = set()
+        for path in files:
+            seen.add(path)
+            s = bundle.stat(path)
+            known = self.samples.get(path)
+            if known and known[0] == s.st_size and known[1] == s.st_mtime_ns:
+                stats['unchanged'] += 1
+                continue
+            d = parse_demix(path)
+            self.samples[path] = [s.st_size, s.st_mtime_ns, d['lineages'], d['abundances']]
+            stats['parsed'] += 1
+        for path in set(self.samples) - seen:
+            del self.samples[path]
+            stats['dropped'] += 1
+        return stats
+
+    def demix(self, paths) -> List[dict]:
+        return [{'lineages': self.samples[p][2], 'abundances': self.samples[p][3]} for p in paths]
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({'version': CACHE_VERSION, 'samples': self.samples, 'tiles': self.tiles}, f)
+        os.replace(tmp, self.path)
+
+
+def weekly_means(unit, sample, weeks, abundances) -> dict:
+    """Mean abundance per unit (label) and week, one sparse multiply for all labels of a group"""
+
+    first = int(weeks.min()) if len(weeks) else 0
+    span = (int(weeks.max()) - first if len(weeks) else 0) + 1
+    keys, inverse = np.unique(unit * span + weeks[sample] - first, return_inverse=True)
+    indicator = sp.csr_matrix((np.ones(len(sample)), (inverse, sample)), shape=(len(keys), abundances.shape[0]))
+    counts = np.bincount(inverse, minlength=len(keys))
+    means = sp.csr_matrix(sp.diags(1.0 / counts) @ (indicator @ abundances))
+    return {'unit': keys // span, 'week': keys % span + first, 'samples': counts, 'abundance': means}
+
+
+def tile(group, labels, columns, result, digits=5) -> dict:
+    """Nested JSON tile of one label dimension: label -> weeks, samples and lineage abundances per week"""
+
+    data = {}
+    a = result['abundance']
+    for i in range(len(result['unit'])):
+        entry = data.setdefault(labels[result['unit'][i]], {'weeks': [], 'samples': [], 'abundance': []})
+        row = a.indices[a.indptr[i]:a.indptr[i + 1]]
+        values = a.data[a.indptr[i]:a.indptr[i + 1]]
+        entry['weeks'].append(iso(result['week'][i]))
+        entry['samples'].append(int(result['samples'][i]))
+        entry['abundance'].append({columns[j]: round(float(v), digits) for j, v in zip(row, values) if v > 0})
+    return {'group': group, 'labels': data}
+
+
+def tidy_rows(group, labels, columns, result) -> Iterable[tuple]:
+    a = sp.coo_matrix(result['abundance'])
+    for i, j, v in zip(a.row, a.col, a.data):
+        if v > 0:
+            yield (group, labels[result['unit'][i]], iso(result['week'][i]), int(result['samples'][i]), columns[j], float(v))
+
+
+def write_tile(tiles_dir, name, data, known: Dict[str, int]) -> bool:
+    """Write a tile only if its content changed, known maps tile names to content crc32"""
+
+    text = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+    crc = zlib.crc32(text)
+    path = os.path.join(tiles_dir, name)
+    if known.get(name) == crc and os.path.isfile(path):
+        return False
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    known[name] = crc
+    return True
+
+
+def write_parquet(path, rows: Iterable[tuple]) -> int:
+    """Tidy table as Parquet, needs pyarrow"""
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = list(zip(*rows)) or [[] for _ in TIDY_HEADER]
+    table = pa.table({h: list(c) for h, c in zip(TIDY_HEADER, columns)})
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+    return table.num_rows
+
+
+def index(groups: Dict[str, dict], samples) -> dict:
+    return {'updated': datetime.now().astimezone().isoformat(timespec='seconds'), 'samples': samples,
+            'groups': groups}
@@ -0,0 +1,294 @@
+import fcntl
+import glob
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from lib.qcgate import SKIPPED_DIR
+
+# <run>/queue/{pending,claimed,done,failed}/<sample>.job, one JSON job per file.
+# A job moves between the directories by rename only, which is atomic on one
+# NFS export: of several workers renaming the same pending file exactly one
+# succeeds. A claimed file carries its owner in the name and its mtime is the
+# heartbeat.
+QUEUE_DIR = "queue"
+STATES = ["pending", "claimed", "done", "failed"]
+EVENTS = "events.jsonl"
+CLOCK = ".clock"
+SUFFIX = ".job"
+DEFAULT_COMMAND = "make -B variants/{sample}.variants.tsv"
+HEARTBEAT = 30      # seconds between heartbeats of a running job
+STALE = 300         # seconds without heartbeat before a claimed job is requeued
+MAX_ATTEMPTS = 3
+
+
+class LostClaim(Exception):
+    """The claimed job was requeued by another worker"""
+
+
+def queue_dir(run_dir) -> str:
+    return os.path.join(run_dir, QUEUE_DIR)
+
+
+def _path(run_dir, state, name="") -> str:
+    return os.path.join(run_dir, QUEUE_DIR, state, name)
+
+
+def _now() -> str:
+    return datetime.now().astimezone().isoformat(timespec='seconds')
+
+
+def _write_json(path, data) -> None:
+    tmp = "{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _read_json(path) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def sample_name(name) -> str:
+    """Sample of a job file name, claimed files have the owner appended"""
+
+    return name[:name.index(SUFFIX)]
+
+
+def log_event(run_dir, event, job, **fields) -> None:
+    """Append a queue event as a JSON line under an exclusive lock, like timing.write_event"""
+
+    record = dict(fields, time=_now(), event=event, sample=job['sample'], attempt=job.get('attempt', 0),
+                  host=socket.gethostname(), pid=os.getpid())
+    fd = os.open(os.path.join(queue_dir(run_dir), EVENTS), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, (json.dumps(record, sort_keys=True) + "\n").encode())
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def read_events(run_dir) -> List[dict]:
+    events = []
+    try:
+        with open(os.path.join(queue_dir(run_dir), EVENTS)) as f:
+            for l in f:
+                try:
+                    events.append(json.loads(l))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return events
+
+
+def server_time(run_dir) -> float:
+    """Current time of the file server, hosts' clocks may disagree but the server stamps all heartbeats"""
+
+    if not os.path.isdir(queue_dir(run_dir)):
+        return time.time()
+    clock = os.path.join(queue_dir(run_dir), CLOCK)
+    with open(clock, "a"):
+        os.utime(clock)
+    return os.stat(clock).st_mtime
+
+
+def pending_samples(run_dir, all_samples=False) -> List[str]:
+    """Samples with a bam and, unless all_samples, without a demix output or QC gate placeholder"""
+
+    samples = sorted(os.path.basename(b)[:-len(".sorted.bam")] for b in glob.glob(os.path.join(run_dir, "bam", "*.sorted.bam")))
+    if all_samples:
+        return samples
+    return [s for s in samples if not os.path.isfile(os.path.join(run_dir, "output", s + ".out"))
+            and not os.path.isfile(os.path.join(run_dir, SKIPPED_DIR, s + ".out"))]
+
+
+def jobs(run_dir, state) -> List[str]:
+    """Job file names in one state directory"""
+
+    try:
+        return sorted(n for n in os.listdir(_path(run_dir, state)) if SUFFIX in n and not n.endswith(".tmp"))
+    except FileNotFoundError:
+        return []
+
+
+def enqueue(run_dir, samples, command=DEFAULT_COMMAND, max_attempts=MAX_ATTEMPTS) -> dict:
+    """Write a pending job per sample not already pending or claimed, finished jobs of a sample are replaced"""
+
+    for state in STATES:
+        os.makedirs(_path(run_dir, state), exist_ok=True)
+    active = {sample_name(n) for state in ("pending", "claimed") for n in jobs(run_dir, state)}
+    stats = {'queued': 0, 'active': 0}
+    for sample in samples:
+        if sample in active:
+            stats['active'] += 1
+            continue
+        for state in ("done", "failed"):
+            try:
+                os.unlink(_path(run_dir, state, sample + SUFFIX))
+            except FileNotFoundError:
+                pass
+        job = {'sample': sample, 'command': command.format(sample=sample), 'attempt': 0,
+               'max_attempts': max_attempts, 'queued': _now()}
+        _write_json(_path(run_dir, "pending", sample + SUFFIX), job)
+        log_event(run_dir, "queued", job)
+        stats['queued'] += 1
+    return stats
+
+
+def _requeue(run_dir, owned, job, event, **fields) -> str:
+    """Put a job this process owns back to pending, or to failed after its last attempt"""
+
+    job = dict(job, attempt=job.get('attempt', 0) + 1)
+    state = "failed" if job['attempt'] >= job.get('max_attempts', MAX_ATTEMPTS) else "pending"
+    _write_json(_path(run_dir, state, job['sample'] + SUFFIX), job)
+    os.unlink(owned)
+    log_event(run_dir, event if state == "pending" else "failed", job, **fields)
+    return state
+
+
+def reap(run_dir, stale=STALE, owner="reaper") -> List[str]:
+    """Requeue claimed jobs whose heartbeat is older than stale seconds"""
+
+    now = server_time(run_dir)
+    requeued = []
+    for name in jobs(run_dir, "claimed"):
+        path = _path(run_dir, "claimed", name)
+        try:
+            if now - os.stat(path).st_mtime < stale:
+                continue
+            # take the stale claim over by renaming it, only one reaper wins
+            owned = path + ".reaped." + owner
+            os.rename(path, owned)
+        except FileNotFoundError:
+            continue
+        job = _read_json(owned) or {'sample': sample_name(name)}
+        _requeue(run_dir, owned, job, "requeued", owner=name[name.index(SUFFIX) + len(SUFFIX) + 1:])
+        requeued.append(job['sample'])
+    return requeued
+
+
+class Worker(object):
+    """Claims jobs of one or more run queues and runs them one at a time.
+
+    Several workers per host and any number of hosts share the queues. While
+    a job runs the worker touches its claimed file every heartbeat seconds; if
+    the file is gone another worker has requeued it, the job's process is
+    killed and its result not recorded.
+    """
+
+    def __init__(self, run_dirs, name=None, heartbeat=HEARTBEAT, stale=STALE):
+        self.run_dirs = run_dirs
+        self.name = name or "{}.{}".format(socket.gethostname(), os.getpid())
+        self.heartbeat = heartbeat
+        self.stale = stale
+        self.stopping = False
+
+    def claim(self) -> Optional[tuple]:
+        """(run dir, claimed path, job) of the first job this worker could rename into claimed/"""
+
+        for run_dir in self.run_dirs:
+            for name in jobs(run_dir, "pending"):
+                pending = _path(run_dir, "pending", name)
+                claimed = _path(run_dir, "claimed", name + "." + self.name)
+                try:
+                    # the rename keeps the mtime, touch first so a reaper does not take a fresh claim for stale
+                    os.utime(pending)
+                    os.rename(pending, claimed)
+                except FileNotFoundError:
+                    continue
+                job = _read_json(claimed)
+                if job is None:
+                    os.unlink(claimed)
+                    continue
+                log_event(run_dir, "claimed", job, worker=self.name)
+                return run_dir, claimed, job
+        return None
+
+    def execute(self, run_dir, claimed, job) -> int:
+        """Run the job's command in the run directory, heartbeating its claim"""
+
+        start = time.time()
+        proc = subprocess.Popen(shlex.split(job['command']), cwd=run_dir, start_new_session=True)
+        while True:
+            try:
+                code = proc.wait(timeout=self.heartbeat)
+                break
+            except subprocess.TimeoutExpired:
+                try:
+                    os.utime(claimed)
+                except FileNotFoundError:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                    proc.wait()
+                    log_event(run_dir, "lost", job, worker=self.name, wall=round(time.time() - start, 3))
+                    raise LostClaim(job['sample'])
+        # a claim can also be lost between the last heartbeat and the end of the job
+        try:
+            os.utime(claimed)
+        except FileNotFoundError:
+            log_event(run_dir, "lost", job, worker=self.name, wall=round(time.time() - start, 3))
+            raise LostClaim(job['sample'])
+        wall = round(time.time() - start, 3)
+        if code == 0:
+            os.rename(claimed, _path(run_dir, "done", job['sample'] + SUFFIX))
+            log_event(run_dir, "done", job, worker=self.name, wall=wall)
+        else:
+            _requeue(run_dir, claimed, job, "retry", worker=self.name, returncode=code, wall=wall)
+        return code
+
+    def active(self) -> bool:
+        return any(jobs(d, state) for d in self.run_dirs for state in ("pending", "claimed"))
+
+    def run(self, follow=False, poll=None) -> dict:
+        """Work until no job is pending or claimed, with follow until stopped"""
+
+        stats = {'done': 0, 'failed': 0, 'lost': 0, 'requeued': 0}
+        poll = poll or self.heartbeat
+        while not self.stopping:
+            for run_dir in self.run_dirs:
+                stats['requeued'] += len(reap(run_dir, self.stale, self.name))
+            claimed = self.claim()
+            if claimed is None:
+                if not follow and not self.active():
+                    break
+                # jobs claimed elsewhere may still go stale
+                time.sleep(poll)
+                continue
+            try:
+                code = self.execute(*claimed)
+                stats['done' if code == 0 else 'failed'] += 1
+            except LostClaim:
+                stats['lost'] += 1
+        return stats
+
+
+def status(run_dir, stale=STALE) -> Dict[str, list]:
+    """Jobs per state, claimed jobs with owner and seconds since their heartbeat"""
+
+    now = server_time(run_dir)
+    result = {}
+    for state in STATES:
+        result[state] = []
+        for name in jobs(run_dir, state):
+            entry = {'sample': sample_name(name)}
+            if state == "claimed":
+                try:
+                    age = now - os.stat(_path(run_dir, state, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+                entry['owner'] = name[name.index(SUFFIX) + len(SUFFIX) + 1:]
+                entry['heartbeat'] = round(age, 1)
+                entry['stale'] = age >= stale
+            result[state].append(entry)
+    return result
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools mutations`, the code lives in covidtools/mutation_matrix.py
+
+import sys
+from covidtools.mutation_matrix import main
+
+if __name__ == '__main__':
+    sys.exit(main())
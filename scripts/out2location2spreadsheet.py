@@ -2,156 +2,10 @@
 
 # Author: Andreas Wilke
 
-import argparse
-from asyncio.proactor_events import _ProactorBaseWritePipeTransport
-import os
-import readline
-import re
-import sys
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("out_file")
-args = parser.parse_args()
-
-
-
-def parse(file) -> dict :
-    
-    p = re.compile('^\s')
-    t = re.compile('^(summarized|lineages|abundances|resid)\s+(.*)$')
-    
-    d = { 
-            'summarized' : {} ,
-            'lineages' : [] ,
-            'abundances' : [] ,
-            'resid' : ''
-         } 
-    
-    with open(file) as f :
-        header_line = f.readline()
-        tag = None
-        for l in f :
-            line = ''       
-            if t.match(l)  :
-                m = t.match(l)
-                tag = m[1] 
-                l = m[2]
-                # print(m[0])
-                # print(m[1])
-                # print(m[2])
-            
-            stripped = l.strip()
-            if tag == "summarized" :
-                sum = re.findall('\(\'(\w+)\',\s*([\d\.]+)\)' , stripped)
-                
-                for pair in sum :
-                    d[tag][pair[0]] = pair[1]
-                
-            if tag == "lineages" :
-                lin = re.findall('([A-Z\.\d]+)' , stripped)
-                d[tag] += lin
-            if tag == "abundances" :
-                abu = re.findall('([\d\.]+)' , stripped)
-                d[tag] += abu
-            if tag == "resid" :
-                d[tag] = stripped
-            
-    
-    return d
+# Same as `covidtools out2location`, the code lives in covidtools/out2location.py
 
-def data2tab(data , metadata=None) -> None :
-    
-    header = False
-    
-    k = data.keys()
-    
-    # print header
-    if header:
-        if metadata :
-            print( "\t".join( ['id' , 'date' , 'location'] )  + "\t" +  "\t".join(k))
-        else:
-            print( "\t".join(k))
-    
-    
-    row = []
-    for i in data :
-
-        if isinstance( data[i], str):
-            row += [data[i]]
-        elif isinstance( data[i], list) :
-            row += [",".join(data[i])]
-        elif isinstance( data[i], dict) :
-            tmp = []
-            for k,v in data[i].items() :
-                tmp += [":".join([ k ,v ])]
-                
-            row += [",".join(tmp)]
-        else :
-            print("Error: Unsupported type " + type(data[i] , file=sys.stderr))
-            sys.exit(0)
-    
-    if metadata :
-        print("\t".join( [ metadata['id'] , metadata['date'] , metadata['location']] + row)) 
-    else:
-        print("\t".join(row)) 
-    return None
-
-def file2meta(filepath) -> dict :
-    m = {
-        'id'    : '' ,
-        'file'  : '' ,
-        'date'  : '' ,
-        'date-format' : '' ,
-        'location' : '' ,
-        'tags'  : [] ,
-        'hierarchy' : []
-    }
-    
-    filename = os.path.basename(filepath)
-    m['file'] = filename
-    
-    d = re.match("^(\d{2})(\d{2})(\d{2})" , filename)
-    l = re.match("^\d+-(.+)_.*" , filename)
-    i = re.match("(.+)\.out" , filename)
-    
-    if i :
-        m['id'] = i[1]
-    else :
-        m['id'] = filename
-    
-    month   = ''
-    day     = ''
-    year    = ''
-    location = ''
-    
-    if d :
-        month   = d[1]
-        day     = d[2]
-        year    = d[3]
-        
-        m['date'] = year + month + day
-        m['date-format'] = year + "-" + month + "-" + day
-        
-    else :
-        m['date'] = ''
-    
-    if l :
-        m['location'] = l[1]
-    else:
-        m['location'] = m['id']
-        
-    return m
-
-
-if os.path.isfile(args.out_file) :
-    m = file2meta(args.out_file)
-    result = parse(args.out_file)
-    data2tab(result , metadata=m)
-else :
-    print("No such file " + args.out_file)
-    
-    
+import sys
+from covidtools.out2location import main
 
-    #  if p.match(l) :
-    #             d[tag] += " " + l.strip()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,14 +11,20 @@ rsa_file=covid_`whoami`_rsa
 jim=/vol/sars2/jdavis/Sarah/
 base=/local/incoming/covid/
 
+# Per stage timing events, see timing-report.py
+export COVID_RUN=${src}
+export COVID_TIMING_LOG=${COVID_TIMING_LOG:-${covid_run_dir}/logs/timing.jsonl}
+timed="python3 ${base}/scripts/time-stage.py"
+
 echo Processing covid-run folder ${src} `date`
 
+# With WORK_QUEUE=<workers> samples are processed through the shared work queue instead of make -j
 # Use FREYJA_VERSION if set, otherwise default to 'latest'
 FREYJA_VERSION=${FREYJA_VERSION:-latest}
 echo "Using Freyja version: ${FREYJA_VERSION}"
 
 echo Moving bam files
-find ${covid_run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${covid_run_dir}/staging/ \;
+${timed} --stage move-bams -- find ${covid_run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${covid_run_dir}/staging/ \;
 # find ${covid_run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${covid_run_dir}/bam/ \;
 current=`pwd`
 cd ${covid_run_dir}
@@ -28,20 +34,30 @@ echo Found ${nr_assemblies} samples from assemblies
 
 echo Setting date for bam files
 mapping_file=`ls *.sample-mapping.tsv`
-python3 ${base}/scripts/staging2bam.py -m ${mapping_file} -s ./staging/ -d ./bam/
+python3 ${base}/scripts/check-text-file.py ${mapping_file} > ${mapping_file}.check.txt || echo WARNING: ${mapping_file} has errors, see ${mapping_file}.check.txt
+${timed} --stage bam-dates -- python3 ${base}/scripts/staging2bam.py -m ${mapping_file} -s ./staging/ -d ./bam/
 
 nr_samples=`ls ${covid_run_dir}/bam/ | wc -l`
 echo Processing ${nr_samples}/${nr_assemblies} samples
 
 echo "Computing variants and out files with Freyja ${FREYJA_VERSION}" `date`
-make update FREYJA_VERSION=${FREYJA_VERSION}
-make -B -i -j 20 strain FREYJA_VERSION=${FREYJA_VERSION}
-make -i -j 10 strain FREYJA_VERSION=${FREYJA_VERSION} 
+${timed} --stage update -- make update FREYJA_VERSION=${FREYJA_VERSION}
+if [ -n "${WORK_QUEUE}" ] ; then
+    # samples go into queue/ of the run, workers on other hosts join with: work-queue.py work <run dir> --jobs N
+    # --all queues every sample with a bam, not only those without output, the same rebuild as make -B
+    python3 ${base}/scripts/work-queue.py enqueue . --all --command "make -B variants/{sample}.variants.tsv FREYJA_VERSION=${FREYJA_VERSION}"
+    ${timed} --stage strain -- python3 ${base}/scripts/work-queue.py work . --jobs ${WORK_QUEUE}
+else
+    ${timed} --stage strain -- make -B -i -j 20 strain FREYJA_VERSION=${FREYJA_VERSION}
+    ${timed} --stage strain-retry -- make -i -j 10 strain FREYJA_VERSION=${FREYJA_VERSION}
+fi
 echo Done - Computing variants and out files `date`
 
 echo Create coverage and summary
-for i in depth/* ; do sh ${base}/scripts/depth2cov.sh $i ; done > coverage.all.txt
-for i in output/* ; do python3 ${base}/scripts/out2spreadsheet.py $i ; done > summary.tsv
+# depth files go into the run's binary depth cache once, coverage is computed from it for all samples at once;
+# a truncated or malformed depth file is skipped by build and only loses that sample
+${timed} --stage coverage -- sh -c "python3 ${base}/scripts/depth-cache.py --level WARNING build . ; python3 ${base}/scripts/depth-cache.py coverage ." > coverage.all.txt
+${timed} --stage summary -- sh -c "python3 ${base}/scripts/covidtools out2tab output/*" > summary.tsv
 
 echo Creating summary
 sort summary.tsv > summary.sorted.tsv
@@ -49,11 +65,13 @@ sort coverage.all.txt > coverage.sorted.txt
 cat coverage.sorted.txt | cut -f1,2 > coverage.c1.c2
 
 join -t $'\t' -a 1 -a 2 -e 'n/a' -j 1 summary.sorted.tsv coverage.c1.c2 > summary.all.tsv
+# one QC gate decision per sample in qc_gate.tsv and summary.all.tsv, skipped samples and their reason in qc_failed.tsv and the log
+python3 ${base}/scripts/qc-gate.py summary . --table summary.all.tsv
 
 python3 ${base}/scripts/update-sample-mapping.py -c coverage.all.txt -m ${mapping_file} -s output 2>./summary.error.log 1> ${mapping_file}.updated.tsv
 
 echo Creating Pileups
-sh /local/incoming/covid/scripts/create-pileups.sh $run_dir
+${timed} --stage pileups -- sh /local/incoming/covid/scripts/create-pileups.sh $run_dir
 
 # echo Moving data for plotting
 # python3 ${base}/scripts/samples2aggregates.py --mapping-file ${mapping_file} --sites2labels ${base}/mapping.tsv --source-dir ./ --destination-dir ${base}/aggregate/current/
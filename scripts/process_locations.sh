@@ -2,11 +2,15 @@ locations=/local/incoming/covid/aggregate/locations/
 base=/local/incoming/covid/
 FREYJA=/local/incoming/covid/config/freyja_1.3.1.sif
 log=`date +%Y-%m-%d`.error.log
-for l in ${locations}/* 
+# optional file with label directories to rebuild, e.g. the output of reconcile-aggregates.py
+if [ -n "$1" ]
+then
+	dirs=`cat $1`
+else
+	dirs=`ls -d ${locations}/*/*`
+fi
 
-	do 
-	groups=${l}
-	for g in ${groups}/* 
+	for g in ${dirs}
 		do 
 			d=`basename $g` 
 			echo Aggregate for $g $d
@@ -26,4 +30,3 @@ for l in ${locations}/*
 			echo Lineages $d
 			singularity  run --bind /local/incoming/covid/ $FREYJA freyja plot $g/$d.aggregate.line.sorted.tsv  --lineages --output $g/$d.aggregate.lineages.pdf
 		done
-	done
@@ -1,11 +1,4 @@
-sh scripts/process_testing_group.sh aggregate/testing/City &
-sh scripts/process_testing_group.sh aggregate/testing/County &
-sh scripts/process_testing_group.sh aggregate/testing/Group &
-sh scripts/process_testing_group.sh aggregate/testing/ID_Pattern &
-sh scripts/process_testing_group.sh aggregate/testing/Label &
-sh scripts/process_testing_group.sh aggregate/testing/Name &
-sh scripts/process_testing_group.sh aggregate/testing/Project &
-sh scripts/process_testing_group.sh aggregate/testing/Region &
-sh scripts/process_testing_group.sh aggregate/testing/SiteID &
-sh scripts/process_testing_group.sh aggregate/testing/wwtp_name &
-
+# all label dimensions in one run: each demix output parsed once, a bounded
+# pool for tables and plots, per dimension timings, exit status 1 on failures
+python3 scripts/aggregate-labels.py aggregate/testing --jobs ${JOBS:-8} \
+	--dimensions City County Group ID_Pattern Label Name Project Region SiteID wwtp_name
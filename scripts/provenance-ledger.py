@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools ledger`, the code lives in covidtools/provenance_ledger.py
+
+import sys
+from covidtools.provenance_ledger import main
+
+if __name__ == '__main__':
+    sys.exit(main())
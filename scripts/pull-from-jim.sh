@@ -11,14 +11,8 @@ rsa_file=covid_`whoami`_rsa
 jim=/vol/sars2/jdavis/Sarah/
 base=/local/incoming/covid/
 echo Pulling $run_dir
-echo rsync -zurv --rsh="ssh -i ~/.ssh/${rsa_file}" --include="*.bam" --exclude="*.*"  wilke@locust:${jim}/${src}/ ${covid_run_dir}/
-
-rsync -zurv --chmod=g\+w --rsh="ssh -i ~/.ssh/${rsa_file}" --include="*.bam" --exclude="*.*"  wilke@locust:${jim}/${src}/ ${covid_run_dir}/
-
-
-echo Moving bam files
-find ${covid_run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${covid_run_dir}/staging/ \;
-# find ${covid_run_dir}/Assemblies -name *.sorted.bam -exec mv {} ${covid_run_dir}/bam/ \;
+# only new or changed bams, straight into staging/, parallel streams without compression
+python3 ${base}/scripts/sync-run.py wilke@locust:${jim}/${src}/ ${covid_run_dir} --include "*.sorted.bam" --flatten staging --chmod g+w --ssh "ssh -i ${HOME}/.ssh/${rsa_file}"
 current=`pwd`
 cd ${covid_run_dir}
 
@@ -29,7 +23,7 @@ make -j 8 strain
 
 echo Create coverage and summary
 for i in depth/* ; do sh ${base}/scripts/depth2cov.sh $i ; done | tee coverage.all.txt
-for i in output/* ; do python3 ${base}/scripts/out2spreadsheet.py $i ; done > summary.tsv
+python3 ${base}/scripts/covidtools out2tab output/* > summary.tsv
 
 sort summary.tsv > summary.sorted.tsv
 sort coverage.all.txt > coverage.sorted.txt
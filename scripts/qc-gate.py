@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools qc-gate`, the code lives in covidtools/qc_gate.py
+
+import sys
+from covidtools.qc_gate import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,6 +39,8 @@ echo Processing ${nr_samples}/${nr_assemblies} samples
 echo Computing variants and out files `date`
 # make update
 ### clean variants for recompute
+# a packed run gets its loose files back first, the recomputed files replace them
+if [ -f results.bundle ] ; then python3 ${base}/scripts/bundle-run.py unpack . ; fi
 mv Makefile Makefile.${time_suffix}
 cp ${base}/config/Makefile .
 rm variants/*
@@ -47,8 +49,8 @@ make -i -j 10 strain
 echo Done - Computing variants and out files `date`
 
 echo Create coverage and summary
-for i in depth/* ; do sh ${base}/scripts/depth2cov.sh $i ; done > coverage.all.txt
-for i in output/* ; do python3 ${base}/scripts/out2spreadsheet.py $i ; done > summary.tsv
+python3 ${base}/scripts/depth-cache.py --level WARNING build . ; python3 ${base}/scripts/depth-cache.py coverage . > coverage.all.txt
+python3 ${base}/scripts/covidtools out2tab output/* > summary.tsv
 
 echo Creating summary
 sort summary.tsv > summary.sorted.tsv
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools reconcile`, the code lives in covidtools/reconcile_aggregates.py
+
+import sys
+from covidtools.reconcile_aggregates import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools results-db`, the code lives in covidtools/results_db.py
+
+import sys
+from covidtools.results_db import main
+
+if __name__ == '__main__':
+    sys.exit(main())
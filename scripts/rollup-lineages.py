@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools rollup`, the code lives in covidtools/rollup_lineages.py
+
+import sys
+from covidtools.rollup_lineages import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,8 +17,6 @@ echo "Copying fastq's"
 find $1 -name "*.fastq.gz" -exec cp {} ${covid_run_dir}/samples/ \;
 
 echo "Syncing to locust"
-rsync -arvp --rsh="ssh -i ~/.ssh/${rsa_file} " --include="*.fastq.gz" --exclude="*.*" ${covid_run_dir} wilke@locust:/vol/sars2/jdavis/Sarah/${dir}
-
-echo Updating permissions
-ssh -i ~/.ssh/${rsa_file} wilke@locust "echo Changing group ; chgrp -R collab /vol/sars2/jdavis/Sarah/${dir} ; echo Changing permissions ; chmod -R g+w /vol/sars2/jdavis/Sarah/${dir}"
+# group and mode are set as files are written, no recursive chgrp/chmod afterwards
+python3 /local/incoming/covid/scripts/sync-run.py ${covid_run_dir} wilke@locust:/vol/sars2/jdavis/Sarah/${dir} --include "*.fastq.gz" Makefile --chmod g+w --group collab --ssh "ssh -i ${HOME}/.ssh/${rsa_file}"
 echo Done `date`
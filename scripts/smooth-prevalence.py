@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools smooth`, the code lives in covidtools/smooth_prevalence.py
+
+import sys
+from covidtools.smooth_prevalence import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools sra-submit`, the code lives in covidtools/sra_submit.py
+
+import sys
+from covidtools.sra_submit import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools stage-reads`, the code lives in covidtools/stage_reads.py
+
+import sys
+from covidtools.stage_reads import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools sync`, the code lives in covidtools/sync_run.py
+
+import sys
+from covidtools.sync_run import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools time-stage`, the code lives in covidtools/time_stage.py
+
+import sys
+from covidtools.time_stage import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools timing-report`, the code lives in covidtools/timing_report.py
+
+import sys
+from covidtools.timing_report import main
+
+if __name__ == '__main__':
+    sys.exit(main())
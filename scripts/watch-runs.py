@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools watch`, the code lives in covidtools/watch_runs.py
+
+import sys
+from covidtools.watch_runs import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools tiles`, the code lives in covidtools/weekly_tiles.py
+
+import sys
+from covidtools.weekly_tiles import main
+
+if __name__ == '__main__':
+    sys.exit(main())
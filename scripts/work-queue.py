@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+
+# Author: Andreas Wilke
+
+# Same as `covidtools work-queue`, the code lives in covidtools/work_queue.py
+
+import sys
+from covidtools.work_queue import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Timed benchmarks for the parsing, mapping and linking hot paths in scripts/.
+
+Inputs come from synthetic.py; results are written as JSON and can be compared
+against a stored baseline to catch regressions before deployment:
+
+    python3 tests/benchmarks/run_benchmarks.py --scale 0.01 --output baseline.json
+    python3 tests/benchmarks/run_benchmarks.py --scale 0.01 --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(HERE)), "scripts")
+sys.path.insert(0, SCRIPTS)
+sys.path.insert(0, HERE)
+
+from synthetic import generate  # noqa: E402
+from lib.depthcache import DepthCache, depth_files  # noqa: E402
+from lib.mapping import Mapping  # noqa: E402
+from covidtools import out2tab, sort_aggregate, update_mapping  # noqa: E402
+
+
+def run_script(name, *args):
+    subprocess.run([sys.executable, os.path.join(SCRIPTS, name)] + list(args),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+class Benchmarks(object):
+
+    def __init__(self, data_dir, work_dir):
+        self.data = data_dir
+        self.work = work_dir
+        self.mapping_file = os.path.join(data_dir, "all.sample-mapping.tsv")
+        self.sites_file = os.path.join(data_dir, "sites.tsv")
+        self.out_dir = os.path.join(data_dir, "output")
+        self.outs = sorted(os.path.join(self.out_dir, f) for f in os.listdir(self.out_dir))
+        self.aggregates = sorted(os.path.join(r, f) for r, _, fs in os.walk(os.path.join(data_dir, "aggregate"))
+                                 for f in fs if f.endswith(".aggregate.tsv"))
+        self.mapping = Mapping()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.mapping.load(self.mapping_file)
+        self.ids = [self.mapping.get_id(f) for f in self.outs]
+        self.depths = depth_files(data_dir)
+
+    # each benchmark returns the number of items it processed
+
+    def mapping_load(self):
+        m = Mapping()
+        m.load(self.mapping_file)
+        return len(m.ids)
+
+    def mapping_get_id(self):
+        for f in self.outs:
+            self.mapping.get_id(f)
+        return len(self.outs)
+
+    def mapping_id2date(self):
+        for i in self.ids:
+            self.mapping.id2date(i)
+        return len(self.ids)
+
+    def out2spreadsheet_parse(self):
+        parse = out2tab.parse
+        for f in self.outs:
+            parse(f)
+        return len(self.outs)
+
+    def update_mapping_parse_demix(self):
+        parse = update_mapping._parse_demix_file
+        for f in self.outs:
+            parse(f)
+        return len(self.outs)
+
+    def sort_aggregate_parse(self):
+        parse = sort_aggregate.parse
+        for f in self.aggregates:
+            parse(f)
+        return len(self.aggregates)
+
+    def merge(self):
+        run_script("merge.py", "-a", self.mapping_file, "-b", self.mapping_file,
+                   "-ka", "1", "-kb", "1", "-c", "4", "5", "--has-header")
+        return len(self.mapping.ids)
+
+    def labels_fanout(self):
+        dest = os.path.join(self.work, "aggregate")
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        os.makedirs(dest)
+        run_script("samples2aggregates.py", "--mapping-file", self.mapping_file, "--sites2labels", self.sites_file,
+                   "--source-dir", self.out_dir, "--destination-dir", dest)
+        return len(self.outs)
+
+    def depth_text_coverage(self):
+        # what depth2cov.sh does per file, in Python
+        for path in self.depths.values():
+            count = total = 0
+            with open(path) as f:
+                for l in f:
+                    total += 1
+                    if int(l.split("\t")[3]) >= 3:
+                        count += 1
+        return len(self.depths)
+
+    def depth_cache_build(self):
+        run_dir = os.path.join(self.work, "depth-cache")
+        if os.path.isdir(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+        DepthCache(run_dir).update(self.depths)
+        return len(self.depths)
+
+    def depth_cache_coverage(self):
+        run_dir = os.path.join(self.work, "depth-cache")
+        if not os.path.isfile(os.path.join(run_dir, "depth.u32.json")):
+            self.depth_cache_build()
+        return len(DepthCache(run_dir).coverage())
+
+
+NAMES = ['mapping_load', 'mapping_get_id', 'mapping_id2date', 'out2spreadsheet_parse',
+         'update_mapping_parse_demix', 'sort_aggregate_parse', 'merge', 'labels_fanout',
+         'depth_text_coverage', 'depth_cache_build', 'depth_cache_coverage']
+
+
+def measure(fn, repeats) -> dict:
+    times = []
+    items = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            items = fn()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        'repeats': repeats,
+        'items': items,
+        'seconds_min': round(best, 6),
+        'seconds_median': round(statistics.median(times), 6),
+        'items_per_second': round(items / best, 1) if best else None
+    }
+
+
+def compare(baseline, results, threshold) -> list:
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get('results', {}).get(name)
+        if not b or not b['seconds_min']:
+            continue
+        change = (r['seconds_min'] - b['seconds_min']) / b['seconds_min']
+        if change > threshold:
+            regressions.append((name, b['seconds_min'], r['seconds_min'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing, mapping and linking hot paths.')
+    parser.add_argument('--data-dir', dest='data_dir', default='/tmp/covid-benchmark-data')
+    parser.add_argument('--scale', dest='scale', type=float, default=1.0,
+                        help='Fraction of the full scale (100k outputs, 5k mapping rows)')
+    parser.add_argument('--repeats', dest='repeats', type=int, default=3)
+    parser.add_argument('--only', dest='only', nargs='+', default=None, choices=NAMES)
+    parser.add_argument('--output', dest='output', default=None, help='Write results JSON here')
+    parser.add_argument('--baseline', dest='baseline', default=None, help='Results JSON to compare against')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.25,
+                        help='Fail if a benchmark is slower than baseline by this fraction')
+    args = parser.parse_args()
+
+    params = generate(args.data_dir, scale=args.scale)
+    work = args.data_dir.rstrip("/") + ".work"
+    os.makedirs(work, exist_ok=True)
+    bench = Benchmarks(args.data_dir, work)
+
+    results = {}
+    for name in args.only or NAMES:
+        results[name] = measure(getattr(bench, name), args.repeats)
+        r = results[name]
+        print("{:<28} {:>10.3f}s {:>12} items/s".format(name, r['seconds_min'], r['items_per_second']))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print("WARNING: baseline was run with different parameters")
+        regressions = compare(baseline, results, args.threshold)
+        for name, old, new, change in regressions:
+            print("REGRESSION {}: {:.3f}s -> {:.3f}s ({:+.0%})".format(name, old, new, change))
+        if regressions:
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Synthetic input generator for the benchmark suite.
+
+Fabricates run data shaped like data/output/*.out and data/all.sample-mapping.tsv
+at a configurable scale: demix outputs with numpy-style wrapped lineage and
+abundance lists, a sample mapping, a site/label mapping, depth files and a
+nested aggregate tree (<group>/<label>/data/*.out plus wrapped aggregate TSVs).
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+from datetime import date, timedelta
+
+# Counts at --scale 1.0
+BASE_SCALE = {
+    'outs': 100000,
+    'mapping_rows': 5000,
+    'sites': 300,
+    'depth_files': 200,
+    'depth_positions': 29903,
+    'aggregate_groups': 10,
+    'aggregate_labels': 30,
+    'aggregate_rows': 400
+}
+
+CLADES = ['Omicron', 'Delta', 'Alpha', 'Other', 'Gamma', 'Beta', 'Mu', 'A']
+LINEAGE_ROOTS = ['B.1.1.529', 'BA.1', 'BA.2', 'BA.4', 'BA.5', 'BQ.1', 'XBB.1', 'B.1.617.2',
+                 'AY.4', 'AY.103', 'B.1.1.7', 'P.1', 'B.1.177', 'A.2', 'XBB.1.5', 'EG.5']
+LABEL_COLUMNS = ['City', 'County', 'Region', 'wwtp_name', 'Project']
+
+
+def scaled(scale) -> dict:
+    return {k: max(1, int(v * scale)) if k != 'depth_positions' else v for k, v in BASE_SCALE.items()}
+
+
+def lineage(rng):
+    root = rng.choice(LINEAGE_ROOTS)
+    depth = rng.randint(0, 3)
+    return ".".join([root] + [str(rng.randint(1, 60)) for _ in range(depth)])
+
+
+def wrap(items, width=75, indent=" "):
+    """Wrap a list the way numpy prints long arrays"""
+
+    lines = []
+    line = ""
+    for item in items:
+        if line and len(line) + len(item) + 1 > width:
+            lines.append(line)
+            line = indent + item
+        else:
+            line = line + " " + item if line else item
+    lines.append(line)
+    return "\n".join(lines)
+
+
+def demix_text(name, rng) -> str:
+    n = rng.choice([1, 2, 4, 8, 20, 60, 300]) if rng.random() < 0.1 else rng.randint(1, 6)
+    lineages = [lineage(rng) for _ in range(n)]
+    weights = sorted([rng.random() for _ in range(n)], reverse=True)
+    total = sum(weights)
+    abundances = [w / total for w in weights]
+    clades = rng.sample(CLADES, rng.randint(1, 3))
+    summarized = ", ".join("('{}', {})".format(c, round(rng.random(), 16)) for c in clades)
+
+    lin = "[" + wrap(["'" + l + "'" for l in lineages]) + "]"
+    abu = "[" + wrap(["{:.8f}".format(a) for a in abundances]) + "]"
+    if "\n" in lin:
+        lin = '"' + lin + '"'
+        abu = '"' + abu + '"'
+    return "\n".join([
+        "\tvariants/" + name + ".variants.tsv",
+        "summarized\t[" + summarized + "]",
+        "lineages\t" + lin,
+        "abundances\t" + abu,
+        "resid\t" + str(rng.random() * 20),
+        "coverage\t" + str(round(rng.random() * 100, 2)),
+        ""
+    ])
+
+
+def sample_rows(counts, rng):
+    """(sample_id, M/D/YY date, site_id, wwtp_name) per mapping row"""
+
+    start = date(2022, 1, 1)
+    rows = []
+    for i in range(counts['mapping_rows']):
+        site = rng.randint(1, counts['sites'])
+        d = start + timedelta(days=rng.randint(0, 700))
+        rows.append((str(18000 + i), "{}/{}/{}".format(d.month, d.day, d.strftime("%y")),
+                     "S{:04d}".format(site), "WWTP_{:04d}".format(site)))
+    return rows
+
+
+def write_mapping(path, rows):
+    with open(path, "w") as f:
+        f.write("\t".join(["sample_id", "sample_collect_date", "sample_location_specify", "wwtp_name", "site_id"]) + "\n")
+        for sid, d, site, wwtp in rows:
+            f.write("\t".join([sid, d, "", wwtp, site]) + "\n")
+
+
+def write_sites(path, counts, rng):
+    """Site to label mapping as read by Mapping.load_site_mapping()"""
+
+    with open(path, "w") as f:
+        f.write("\t".join(["ID_Pattern", "SiteID"] + LABEL_COLUMNS) + "\n")
+        for s in range(1, counts['sites'] + 1):
+            labels = ["{}_{}".format(c, rng.randint(1, 12)) for c in LABEL_COLUMNS]
+            f.write("\t".join(["P{:04d}".format(s), "S{:04d}".format(s)] + labels) + "\n")
+
+
+def write_outs(out_dir, rows, counts, rng):
+    for i in range(counts['outs']):
+        sid, d, site, wwtp = rows[i % len(rows)]
+        m, day, y = d.split("/")
+        name = "{}{:02d}{:02d}.{}_S{}".format(y, int(m), int(day), sid, i % 384 + 1)
+        if i >= len(rows):
+            # re-sequenced samples keep their ID but get a new run prefix
+            name = "{}.{}_S{}".format(rng.randint(220101, 241231), sid, i % 384 + 1)
+        with open(os.path.join(out_dir, name + ".out"), "w") as f:
+            f.write(demix_text(name, rng))
+
+
+def write_depths(depth_dir, counts, rng):
+    for i in range(counts['depth_files']):
+        mean = rng.choice([0, 5, 50, 500, 3000])
+        with open(os.path.join(depth_dir, "S{}.depth".format(i)), "w") as f:
+            for pos in range(1, counts['depth_positions'] + 1):
+                f.write("MN908947.3\t{}\tA\t{}\n".format(pos, max(0, int(rng.gauss(mean, mean / 3 + 1)))))
+
+
+def write_aggregates(agg_dir, out_dir, counts, rng):
+    """<group>/<label>/data/*.out hardlinks and a wrapped aggregate TSV per label"""
+
+    outs = sorted(os.listdir(out_dir))
+    for g in range(counts['aggregate_groups']):
+        for l in range(counts['aggregate_labels']):
+            label_dir = os.path.join(agg_dir, "Group_{}".format(g), "Label_{}".format(l))
+            data_dir = os.path.join(label_dir, "data")
+            os.makedirs(data_dir)
+            for name in rng.sample(outs, min(len(outs), 20)):
+                os.link(os.path.join(out_dir, name), os.path.join(data_dir, name))
+            with open(os.path.join(label_dir, "Label_{}.aggregate.tsv".format(l)), "w") as f:
+                f.write("\tsummarized\tlineages\tabundances\tresid\tcoverage\n")
+                for r in range(counts['aggregate_rows']):
+                    n = rng.randint(1, 30)
+                    lin = wrap([lineage(rng) for _ in range(n)], width=60)
+                    abu = wrap(["{:.6f}".format(rng.random()) for _ in range(n)], width=60)
+                    f.write("\t".join(["{}.{}_S{}.out".format(rng.randint(220101, 241231), 18000 + r, r),
+                                       "[('Omicron', 0.9)]", lin, abu, "1.5", "97.1"]) + "\n")
+
+
+def generate(data_dir, scale=1.0, seed=42, force=False) -> dict:
+    """Create the synthetic data set in data_dir, reusing it if the parameters match"""
+
+    counts = scaled(scale)
+    params = {'scale': scale, 'seed': seed, 'counts': counts}
+    params_file = os.path.join(data_dir, "params.json")
+
+    if not force and os.path.isfile(params_file):
+        with open(params_file) as f:
+            if json.load(f) == params:
+                return params
+    if os.path.isdir(data_dir):
+        shutil.rmtree(data_dir)
+
+    rng = random.Random(seed)
+    for d in ["output", "depth", "aggregate"]:
+        os.makedirs(os.path.join(data_dir, d))
+
+    rows = sample_rows(counts, rng)
+    write_mapping(os.path.join(data_dir, "all.sample-mapping.tsv"), rows)
+    write_sites(os.path.join(data_dir, "sites.tsv"), counts, rng)
+    write_outs(os.path.join(data_dir, "output"), rows, counts, rng)
+    write_depths(os.path.join(data_dir, "depth"), counts, rng)
+    write_aggregates(os.path.join(data_dir, "aggregate"), os.path.join(data_dir, "output"), counts, rng)
+
+    with open(params_file, "w") as f:
+        json.dump(params, f, indent=2)
+    return params
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic benchmark inputs.')
+    parser.add_argument('--data-dir', dest='data_dir', required=True)
+    parser.add_argument('--scale', dest='scale', type=float, default=1.0,
+                        help='Fraction of the full scale (100k outputs, 5k mapping rows)')
+    parser.add_argument('--seed', dest='seed', type=int, default=42)
+    parser.add_argument('--force', dest='force', action='store_true', default=False)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.data_dir, args.scale, args.seed, args.force), indent=2))
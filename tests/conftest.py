@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the libraries are imported as the scripts import them, from scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
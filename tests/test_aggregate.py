@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from covidtools import aggregate_labels, sort_aggregate
+from lib.aggregate import parse_once
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+OUTPUT = os.path.join(os.path.dirname(TESTS), "data", "output")
+SAMPLES = ["220327.20900_S36", "220328.21624_S68", "220328.22902_S42"]
+
+
+@pytest.fixture
+def root(tmp_path):
+    """City/Chicago with three outputs, City/Springfield with a hardlink of one of them and a dangling link"""
+
+    chicago = tmp_path / "City" / "Chicago" / "data"
+    springfield = tmp_path / "City" / "Springfield" / "data"
+    chicago.mkdir(parents=True)
+    springfield.mkdir(parents=True)
+    for name in SAMPLES:
+        shutil.copy(os.path.join(OUTPUT, name + ".out"), str(chicago / (name + ".out")))
+    os.link(str(chicago / (SAMPLES[0] + ".out")), str(springfield / (SAMPLES[0] + ".out")))
+    os.symlink(str(tmp_path / "gone.out"), str(springfield / "220401.23001_S1.out"))
+    return tmp_path
+
+
+def test_matches_freyja_aggregate(root, capsys):
+    assert aggregate_labels.main([str(root), "--no-plot", "--jobs", "1"]) == 1
+    capsys.readouterr()
+
+    # freyja aggregate output for the same outputs, rows named by the demix header column
+    fixture = os.path.join(TESTS, "data", "Chicago.aggregate.tsv")
+    label = root / "City" / "Chicago"
+    with open(fixture) as f:
+        assert (label / "Chicago.aggregate.tsv").read_text() == f.read()
+
+    sort_aggregate.main([fixture])
+    line = capsys.readouterr().out
+    assert (label / "Chicago.aggregate.line.tsv").read_text() == line
+    filtered = [l for l in line.splitlines() if "[]" not in l]
+    assert (label / "Chicago.aggregate.line.filtered.tsv").read_text().splitlines() == filtered
+    assert [l.split("\t")[0] for l in filtered[2:]] == ["220327.20900_S36.variants.tsv", "220328.21624_S68.variants.tsv"]
+
+
+def test_unreadable_output_fails_label(root, caplog):
+    assert aggregate_labels.main([str(root), "--no-plot", "--jobs", "1"]) == 1
+    assert "220401.23001_S1.out: not readable" in caplog.text
+    # the readable output of the label is still aggregated
+    rows = (root / "City" / "Springfield" / "Springfield.aggregate.tsv").read_text().splitlines()
+    assert [r.split("\t")[0] for r in rows] == ["", "220327.20900_S36.variants.tsv"]
+
+
+def test_parse_once_shares_hardlinks(root):
+    chicago = str(root / "City" / "Chicago" / "data" / (SAMPLES[0] + ".out"))
+    springfield = str(root / "City" / "Springfield" / "data" / (SAMPLES[0] + ".out"))
+    dangling = str(root / "City" / "Springfield" / "data" / "220401.23001_S1.out")
+    parsed = parse_once([chicago, springfield, dangling])
+    assert parsed[chicago] is parsed[springfield]
+    assert parsed[chicago][0] == "220327.20900_S36.variants.tsv"
+    assert parsed[dangling] is None
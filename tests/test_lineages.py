@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import yaml
+
+from lib import lineages
+from lib.lineages import Hierarchy
+
+LINEAGES_YML = """
+- name: B.1.1.529
+- name: BA.1
+  alias: B.1.1.529.1
+- name: BA.2
+  alias: B.1.1.529.2
+- name: BA.2.75
+  alias: B.1.1.529.2.75
+- name: XBB
+  parent: BA.2
+- name: XBB.1.5
+"""
+
+
+@pytest.fixture
+def hierarchy():
+    return Hierarchy.compile(yaml.safe_load(LINEAGES_YML))
+
+
+def names(h, indices):
+    return sorted(h.names[i] for i in indices)
+
+
+def test_compile(hierarchy):
+    h = hierarchy
+    assert h.full[h.index["BA.2.75"]] == "B.1.1.529.2.75"
+    assert h.names[h.parent[h.index["BA.2.75"]]] == "BA.2"
+    assert h.names[h.parent[h.index["XBB"]]] == "BA.2"
+    assert h.names[h.parent[h.index["XBB.1.5"]]] == "XBB"
+    assert names(h, h.ancestors(h.index["XBB.1.5"])) == ["B.1.1.529", "BA.2", "XBB"]
+    assert names(h, h.descendants(h.index["BA.2"])) == ["BA.2.75", "XBB", "XBB.1.5"]
+
+
+def test_resolve(hierarchy):
+    h = hierarchy
+    assert h.resolve("BA.1") == h.index["BA.1"]
+    # aliased names and unknown sublineages go to the nearest known ancestor
+    assert h.resolve("B.1.1.529.2.75") == h.index["BA.2.75"]
+    assert h.resolve("BA.2.75.2") == h.index["BA.2.75"]
+    assert h.resolve("BA.5") == h.index["B.1.1.529"]
+    assert h.resolve("AY.4") == -1
+
+
+def test_resolve_cache_per_instance(hierarchy):
+    other = Hierarchy.compile([{'name': "BA.2", 'alias': "B.1.1.529.2"}])
+    assert hierarchy.resolve("BA.2.75.2") == hierarchy.index["BA.2.75"]
+    assert other.resolve("BA.2.75.2") == other.index["BA.2"]
+    assert "BA.2.75.2" in hierarchy._resolved
+    assert "BA.2.75.2" in other._resolved
+
+
+def test_rollup(hierarchy):
+    h = hierarchy
+    m = h.abundance_matrix([(["BA.1", "BA.2.75", "XBB.1.5"], ["0.2", "0.3", "0.5"]),
+                            (["AY.4"], ["1.0"])])
+    assert m.shape == (2, len(h) + 1)
+    inclusive = h.rollup(m, ["BA.2", "XBB", "B.1.1.529"])
+    np.testing.assert_allclose(inclusive, [[0.8, 0.5, 1.0], [0.0, 0.0, 0.0]])
+    exclusive = h.rollup(m, ["BA.2", "XBB", "B.1.1.529"], exclusive=True)
+    np.testing.assert_allclose(exclusive, [[0.3, 0.5, 0.2, 0.0], [0.0, 0.0, 0.0, 1.0]])
+
+
+def test_load_cache(tmp_path):
+    path = tmp_path / "lineages.yml"
+    path.write_text(LINEAGES_YML)
+    h = lineages.load(str(path))
+    cached = list(tmp_path.glob("lineages.*.npz"))
+    assert len(cached) == 1
+    again = lineages.load(str(path))
+    assert again.names == h.names
+    assert again.full == h.full
+    assert np.array_equal(again.parent, h.parent)
+    assert again.resolve("BA.2.75.2") == h.resolve("BA.2.75.2")
+
+
+def test_cache_keeps_derived_arrays(tmp_path, monkeypatch):
+    path = tmp_path / "lineages.yml"
+    path.write_text(LINEAGES_YML)
+    h = lineages.load(str(path))
+    # a cached hierarchy is not derived again
+    monkeypatch.setattr(Hierarchy, "_derive", lambda self: pytest.fail("derived on load"))
+    again = lineages.load(str(path))
+    for name in lineages.DERIVED:
+        assert np.array_equal(getattr(again, name), getattr(h, name))
+    assert names(again, again.descendants(again.index["BA.2"])) == ["BA.2.75", "XBB", "XBB.1.5"]
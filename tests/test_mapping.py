@@ -0,0 +1,74 @@
+import pytest
+
+from lib.mapping import Mapping, Sample
+
+MAPPING = ("sample_id\tsample_collect_date\tsample_location_specify\twwtp_name\tsite_id\n"
+           "18510\t1/18/22\t\tFOX METRO WRD WWTP\tS0024\n"
+           "18490\t1/18/22\t\tBELLEVILLE STP 1 - East\tS0004\n"
+           "18491\t12/3/21\t\tBELLEVILLE STP 1 - East\tS0004\n"
+           "18492\tpending\t\tFOX METRO WRD WWTP\tS0024\n"
+           "short\t1/18/22\n")
+
+SITES = ("ID_Pattern\tSiteID\tCity\tCounty\n"
+         "P0024\tS0024\tAurora\tKane\n"
+         "P0004\tS0004\tBelleville\tSt. Clair\n")
+
+
+@pytest.fixture
+def mapping(tmp_path):
+    mapping_file = tmp_path / "all.sample-mapping.tsv"
+    mapping_file.write_text(MAPPING)
+    m = Mapping()
+    m.load(str(mapping_file))
+    return m
+
+
+def test_load(mapping):
+    assert sorted(mapping.ids) == ["18490", "18491", "18492", "18510"]
+    sample = mapping.ids["18510"]
+    assert isinstance(sample, Sample)
+    assert (sample.date, sample.site) == ("1/18/22", "S0024")
+    assert sample.labels == (("wwtp_name", "FOX_METRO_WRD_WWTP"), ("site_id", "S0024"))
+    # mapping['values'] holds the same records
+    assert mapping.mapping['values']["18510"] is sample
+
+
+def test_sample_item_access(mapping):
+    sample = mapping.ids["18490"]
+    assert sample['date'] == "1/18/22"
+    assert sample['site'] == "S0004"
+    assert sample['labels'] == ["BELLEVILLE_STP_1_-_East", "S0004"]
+    assert sample['columns'] == [{'header': "wwtp_name", 'group': "BELLEVILLE_STP_1_-_East"},
+                                 {'header': "site_id", 'group': "S0004"}]
+    with pytest.raises(KeyError):
+        sample['missing']
+
+
+def test_id2site_and_id2date(mapping):
+    assert mapping.id2site("18490") == "S0004"
+    assert mapping.id2site("99999") is None
+    assert mapping.id2date("18491") == "211203"
+    assert mapping.id2date("18492") is None
+    assert mapping.id2date("99999") is None
+
+
+def test_site2labels(mapping, tmp_path):
+    # samples of one site share its labels once
+    assert mapping.site2labels("S0004") == [("wwtp_name", "BELLEVILLE_STP_1_-_East"), ("site_id", "S0004")]
+    assert mapping.site2labels("S9999") is None
+
+    sites_file = tmp_path / "sites.tsv"
+    sites_file.write_text(SITES)
+    mapping.load_site_mapping(str(sites_file))
+    labels = mapping.site2labels("S0004")
+    assert labels[:2] == [("wwtp_name", "BELLEVILLE_STP_1_-_East"), ("site_id", "S0004")]
+    assert labels[2:] == [("ID_Pattern", "P0004"), ("SiteID", "S0004"), ("City", "Belleville"),
+                          ("County", "St._Clair")]
+    # pairs are shared between sites and samples
+    assert mapping.ids["18490"].labels[0] is labels[0]
+
+
+def test_resolve(mapping):
+    result = mapping.resolve(["220118.18510_S1.out", "220118.99999_S2.out", "220118.18492_S3.out"])
+    assert result['samples'][0] == ("220118.18510_S1.out", "18510", "220118", "S0024")
+    assert result['missing'] == {'id': [], 'mapping': ["99999"], 'date': ["18492"]}
@@ -0,0 +1,51 @@
+import numpy as np
+
+from lib import mutations
+from lib.mutations import MutationStore
+
+HEADER = "REGION\tPOS\tREF\tALT\tALT_FREQ\tTOTAL_DP\n"
+
+
+def variants(rows):
+    return HEADER + "".join("MN908947.3\t{}\t{}\t{}\t{}\t{}\n".format(*r) for r in rows)
+
+
+def make_run(tmp_path, run, samples):
+    (tmp_path / run / "variants").mkdir(parents=True)
+    for sample, rows in samples.items():
+        (tmp_path / run / "variants" / (sample + ".variants.tsv")).write_text(variants(rows))
+    return str(tmp_path / run)
+
+
+def test_rebuild_interrupted_before_save(tmp_path):
+    store_dir = str(tmp_path / "store")
+    run = make_run(tmp_path, "220407", {"22501_S1": [(23063, "A", "T", 0.9, 100)]})
+    store = MutationStore(store_dir)
+    store.add_run(run)
+    store.save()
+
+    # the rebuild adds mutations and dies before save()
+    (tmp_path / "220407" / "variants" / "22502_S2.variants.tsv").write_text(
+        variants([(23063, "A", "T", 0.5, 80), (22578, "G", "A", 0.7, 60)]))
+    MutationStore(store_dir).add_run(run, force=True)
+
+    store = MutationStore(store_dir)
+    assert store.af.shape == (2, 2)
+    assert [(c, round(af, 2), dp) for c, af, dp in store.carriers("A23063T")] == [(0, 0.9, 100), (1, 0.5, 80)]
+    assert [(c, round(af, 2), dp) for c, af, dp in store.carriers("G22578A")] == [(1, 0.7, 60)]
+
+
+def test_shard_past_dictionary_skipped(tmp_path, caplog):
+    store_dir = str(tmp_path / "store")
+    store = MutationStore(store_dir)
+    store.add_run(make_run(tmp_path, "220407", {"22501_S1": [(23063, "A", "T", 0.9, 100)]}))
+    store.add_run(make_run(tmp_path, "220408", {"22601_S1": [(22578, "G", "A", 0.7, 60)]}))
+    store.save()
+    np.savez_compressed(str(tmp_path / "store" / mutations.SHARDS / "220408.npz"), mutation=np.array([5], dtype=np.int32),
+                        sample=np.array([1], dtype=np.int32), af=np.array([0.7], dtype=np.float32),
+                        dp=np.array([60], dtype=np.uint32))
+
+    store = MutationStore(store_dir)
+    assert store.af.nnz == 1
+    assert [(c, round(af, 2), dp) for c, af, dp in store.carriers("A23063T")] == [(0, 0.9, 100)]
+    assert "220408.npz" in caplog.text
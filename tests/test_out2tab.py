@@ -0,0 +1,21 @@
+import os
+
+from covidtools import out2tab
+from lib.mapping import Mapping
+
+OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "output")
+
+
+def test_summary_lines_only(tmp_path, capsys):
+    mapping = tmp_path / "all.sample-mapping.tsv"
+    mapping.write_text("sample_id\tsample_collect_date\twwtp_name\tsite_id\n20900\t3/27/22\tWWTP A\tS01\n")
+    assert out2tab.main(["-m", str(mapping), os.path.join(OUTPUT, "220327.20900_S36.out"),
+                         os.path.join(OUTPUT, "220328.22902_S42.out")]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "20900 : 220327 : S01 : Omicron:0.9999999999847274 : BA.1.1 : 1. : 2.6129820477283925",
+        "22902 : 220328 : 22902 :  :  :  : 3.770005915680017e-11"]
+
+
+def test_file2meta_unmatched_name():
+    m = out2tab.file2meta("/runs/220327/output/summary.out", mapping=Mapping())
+    assert (m['id'], m['date'], m['location']) == ("summary.out", "", "summary.out")
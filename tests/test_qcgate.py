@@ -0,0 +1,37 @@
+from covidtools import qc_gate
+from lib.qcgate import read_decisions
+
+DEPTH = "".join("MN908947.3\t{}\tA\t{}\n".format(i, 10 if i <= 80 else 0) for i in range(1, 101))
+LOW = "".join("MN908947.3\t{}\tA\t{}\n".format(i, 5 if i <= 5 else 0) for i in range(1, 101))
+
+SUMMARY = ("22501 : 220322 : S01 : Omicron:0.99 : BA.2 : 0.99 : 1.2\n"
+           "220322.22501_S53\t80.00\n"
+           "220322.22502_S54\t5.00\n"
+           "220322.22503_S55\t0.00\n")
+
+
+def test_summary_joins_decisions(tmp_path, capsys):
+    (tmp_path / "depth").mkdir()
+    (tmp_path / "depth" / "220322.22501_S53.depth").write_text(DEPTH)
+    (tmp_path / "depth" / "220322.22502_S54.depth").write_text(LOW)
+    for sample in ["220322.22501_S53", "220322.22502_S54", "220322.22504_S56"]:
+        qc_gate.main(["--level", "ERROR", "check", "--sample", sample, "--run-dir", str(tmp_path),
+                      "--min-breadth", "10", "--min-mean-depth", "1"])
+    assert sorted(read_decisions(str(tmp_path))) == ["220322.22501_S53", "220322.22502_S54", "220322.22504_S56"]
+    capsys.readouterr()
+
+    table = tmp_path / "summary.all.tsv"
+    table.write_text(SUMMARY)
+    assert qc_gate.main(["summary", str(tmp_path), "--table", str(table)]) == 0
+    # skipped samples and their reason on stdout
+    assert [l.split("\t")[0] for l in capsys.readouterr().out.splitlines()] == ["220322.22502_S54", "220322.22504_S56"]
+
+    rows = [l.split("\t") for l in table.read_text().splitlines()]
+    assert rows[0] == ["220322.22501_S53", "80.00", "pass", "80", "8", ""]
+    assert rows[1] == ["220322.22502_S54", "5.00", "fail", "5", "0.25",
+                       "breadth 5.00% at depth 3 < 10.0%; mean depth 0.25 < 1.0"]
+    assert rows[2] == ["220322.22503_S55", "0.00", "n/a", "n/a", "n/a", "n/a"]
+    # a gated sample without coverage row gets one
+    assert rows[3][:3] == ["220322.22504_S56", "n/a", "fail"]
+    assert rows[3][5].startswith("no depth")
+    assert rows[4] == ["22501 : 220322 : S01 : Omicron:0.99 : BA.2 : 0.99 : 1.2", "n/a", "n/a", "n/a", "n/a"]
@@ -0,0 +1,209 @@
+#!/bin/bash
+#
+# Test suite for sra-submit.py
+# Uploads a synthetic run to a local directory standing in for the CDC
+# endpoint (file:// URL) and checks dry run, resume and manifest handling
+#
+
+set -e
+
+# Colors for output
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+YELLOW='\033[1;33m'
+NC='\033[0m'
+
+# Test configuration
+TEST_DIR="/tmp/sra_submit_test_$$"
+SCRIPT_DIR="$(cd "$(dirname "$0")/../scripts" && pwd)"
+RUN=${TEST_DIR}/230712
+REMOTE=${TEST_DIR}/endpoint
+SUBMIT="python3 ${SCRIPT_DIR}/sra-submit.py --url file://${REMOTE} --dest /Data/Test --retry-wait 0 --level WARNING"
+
+# Test counters
+TESTS_RUN=0
+TESTS_PASSED=0
+TESTS_FAILED=0
+
+# Helper functions
+pass() {
+    echo -e "${GREEN}✓${NC} $1"
+    TESTS_PASSED=$((TESTS_PASSED + 1))
+}
+
+fail() {
+    echo -e "${RED}✗${NC} $1"
+    TESTS_FAILED=$((TESTS_FAILED + 1))
+}
+
+run_test() {
+    echo -e "\n${YELLOW}TEST:${NC} $1"
+    TESTS_RUN=$((TESTS_RUN + 1))
+}
+
+# Setup: run folder with mapping, templates and 5 fastq pairs of 3MB each
+setup() {
+    mkdir -p ${RUN}/reads ${RUN}/SRA ${REMOTE}/Data/Test
+    printf 'sample_id\tsample_collect_date\twwtp_name\tsite_id\n' > ${RUN}/230712.sample-mapping.tsv
+    for i in 1 2 3 4 5; do
+        printf '2300%d\t7/1/23\tPLANT %d\tS000%d\n' $i $i $i >> ${RUN}/230712.sample-mapping.tsv
+        for r in 1 2; do
+            head -c 3000000 /dev/urandom > ${RUN}/reads/2300${i}_S${i}_L001_R${r}_001.fastq.gz
+        done
+    done
+    # sample without reads
+    printf '23009\t7/1/23\tPLANT 9\tS0009\n' >> ${RUN}/230712.sample-mapping.tsv
+    printf 'library_ID\ttitle\tfilename\tfilename2\n\tWastewater {site_id} {sample_collect_date}\t\t\n' > ${RUN}/SRA/230712.run.tmpl.tsv
+    printf 'sample_name\tcollected_by\tgeo_loc_name\nIL-{sample_id}\tIDPH\tUSA: Illinois\n' > ${RUN}/SRA/230712.biosample.tmpl.tsv
+}
+
+# Cleanup
+cleanup() {
+    cd /
+    rm -rf ${TEST_DIR}
+}
+
+remote_count() {
+    find ${REMOTE}/Data/Test/230712 -type f 2>/dev/null | wc -l
+}
+
+# Test 1: dry run lists files and touches nothing
+test_dry_run() {
+    run_test "Dry run lists uploads without writing"
+
+    output=$(${SUBMIT} ${RUN} --dry-run)
+    uploads=$(echo "${output}" | grep -c "^upload")
+    if [ "${uploads}" -eq 12 ] && [ "$(remote_count)" -eq 0 ] && [ ! -f ${RUN}/SRA/230712.run.tsv ]; then
+        pass "12 uploads listed (10 fastq, 2 metadata), nothing written"
+    else
+        fail "Dry run listed ${uploads} uploads, $(remote_count) remote files"
+    fi
+}
+
+# Test 2: parallel upload to the stand-in
+test_upload() {
+    run_test "Upload over parallel connections"
+
+    ${SUBMIT} ${RUN} --connections 4
+    if [ "$(remote_count)" -eq 12 ]; then
+        pass "All fastq and metadata files uploaded"
+    else
+        fail "Expected 12 remote files, found $(remote_count)"
+    fi
+
+    ok=1
+    for f in ${RUN}/reads/*.fastq.gz; do
+        cmp -s $f ${REMOTE}/Data/Test/230712/`basename $f` || ok=0
+    done
+    if [ $ok -eq 1 ] && [ "$(tail -n +2 ${RUN}/SRA/upload.manifest.tsv | wc -l)" -eq 12 ]; then
+        pass "Remote copies identical, manifest complete"
+    else
+        fail "Remote copies differ or manifest incomplete"
+    fi
+
+    if grep -q "Wastewater S0003 7/1/23" ${REMOTE}/Data/Test/230712/230712.run.tsv \
+        && grep -q "23003_S3_L001_R2_001.fastq.gz" ${REMOTE}/Data/Test/230712/230712.run.tsv \
+        && grep -q "^IL-23001	IDPH" ${REMOTE}/Data/Test/230712/230712.biosample.tsv; then
+        pass "Metadata rows filled from mapping and file names"
+    else
+        fail "Metadata rows not filled"
+    fi
+}
+
+# Test 3: completed files are not sent again
+test_no_resend() {
+    run_test "Re-run skips completed files"
+
+    before=$(stat -c %Y:%i ${REMOTE}/Data/Test/230712/*)
+    sleep 1
+    output=$(${SUBMIT} ${RUN} --dry-run)
+    ${SUBMIT} ${RUN}
+    after=$(stat -c %Y:%i ${REMOTE}/Data/Test/230712/*)
+    if ! echo "${output}" | grep -q "^upload" && [ "${before}" == "${after}" ]; then
+        pass "Nothing planned, remote files untouched"
+    else
+        fail "Completed files were sent again"
+    fi
+}
+
+# Test 4: an interrupted transfer resumes from the partial file
+test_resume() {
+    run_test "Interrupted upload resumes"
+
+    name=23002_S2_L001_R1_001.fastq.gz
+    rm ${REMOTE}/Data/Test/230712/${name}
+    head -c 1000000 ${RUN}/reads/${name} > ${REMOTE}/Data/Test/230712/${name}.part
+    grep -v "^230712/${name}" ${RUN}/SRA/upload.manifest.tsv > ${TEST_DIR}/manifest.tsv
+    mv ${TEST_DIR}/manifest.tsv ${RUN}/SRA/upload.manifest.tsv
+
+    output=$(${SUBMIT} ${RUN} --level INFO 2>&1)
+    if echo "${output}" | grep -q "uploaded 1 (resumed 1)" \
+        && echo "${output}" | grep -q "2000000 bytes" \
+        && cmp -s ${RUN}/reads/${name} ${REMOTE}/Data/Test/230712/${name} \
+        && [ ! -f ${REMOTE}/Data/Test/230712/${name}.part ]; then
+        pass "Only the missing 2MB sent, file complete"
+    else
+        fail "Resume failed: ${output}"
+    fi
+}
+
+# Test 5: failed fastq uploads hold back the metadata
+test_failure() {
+    run_test "Failed upload holds back metadata"
+
+    name=23004_S4_L001_R2_001.fastq.gz
+    rm ${REMOTE}/Data/Test/230712/${name} ${REMOTE}/Data/Test/230712/230712.run.tsv
+    grep -v "^230712/${name}\|230712.run.tsv" ${RUN}/SRA/upload.manifest.tsv > ${TEST_DIR}/manifest.tsv
+    mv ${TEST_DIR}/manifest.tsv ${RUN}/SRA/upload.manifest.tsv
+    mkdir ${REMOTE}/Data/Test/230712/${name}.part
+
+    if ! ${SUBMIT} ${RUN} --retries 1 2>/dev/null && [ ! -f ${REMOTE}/Data/Test/230712/230712.run.tsv ]; then
+        pass "Exit status 1, RUN file not sent"
+    else
+        fail "Metadata sent although a fastq failed"
+    fi
+
+    rmdir ${REMOTE}/Data/Test/230712/${name}.part
+    if ${SUBMIT} ${RUN} && [ -f ${REMOTE}/Data/Test/230712/230712.run.tsv ]; then
+        pass "Next run completes the submission"
+    else
+        fail "Submission not completed after the failure cleared"
+    fi
+}
+
+# Main test execution
+main() {
+    echo "========================================="
+    echo "SRA Submission Test Suite"
+    echo "========================================="
+
+    setup
+
+    test_dry_run
+    test_upload
+    test_no_resend
+    test_resume
+    test_failure
+
+    cleanup
+
+    # Summary
+    echo ""
+    echo "========================================="
+    echo "Test Results"
+    echo "========================================="
+    echo "Tests run: ${TESTS_RUN}"
+    echo -e "Tests passed: ${GREEN}${TESTS_PASSED}${NC}"
+    echo -e "Tests failed: ${RED}${TESTS_FAILED}${NC}"
+
+    if [ ${TESTS_FAILED} -eq 0 ]; then
+        echo -e "\n${GREEN}All tests passed!${NC}"
+        exit 0
+    else
+        echo -e "\n${RED}Some tests failed!${NC}"
+        exit 1
+    fi
+}
+
+# Run tests
+main "$@"
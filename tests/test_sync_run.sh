@@ -0,0 +1,229 @@
+#!/bin/bash
+#
+# Test suite for sync-run.py
+# Syncs a synthetic run between two local directories and checks the delta,
+# checksum detection, flattening and permissions; the remote manifest is
+# built through a stand-in for ssh that runs the command locally
+#
+
+set -e
+
+# Colors for output
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+YELLOW='\033[1;33m'
+NC='\033[0m'
+
+# Test configuration
+TEST_DIR="/tmp/sync_run_test_$$"
+SCRIPT_DIR="$(cd "$(dirname "$0")/../scripts" && pwd)"
+SRC=${TEST_DIR}/jim/220407
+DEST=${TEST_DIR}/runs/220407
+SYNC="python3 ${SCRIPT_DIR}/sync-run.py --level WARNING"
+
+# Test counters
+TESTS_RUN=0
+TESTS_PASSED=0
+TESTS_FAILED=0
+
+# Helper functions
+pass() {
+    echo -e "${GREEN}✓${NC} $1"
+    TESTS_PASSED=$((TESTS_PASSED + 1))
+}
+
+fail() {
+    echo -e "${RED}✗${NC} $1"
+    TESTS_FAILED=$((TESTS_FAILED + 1))
+}
+
+run_test() {
+    echo -e "\n${YELLOW}TEST:${NC} $1"
+    TESTS_RUN=$((TESTS_RUN + 1))
+}
+
+# Setup: assembly tree with 6 sorted bams of 1MB, other files that are not pulled, and a fake ssh
+setup() {
+    for i in 1 2 3 4 5 6; do
+        mkdir -p ${SRC}/Assemblies/2200${i}
+        head -c 1000000 /dev/urandom > ${SRC}/Assemblies/2200${i}/2200${i}.sorted.bam
+        echo "contig" > ${SRC}/Assemblies/2200${i}/2200${i}.fasta
+        chmod 644 ${SRC}/Assemblies/2200${i}/2200${i}.sorted.bam
+    done
+    echo "all:" > ${SRC}/Makefile
+    mkdir -p ${DEST}/staging
+    printf '#!/bin/sh\nshift\nexec sh -c "$*"\n' > ${TEST_DIR}/ssh
+    chmod +x ${TEST_DIR}/ssh
+}
+
+# Cleanup
+cleanup() {
+    cd /
+    rm -rf ${TEST_DIR}
+}
+
+# Test 1: dry run against a remote endpoint lists the delta and writes nothing
+test_remote_dry_run() {
+    run_test "Dry run with remote manifest"
+
+    output=$(${SYNC} localhost:${SRC}/ ${DEST} --include "*.sorted.bam" --flatten staging --ssh ${TEST_DIR}/ssh --dry-run)
+    if [ "$(echo "${output}" | grep -c "sorted.bam$")" -eq 6 ] && [ -z "$(ls ${DEST}/staging)" ]; then
+        pass "6 bams listed from the remote manifest, nothing written"
+    else
+        fail "Dry run listed: ${output}"
+    fi
+}
+
+# Test 2: first pull puts the bams flat into staging with group write
+test_pull() {
+    run_test "Pull into a flat directory over parallel streams"
+
+    ${SYNC} ${SRC} ${DEST} --include "*.sorted.bam" --flatten staging --streams 3 --chmod g+w --group $(id -gn)
+    ok=1
+    for f in ${SRC}/Assemblies/*/*.sorted.bam; do
+        cmp -s $f ${DEST}/staging/`basename $f` || ok=0
+    done
+    if [ $ok -eq 1 ] && [ "$(ls ${DEST}/staging | wc -l)" -eq 6 ] && [ ! -d ${DEST}/Assemblies ]; then
+        pass "All bams in staging/, nothing else copied"
+    else
+        fail "Staging incomplete or other files copied"
+    fi
+
+    modes=$(stat -c %a ${DEST}/staging/*.bam | sort -u)
+    if [ "${modes}" == "664" ] && [ "$(stat -c %Y ${DEST}/staging/22001.sorted.bam)" == "$(stat -c %Y ${SRC}/Assemblies/22001/22001.sorted.bam)" ]; then
+        pass "Mode set on write, mtime kept"
+    else
+        fail "Modes ${modes} or mtime not preserved"
+    fi
+}
+
+# Test 3: nothing is sent again
+test_no_resend() {
+    run_test "Re-sync transfers nothing"
+
+    before=$(stat -c %Y:%i ${DEST}/staging/*)
+    output=$(${SYNC} ${SRC} ${DEST} --include "*.sorted.bam" --flatten staging --level INFO 2>&1)
+    after=$(stat -c %Y:%i ${DEST}/staging/*)
+    if echo "${output}" | grep -q "0 of 6 files to transfer" && [ "${before}" == "${after}" ]; then
+        pass "0 of 6 files transferred, destination untouched"
+    else
+        fail "Files were sent again: ${output}"
+    fi
+}
+
+# Test 4: a rewritten file of the same size is found by its checksum, a touched one is not sent
+test_checksum() {
+    run_test "Changed content detected by checksum"
+
+    bam=${SRC}/Assemblies/22003/22003.sorted.bam
+    touched=${SRC}/Assemblies/22004/22004.sorted.bam
+    mtime=$(stat -c %Y ${bam})
+    head -c 1000000 /dev/urandom > ${bam}
+    touch -d @$((mtime + 60)) ${bam} ${touched}
+    output=$(${SYNC} ${SRC} ${DEST} --include "*.sorted.bam" --flatten staging --dry-run)
+    # only the two files whose mtime changed are hashed
+    hashed=$(tail -n +2 ${SRC}/.transfer.manifest.tsv | cut -f 1 | sort | tr '\n' ' ')
+    ${SYNC} ${SRC} ${DEST} --include "*.sorted.bam" --flatten staging
+    if [ "${output}" == "Assemblies/22003/22003.sorted.bam" ] \
+        && [ "${hashed}" == "Assemblies/22003/22003.sorted.bam Assemblies/22004/22004.sorted.bam " ] \
+        && cmp -s ${bam} ${DEST}/staging/22003.sorted.bam; then
+        pass "Only the rewritten bam transferred, only files with a new mtime hashed"
+    else
+        fail "Delta was '${output}', hashed '${hashed}'"
+    fi
+}
+
+# Test 5: push keeps the tree, recorded checksums are right
+test_push() {
+    run_test "Push keeps relative paths"
+
+    ${SYNC} ${DEST} ${TEST_DIR}/remote/220407 --include "*.bam" Makefile --streams 2
+    ${SYNC} ${SRC} ${TEST_DIR}/remote/220407 --include Makefile
+    again=$(${SYNC} ${DEST} ${TEST_DIR}/remote/220407 --include "*.bam" --dry-run)
+    recorded=1
+    while IFS=$'\t' read -r path size mtime md5; do
+        [ "$(md5sum < ${TEST_DIR}/remote/220407/${path} | cut -d ' ' -f 1)" == "${md5}" ] || recorded=0
+    done < <(tail -n +2 ${TEST_DIR}/remote/220407/.transfer.manifest.tsv 2>/dev/null)
+    if [ "$(ls ${TEST_DIR}/remote/220407/staging | wc -l)" -eq 6 ] && [ -f ${TEST_DIR}/remote/220407/Makefile ] \
+        && [ -z "${again}" ] && [ ${recorded} -eq 1 ] \
+        && [ -z "$(find ${TEST_DIR}/remote -name "*.part")" ]; then
+        pass "Tree copied, nothing sent again, recorded checksums match, no partial files left"
+    else
+        fail "Push incomplete"
+    fi
+}
+
+# Test 6: files of a remote endpoint are hashed over ssh when their mtime changed
+test_remote_checksum() {
+    run_test "Remote checksums for touched files"
+
+    touch -d @$(($(stat -c %Y ${SRC}/Assemblies/22005/22005.sorted.bam) + 120)) ${SRC}/Assemblies/22005/22005.sorted.bam
+    output=$(${SYNC} localhost:${SRC}/ ${DEST} --include "*.sorted.bam" --flatten staging --ssh ${TEST_DIR}/ssh --dry-run)
+    if [ -z "${output}" ] && grep -q "^Assemblies/22005/22005.sorted.bam" ${SRC}/.transfer.manifest.tsv; then
+        pass "Touched file hashed on the remote side and not listed"
+    else
+        fail "Delta was '${output}'"
+    fi
+}
+
+# Test 7: pull from a remote endpoint with rsync over the fake ssh
+test_rsync() {
+    run_test "Pull over rsync"
+
+    if ! command -v rsync > /dev/null; then
+        echo -e "${YELLOW}skipped${NC}, rsync not installed"
+        TESTS_RUN=$((TESTS_RUN - 1))
+        return
+    fi
+    ${SYNC} localhost:${SRC}/ ${TEST_DIR}/rsync --include "*.sorted.bam" --flatten staging --ssh ${TEST_DIR}/ssh \
+        --streams 2 --chmod g+w
+    ok=1
+    for f in ${SRC}/Assemblies/*/*.sorted.bam; do
+        cmp -s $f ${TEST_DIR}/rsync/staging/`basename $f` || ok=0
+    done
+    again=$(${SYNC} localhost:${SRC}/ ${TEST_DIR}/rsync --include "*.sorted.bam" --flatten staging --ssh ${TEST_DIR}/ssh --dry-run)
+    if [ $ok -eq 1 ] && [ -z "${again}" ] && [ "$(stat -c %a ${TEST_DIR}/rsync/staging/*.bam | sort -u)" == "664" ]; then
+        pass "All bams pulled over rsync with mode set, nothing left to send"
+    else
+        fail "rsync pull incomplete"
+    fi
+}
+
+# Main test execution
+main() {
+    echo "========================================="
+    echo "Delta Transfer Test Suite"
+    echo "========================================="
+
+    setup
+
+    test_remote_dry_run
+    test_pull
+    test_no_resend
+    test_checksum
+    test_push
+    test_remote_checksum
+    test_rsync
+
+    cleanup
+
+    # Summary
+    echo ""
+    echo "========================================="
+    echo "Test Results"
+    echo "========================================="
+    echo "Tests run: ${TESTS_RUN}"
+    echo -e "Tests passed: ${GREEN}${TESTS_PASSED}${NC}"
+    echo -e "Tests failed: ${RED}${TESTS_FAILED}${NC}"
+
+    if [ ${TESTS_FAILED} -eq 0 ]; then
+        echo -e "\n${GREEN}All tests passed!${NC}"
+        exit 0
+    else
+        echo -e "\n${RED}Some tests failed!${NC}"
+        exit 1
+    fi
+}
+
+# Run tests
+main "$@"
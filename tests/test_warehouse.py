@@ -0,0 +1,130 @@
+import io
+import json
+
+import pytest
+
+from lib import warehouse
+
+MAPPING = ("sample_id\tsite_id\tsample_collect_date\twwtp_name\n"
+           "22501\tS01\t3/22/22\tWWTP A\n"
+           "20037\tS02\t3/27/22\tWWTP B\n"
+           "\n"
+           "short\tS03\n"
+           "\tS04\t3/28/22\tWWTP C\n"
+           "20900\tS01\t3/27/22\tWWTP A\n")
+
+OUT = ("\tvariants/{name}.variants.tsv\n"
+       "summarized\t[('Omicron', 0.99), ('Other', 0.01)]\n"
+       "lineages\t['BA.2' 'BA.1']\n"
+       "abundances\t[0.6  0.39]\n"
+       "resid\t12.5\n"
+       "coverage\t98.7\n")
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    run = tmp_path / "220327"
+    (run / "output").mkdir(parents=True)
+    (run / "220327.sample-mapping.tsv").write_text(MAPPING)
+    for name in ["220322.22501_S53", "220327.20037_S52"]:
+        (run / "output" / (name + ".out")).write_text(OUT.format(name=name))
+    (run / "coverage.all.txt").write_text("220322.22501_S53\t97.5\n")
+    return run
+
+
+@pytest.fixture
+def conn(run_dir):
+    conn = warehouse.connect(":memory:")
+    warehouse.ingest_run(conn, str(run_dir))
+    yield conn
+    conn.close()
+
+
+def test_read_mapping_skips_blank_and_short_rows(run_dir):
+    header, rows = warehouse.read_mapping(str(run_dir / "220327.sample-mapping.tsv"))
+    assert header == ["sample_id", "site_id", "sample_collect_date", "wwtp_name"]
+    assert [r[0] for r in rows] == ["22501", "20037", "20900"]
+    assert rows[0][:4] == ("22501", "S01", "2022-03-22", "WWTP A")
+    assert json.loads(rows[0][4]) == ["22501", "S01", "3/22/22", "WWTP A"]
+
+
+def test_ingest_run(run_dir):
+    conn = warehouse.connect(":memory:")
+    counts = warehouse.ingest_run(conn, str(run_dir))
+    assert counts['samples'] == 3
+    assert counts['demix'] == 2
+    assert counts['abundances'] == 4
+    assert counts['clades'] == 4
+    assert counts['coverage'] == 1
+    # unchanged runs are skipped
+    assert warehouse.ingest_run(conn, str(run_dir)) is None
+    assert warehouse.ingest_run(conn, str(run_dir), force=True) == counts
+
+
+def test_export_mapping(conn):
+    stream = io.StringIO()
+    assert warehouse.export_mapping(conn, stream, run="220327") == 3
+    lines = [l.split("\t") for l in stream.getvalue().splitlines()]
+    assert lines[0] == ["sample_id", "site_id", "sample_collect_date", "wwtp_name", "coverage"] + \
+        warehouse.SUMMARY_COLUMNS
+    assert lines[1][:5] == ["22501", "S01", "3/22/22", "WWTP A", "97.5"]
+    assert lines[1][5:] == ["{'Omicron': '0.99', 'Other': '0.01'}", "['BA.2', 'BA.1']", "['0.6', '0.39']",
+                            "12.5", "98.7"]
+    assert lines[2][4] == "not found"
+    assert lines[3][4:] == ["not found"] + ["N/A"] * len(warehouse.SUMMARY_COLUMNS)
+
+
+def test_export_mapping_filters(conn):
+    stream = io.StringIO()
+    assert warehouse.export_mapping(conn, stream, sites=["S01"]) == 2
+    assert [l.split("\t")[0] for l in stream.getvalue().splitlines()[1:]] == ["22501", "20900"]
+    assert warehouse.export_mapping(conn, io.StringIO(), lineage="BA") == 2
+    assert warehouse.export_mapping(conn, io.StringIO(), since="2022-03-23") == 2
+
+
+def test_export_aggregate(conn):
+    stream = io.StringIO()
+    assert warehouse.export_aggregate(conn, stream) == 2
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "\t".join(warehouse.AGGREGATE_HEADER)
+    assert lines[1].split("\t") == ["220322.22501_S53.out", "[('Omicron', 0.99), ('Other', 0.01)]", "BA.2 BA.1",
+                                    "0.6 0.39", "12.5", "98.7"]
+
+
+def test_export_aggregate_queries(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    stream = io.StringIO()
+    assert warehouse.export_aggregate(conn, stream, sites=["S01"]) == 1
+    conn.set_trace_callback(None)
+    # rows and lineage lists in two queries, not one per row
+    assert len(statements) == 2
+    assert stream.getvalue().splitlines()[1].split("\t")[:4] == ["220322.22501_S53.out",
+                                                                "[('Omicron', 0.99), ('Other', 0.01)]", "BA.2 BA.1",
+                                                                "0.6 0.39"]
+
+
+def test_round_trip(conn, run_dir, tmp_path):
+    """An exported aggregate ingests to the same demix rows"""
+
+    stream = io.StringIO()
+    warehouse.export_aggregate(conn, stream)
+    copy = tmp_path / "copy" / "220327"
+    (copy / "output").mkdir(parents=True)
+    (copy / "220327.sample-mapping.tsv").write_text((run_dir / "220327.sample-mapping.tsv").read_text())
+    for l in stream.getvalue().splitlines()[1:]:
+        file, summarized, lineages, abundances, resid, coverage = l.split("\t")
+        (copy / "output" / file).write_text(
+            "\tvariants/{}.variants.tsv\nsummarized\t{}\nlineages\t{}\nabundances\t{}\nresid\t{}\ncoverage\t{}\n".format(
+                file[:-4], summarized, str(lineages.split()).replace(",", ""), "[" + "  ".join(abundances.split()) + "]",
+                resid, coverage))
+
+    other = warehouse.connect(":memory:")
+    warehouse.ingest_run(other, str(copy))
+    for table in ["demix", "abundances", "clades", "samples"]:
+        query = "SELECT * FROM " + table + " ORDER BY 1, 2, 3"
+        assert other.execute(query).fetchall() == conn.execute(query).fetchall()
+    a, b = io.StringIO(), io.StringIO()
+    warehouse.export_mapping(conn, a)
+    warehouse.export_mapping(other, b)
+    assert a.getvalue().replace("97.5", "not found") == b.getvalue()
@@ -0,0 +1,156 @@
+#!/bin/bash
+#
+# Test suite for watch-runs.py and process-covid-run
+# The watcher runs the real process-covid-run against a stand-in installation
+# (COVID_BASE): config files are empty, stage-reads.py, time-stage.py and
+# timing-report.py are the real tools, assembly.sh and process-run.sh only log
+# their calls. A run left "running" in the state is processed a second time,
+# over the run folder the first pass created
+#
+
+set -e
+
+# Colors for output
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+YELLOW='\033[1;33m'
+NC='\033[0m'
+
+# Test configuration
+TEST_DIR="/tmp/watch_runs_test_$$"
+SCRIPT_DIR="$(cd "$(dirname "$0")/../scripts" && pwd)"
+BASE=${TEST_DIR}/covid
+DROP=${TEST_DIR}/drop
+RUN=${BASE}/runs/220407
+STATE=${TEST_DIR}/watch.state.tsv
+WATCH="python3 ${SCRIPT_DIR}/watch-runs.py --drop-dir ${DROP} --once --poll-only --poll 1 --settle 0
+    --primer qiagen --primer-config ${TEST_DIR}/primers.tsv --command ${SCRIPT_DIR}/process-covid-run
+    --state ${STATE} --log-dir ${TEST_DIR}/logs --level WARNING"
+
+# Test counters
+TESTS_RUN=0
+TESTS_PASSED=0
+TESTS_FAILED=0
+
+# Helper functions
+pass() {
+    echo -e "${GREEN}✓${NC} $1"
+    TESTS_PASSED=$((TESTS_PASSED + 1))
+}
+
+fail() {
+    echo -e "${RED}✗${NC} $1"
+    TESTS_FAILED=$((TESTS_FAILED + 1))
+}
+
+run_test() {
+    echo -e "\n${YELLOW}TEST:${NC} $1"
+    TESTS_RUN=$((TESTS_RUN + 1))
+}
+
+status_of() {
+    grep "^${DROP}/$1	" ${STATE} | cut -f2
+}
+
+# Setup: stand-in installation and one complete run in the drop directory
+setup() {
+    mkdir -p ${BASE}/config ${BASE}/scripts ${BASE}/runs ${DROP}/220407/Fastq
+    touch ${BASE}/config/freyja_latest.sif
+    echo "# Makefile" > ${BASE}/config/Makefile
+    echo ">MN908947.3" > ${BASE}/config/MN908947.3.trimmed.fa
+    for tool in stage-reads.py time-stage.py timing-report.py; do
+        ln -s ${SCRIPT_DIR}/${tool} ${BASE}/scripts/${tool}
+    done
+    for stage in assembly process-run; do
+        echo "echo ${stage} \$1 >> ${TEST_DIR}/executions.log" > ${BASE}/scripts/${stage}.sh
+    done
+    for i in 1 2 3; do
+        echo reads > ${DROP}/220407/Fastq/2200${i}_S${i}_R1_001.fastq.gz
+    done
+    touch ${DROP}/220407/CopyComplete.txt
+    export COVID_BASE=${BASE}
+}
+
+cleanup() {
+    cd /
+    rm -rf ${TEST_DIR}
+}
+
+# Test 1: a new run is set up and processed
+test_first_pass() {
+    run_test "Run processed"
+
+    ${WATCH}
+    if [ "$(status_of 220407)" == "done" ] && [ "$(ls ${RUN}/samples | wc -l)" -eq 3 ] \
+        && [ "$(readlink ${RUN}/reads)" == "samples" ] && [ -f ${RUN}/Makefile ] \
+        && [ "$(grep -c '^process-run ' ${TEST_DIR}/executions.log)" -eq 1 ]; then
+        pass "Status done, reads staged, run folder set up"
+    else
+        fail "Status $(status_of 220407), log: $(tail -5 ${TEST_DIR}/logs/220407.log)"
+    fi
+}
+
+# Test 2: a run left running by a stopped watcher is processed again over its run folder
+test_requeued() {
+    run_test "Interrupted run requeued"
+
+    sed -i "s|	done	|	running	|" ${STATE}
+    echo "# edited for this run" >> ${RUN}/Makefile
+    ${WATCH} 2> ${TEST_DIR}/watch.err
+    if [ "$(status_of 220407)" == "done" ] && grep -q "queueing it again" ${TEST_DIR}/watch.err \
+        && grep -q "exists, resuming" ${TEST_DIR}/logs/220407.log \
+        && [ "$(grep -c '^process-run ' ${TEST_DIR}/executions.log)" -eq 2 ] \
+        && grep -q "edited for this run" ${RUN}/Makefile && [ "$(readlink ${RUN}/reads)" == "samples" ] \
+        && [ ! -e ${RUN}/samples/samples ] && [ "$(ls ${RUN}/samples | wc -l)" -eq 3 ]; then
+        pass "Second pass done, Makefile and reads link of the first pass kept"
+    else
+        fail "Status $(status_of 220407), log: $(tail -5 ${TEST_DIR}/logs/220407.log)"
+    fi
+}
+
+# Test 3: finished runs are not processed again
+test_done_skipped() {
+    run_test "Finished run skipped"
+
+    ${WATCH}
+    if [ "$(grep -c '^process-run ' ${TEST_DIR}/executions.log)" -eq 2 ]; then
+        pass "Nothing run for a run already done"
+    else
+        fail "process-run.sh ran $(grep -c '^process-run ' ${TEST_DIR}/executions.log) times"
+    fi
+}
+
+# Main test execution
+main() {
+    echo "========================================="
+    echo "Watch Runs Test Suite"
+    echo "========================================="
+
+    setup
+
+    test_first_pass
+    test_requeued
+    test_done_skipped
+
+    cleanup
+
+    # Summary
+    echo ""
+    echo "========================================="
+    echo "Test Results"
+    echo "========================================="
+    echo "Tests run: ${TESTS_RUN}"
+    echo -e "Tests passed: ${GREEN}${TESTS_PASSED}${NC}"
+    echo -e "Tests failed: ${RED}${TESTS_FAILED}${NC}"
+
+    if [ ${TESTS_FAILED} -eq 0 ]; then
+        echo -e "\n${GREEN}All tests passed!${NC}"
+        exit 0
+    else
+        echo -e "\n${RED}Some tests failed!${NC}"
+        exit 1
+    fi
+}
+
+# Run tests
+main "$@"
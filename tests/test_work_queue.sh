@@ -0,0 +1,210 @@
+#!/bin/bash
+#
+# Test suite for work-queue.py
+# Several local worker processes share the queue of a synthetic run; the job
+# command is a stand-in for make that writes variants/, depth/ and output/
+# files and logs every execution, so double runs and lost results show up
+#
+
+set -e
+
+# Colors for output
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+YELLOW='\033[1;33m'
+NC='\033[0m'
+
+# Test configuration
+TEST_DIR="/tmp/work_queue_test_$$"
+SCRIPT_DIR="$(cd "$(dirname "$0")/../scripts" && pwd)"
+RUN=${TEST_DIR}/runs/220407
+QUEUE="python3 ${SCRIPT_DIR}/work-queue.py --level WARNING"
+JOB="sh ${TEST_DIR}/job.sh {sample}"
+
+# Test counters
+TESTS_RUN=0
+TESTS_PASSED=0
+TESTS_FAILED=0
+
+# Helper functions
+pass() {
+    echo -e "${GREEN}✓${NC} $1"
+    TESTS_PASSED=$((TESTS_PASSED + 1))
+}
+
+fail() {
+    echo -e "${RED}✗${NC} $1"
+    TESTS_FAILED=$((TESTS_FAILED + 1))
+}
+
+run_test() {
+    echo -e "\n${YELLOW}TEST:${NC} $1"
+    TESTS_RUN=$((TESTS_RUN + 1))
+}
+
+count_events() {
+    grep -c "\"event\": \"$1\"" ${RUN}/queue/events.jsonl || true
+}
+
+# Setup: run with 12 bams, one sample already demixed, and the stand-in job.
+# Samples named slow* sleep 30 seconds on their first execution, fail* always fail
+setup() {
+    mkdir -p ${RUN}/bam ${RUN}/variants ${RUN}/depth ${RUN}/output
+    for i in $(seq 1 12); do
+        echo bam > ${RUN}/bam/2200${i}_S${i}.sorted.bam
+    done
+    echo old > ${RUN}/output/22001_S1.out
+    cat > ${TEST_DIR}/job.sh <<'JOB'
+echo "$1 $$" >> executions.log
+case $1 in
+    fail*) exit 2 ;;
+    slow*) if [ ! -f first.$1 ]; then touch first.$1; sleep 30; fi ;;
+    *) sleep 0.2 ;;
+esac
+echo variants > variants/$1.variants.tsv
+echo depth > depth/$1.depth
+echo out > output/$1.out
+JOB
+}
+
+# Cleanup, including jobs orphaned by the killed worker
+cleanup() {
+    pkill -f "${TEST_DIR}/job.sh" || true
+    cd /
+    rm -rf ${TEST_DIR}
+}
+
+# Test 1: only samples without output are queued, and only once
+test_enqueue() {
+    run_test "Enqueue pending samples"
+
+    ${QUEUE} enqueue ${RUN} --command "${JOB}"
+    ${QUEUE} enqueue ${RUN} --command "${JOB}"
+    if [ "$(ls ${RUN}/queue/pending | wc -l)" -eq 11 ] && [ ! -f ${RUN}/queue/pending/22001_S1.job ] \
+        && [ "$(count_events queued)" -eq 11 ]; then
+        pass "11 jobs queued, demixed sample skipped, second enqueue added nothing"
+    else
+        fail "Queue has $(ls ${RUN}/queue/pending | wc -l) jobs"
+    fi
+}
+
+# Test 2: four worker processes, one of them with two workers, drain the queue
+test_parallel_workers() {
+    run_test "Several worker processes share the queue"
+
+    ${QUEUE} work ${RUN} --heartbeat 1 &
+    p1=$!
+    ${QUEUE} work ${RUN} --heartbeat 1 &
+    p2=$!
+    ${QUEUE} work ${RUN} --heartbeat 1 &
+    p3=$!
+    ${QUEUE} work ${RUN} --heartbeat 1 --jobs 2
+    wait $p1 $p2 $p3
+
+    runs=$(cut -d' ' -f1 ${RUN}/executions.log | sort | uniq -d)
+    workers=$(grep '"event": "claimed"' ${RUN}/queue/events.jsonl | sed 's/.*"pid": \([0-9]*\).*/\1/' | sort -u | wc -l)
+    if [ "$(wc -l < ${RUN}/executions.log)" -eq 11 ] && [ -z "${runs}" ] && [ "$(ls ${RUN}/output | wc -l)" -eq 12 ] \
+        && [ "$(ls ${RUN}/variants/*.variants.tsv | wc -l)" -eq 11 ] && [ "$(ls ${RUN}/queue/done | wc -l)" -eq 11 ] \
+        && [ -z "$(find ${RUN}/queue/pending ${RUN}/queue/claimed -type f)" ] && [ ${workers} -gt 1 ]; then
+        pass "Every job ran exactly once, spread over ${workers} processes, results in place"
+    else
+        fail "Executions: $(wc -l < ${RUN}/executions.log), duplicates: ${runs}"
+    fi
+}
+
+# Test 3: the claim of a killed worker is requeued once its heartbeat is stale
+test_dead_worker() {
+    run_test "Dead worker's job requeued"
+
+    ${QUEUE} enqueue ${RUN} slow1 --command "${JOB}"
+    ${QUEUE} work ${RUN} --heartbeat 1 &
+    pid=$!
+    for i in $(seq 1 50); do
+        [ -n "$(ls ${RUN}/queue/claimed)" ] && break
+        sleep 0.1
+    done
+    kill -9 ${pid}
+    wait ${pid} 2>/dev/null || true
+    sleep 1
+    fresh=$(${QUEUE} status ${RUN} --stale 3 | grep -c "^claimed	slow1" || true)
+    ${QUEUE} work ${RUN} --heartbeat 1 --stale 3
+    if [ "${fresh}" -eq 1 ] && [ "$(count_events requeued)" -eq 1 ] && [ -f ${RUN}/queue/done/slow1.job ] \
+        && [ -f ${RUN}/output/slow1.out ] && grep -q '"attempt": 1' ${RUN}/queue/done/slow1.job; then
+        pass "Claim kept while fresh, requeued after 3s without heartbeat and finished"
+    else
+        fail "slow1 not recovered, status: $(${QUEUE} status ${RUN})"
+    fi
+}
+
+# Test 4: a requeued claim is given up by its worker on the next heartbeat
+test_lost_claim() {
+    run_test "Worker stops a job it lost"
+
+    ${QUEUE} enqueue ${RUN} slow2 --command "${JOB}"
+    ${QUEUE} work ${RUN} --heartbeat 1 &
+    pid=$!
+    for i in $(seq 1 50); do
+        [ -n "$(ls ${RUN}/queue/claimed)" ] && break
+        sleep 0.1
+    done
+    requeued=$(${QUEUE} requeue ${RUN} --stale 0)
+    wait ${pid}
+    if [ "${requeued}" == "slow2" ] && [ "$(count_events lost)" -eq 1 ] && [ -f ${RUN}/queue/done/slow2.job ] \
+        && ! pgrep -f "${TEST_DIR}/job.sh slow2" > /dev/null; then
+        pass "Job killed after losing the claim, rerun from the queue"
+    else
+        fail "Lost claim not handled, events: $(count_events lost)"
+    fi
+}
+
+# Test 5: failing jobs are retried, then parked in failed/
+test_failed_job() {
+    run_test "Failed job retried up to max attempts"
+
+    ${QUEUE} enqueue ${RUN} fail1 --command "${JOB}" --max-attempts 2
+    status=0
+    python3 ${SCRIPT_DIR}/work-queue.py --level CRITICAL work ${RUN} --heartbeat 1 || status=$?
+    if [ ${status} -eq 1 ] && [ "$(grep -c '^fail1 ' ${RUN}/executions.log)" -eq 2 ] && [ -f ${RUN}/queue/failed/fail1.job ] \
+        && [ "$(count_events retry)" -eq 1 ] && [ "$(count_events failed)" -eq 1 ]; then
+        pass "Two attempts, job in failed/, worker exit status 1"
+    else
+        fail "Exit status ${status}, attempts $(grep -c '^fail1 ' ${RUN}/executions.log)"
+    fi
+}
+
+# Main test execution
+main() {
+    echo "========================================="
+    echo "Work Queue Test Suite"
+    echo "========================================="
+
+    setup
+
+    test_enqueue
+    test_parallel_workers
+    test_dead_worker
+    test_lost_claim
+    test_failed_job
+
+    cleanup
+
+    # Summary
+    echo ""
+    echo "========================================="
+    echo "Test Results"
+    echo "========================================="
+    echo "Tests run: ${TESTS_RUN}"
+    echo -e "Tests passed: ${GREEN}${TESTS_PASSED}${NC}"
+    echo -e "Tests failed: ${RED}${TESTS_FAILED}${NC}"
+
+    if [ ${TESTS_FAILED} -eq 0 ]; then
+        echo -e "\n${GREEN}All tests passed!${NC}"
+        exit 0
+    else
+        echo -e "\n${RED}Some tests failed!${NC}"
+        exit 1
+    fi
+}
+
+# Run tests
+main "$@"